@@ -1,26 +1,89 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import datetime
 import logging
 from pathlib import Path
+from typing import Iterable, Iterator, List, Mapping, Optional, Sequence
 
 import dotenv
 
-from scraper.common.api.openai import OpenAIApi
+from scraper.common.api import http
+from scraper.common.api.archive import PageArchive
+from scraper.common.api.async_http import close_async_session_pool
+from scraper.common.api.batch import OpenAIBatchApi
+from scraper.common.api.http_cache import HttpCache
+from scraper.common.api.packing import OpenAIPackedApi, PageBatcher
+from scraper.common.api.politeness import HostScheduler
+from scraper.common.api.rate_limits import CompletionScheduler
+from scraper.common.api.sitemap import (
+    load_failed_pages,
+    load_last_run,
+    save_last_run,
+    SitemapDiscovery,
+)
+from scraper.common.api.usage import UsageLedger
+from scraper.common.api.openai import AsyncOpenAIApi, OpenAIApi
 from scraper.common.filters.date_and_time import exclude_old_items
 from scraper.common.logs.config import configure_logging, set_log_level
 from scraper.common.parsers.url import parse_url_list
+from scraper.common.stores.completions import CompletionCache
+from scraper.common.stores.sqlite import SqliteStore
+from scraper.common.text_processors.profiles import SiteProfile
+from scraper.common.text_processors.streaming import CLEANERS, TREE_CLEANER
+from scraper.common.text_processors.html import (
+    AUTO_PARSER,
+    CONTENT_FORMATS,
+    FALLBACK_PARSER,
+    HTML_FORMAT,
+    HTML_PARSERS,
+    set_html_parser,
+)
 from scraper.common.writers.format_selector import SUPPORTED_FORMATS, write_items
-from scraper.events.event import EventList
-from scraper.events.pipeline import fetch_events
+from scraper.events.event import Event, EventList, merge_event_lists
+from scraper.events.pipeline import (
+    fetch_events,
+    fetch_events_async,
+    fetch_events_batch,
+)
 from scraper.events.prompt import EVENT_PROMPT_OVERVIEW
-from scraper.events.sources import EVENT_SOURCES
+from scraper.events.quality import check_event_list
+from scraper.events.sources import EVENT_SOURCES, SITE_PROFILES
+from scraper.events.structured_data import parse_structured_events
 
 TODAY = datetime.date.today()
 # Datetime which is earlier than any legitimate ones we expect to encounter
 EPOCH_START = datetime.date.fromtimestamp(0)
 
 
+async def fetch_events_with_asyncio(
+    api: OpenAIApi[EventList],
+    sources: Sequence[str],
+    concurrency: int,
+    discovery: Optional[SitemapDiscovery],
+    profiles: Mapping[str, SiteProfile],
+    ledger: UsageLedger,
+) -> List[Event]:
+    try:
+        return await fetch_events_async(
+            api=AsyncOpenAIApi(api),
+            sources=sources,
+            concurrency=concurrency,
+            discovery=discovery,
+            profiles=profiles,
+            ledger=ledger,
+        )
+    finally:
+        await close_async_session_pool()
+
+
+def count_events(events: Iterable[Event], ledger: UsageLedger) -> Iterator[Event]:
+    """Count the events found from each source as they're passed on"""
+    for event in events:
+        ledger.record_event(event.scrape_source)
+        yield event
+
+
 def main() -> None:
     output_formats = tuple(SUPPORTED_FORMATS.keys())
     parser = argparse.ArgumentParser(
@@ -65,7 +128,298 @@ def main() -> None:
         type=int,
         default=3,
         help="""
-            Number of parallel workers to use for fetching events.
+            Number of parallel workers to use for extracting events from pages. With
+            --async, this is the number of pages which can be scraped at once.
+        """,
+    )
+    parser.add_argument(
+        "--model",
+        default="gpt-4o-mini",
+        help="OpenAI model used to extract events.",
+    )
+    parser.add_argument(
+        "--escalation-model",
+        action="append",
+        default=[],
+        metavar="MODEL",
+        help="""
+            Stronger model to retry extraction with when the events from the previous
+            model look wrong, e.g. none were found on a page with dates, or some are
+            missing titles or dates. May be given more than once, from the cheapest
+            model to the strongest. Batches submitted with --batch only use --model.
+        """,
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        help="""
+            Budget of prompt and completion tokens for the run. Once it runs low, event
+            pages are no longer extracted, so events only have the details from their
+            listing, and once it runs out, no more listing pages are extracted either.
+        """,
+    )
+    parser.add_argument(
+        "--max-cost",
+        type=float,
+        help="""
+            Budget for the run in US dollars, estimated from the tokens used and each
+            model's price. Works like --max-tokens.
+        """,
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=12000,
+        help="""
+            Pages estimated to be longer than this many tokens after cleaning are split
+            into overlapping chunks which are extracted in parallel. Tokens are
+            estimated as one per 3 characters rather than with the model's tokenizer.
+            Chunks share the limit on completions in flight with other pages, so they
+            don't add to it. Use 0 to never split pages.
+        """,
+    )
+    parser.add_argument(
+        "--fetch-workers",
+        type=int,
+        help="""
+            Number of parallel workers to use for downloading pages, independently of
+            extraction. Defaults to the value of --workers. Ignored with --async.
+        """,
+    )
+    parser.add_argument(
+        "--clean-workers",
+        type=int,
+        default=1,
+        help="""
+            Number of parallel workers to use for cleaning downloaded pages before
+            extraction. Ignored with --async.
+        """,
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_asyncio",
+        action="store_true",
+        help="""
+            Fetch pages using asyncio instead of a pool of threads. This allows many
+            more pages to be fetched at once.
+        """,
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="""
+            Extract events using OpenAI's Batch API, which costs half as much and
+            isn't subject to per-minute rate limits, but can take up to a day. All
+            listing pages are extracted in one batch, then all event pages in another.
+            Suitable for scheduled runs.
+        """,
+    )
+    parser.add_argument(
+        "--batch-poll-interval",
+        type=float,
+        default=60.0,
+        help="Number of seconds to wait between checks on a batch's progress.",
+    )
+    parser.add_argument(
+        "--pack-details",
+        type=int,
+        default=1,
+        metavar="PAGES",
+        help="""
+            Extract up to this many small event pages with each completion, so the
+            prompt and schema are sent once for all of them. Each page waiting to be
+            packed holds up an extract worker, so this can't be more than --workers.
+        """,
+    )
+    parser.add_argument(
+        "--pack-wait",
+        type=float,
+        default=2.0,
+        help="""
+            Maximum number of seconds an event page waits for others to be packed with
+            it before it's extracted anyway.
+        """,
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="""
+            Stream the events on each listing page as they're generated, so their
+            event pages are fetched while the rest of the listing is still being
+            extracted. Listings are extracted without streaming when using
+            --escalation-model, --record or --replay, or when they're split into
+            chunks.
+        """,
+    )
+    parser.add_argument(
+        "--no-adaptive-concurrency",
+        action="store_true",
+        help="""
+            Send completions as fast as the workers allow, leaving the OpenAI client to
+            retry any which are rate limited. By default, the number of completions in
+            flight starts at --workers and adapts to the rate limits reported by the
+            API, so that we stay just under them.
+        """,
+    )
+    parser.add_argument(
+        "--host-rate",
+        type=float,
+        default=1.0,
+        help="""
+            Maximum number of page requests per second to send to any one host. Hosts
+            which specify a Crawl-delay in their robots.txt may be limited further.
+            Requests to APIs aren't limited by this.
+        """,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="""
+            Directory in which to cache fetched pages between runs. When a page is
+            fetched again, the server is asked to only send it if it has changed.
+            Events extracted from listing pages which haven't changed are reused,
+            and completions for pages whose cleaned content is unchanged are reused
+            from the completion cache, whether pages are scraped with threads, --async or --batch. If not
+            specified, no cache is used.
+        """,
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=500,
+        help="""
+            Maximum size of the page cache in megabytes. When exceeded, the least
+            recently used pages are evicted.
+        """,
+    )
+    parser.add_argument(
+        "--completion-cache-ttl",
+        type=float,
+        default=30.0,
+        help="""
+            Number of days to keep completions in the cache in --cache-dir. Pages
+            whose cleaned content was extracted in the meantime with the same model,
+            prompt and schema reuse the cached completion instead of calling the API.
+        """,
+    )
+    parser.add_argument(
+        "--completion-cache-entries",
+        type=int,
+        default=20000,
+        help="""
+            Maximum number of completions to keep in the cache in --cache-dir. When
+            exceeded, the least recently used completions are evicted.
+        """,
+    )
+    parser.add_argument(
+        "--sitemaps",
+        action="store_true",
+        help="""
+            Check each source's sitemaps and skip fetching event pages which haven't
+            changed since the last successful run, keeping their events as listed.
+            Requires --cache-dir, where the time of the last run is stored along
+            with the pages it failed to fetch, which are always fetched again. Only
+            runs over the default sources which finish within their budget count.
+        """,
+    )
+    parser.add_argument(
+        "--max-page-size",
+        type=int,
+        default=5,
+        help="""
+            Maximum size of a page to download in megabytes. Larger pages are
+            truncated to this size.
+        """,
+    )
+    parser.add_argument(
+        "--run-report",
+        type=Path,
+        default=Path("run_report.json"),
+        help="""
+            File where a JSON report of how long requests to each host and source took
+            is written at the end of the run.
+        """,
+    )
+    parser.add_argument(
+        "--html-parser",
+        choices=[AUTO_PARSER, *HTML_PARSERS],
+        default=FALLBACK_PARSER,
+        help="""
+            Parser used to clean pages before extraction. lxml and html5-parser are
+            faster, but aren't requirements, and their output can differ slightly.
+            With auto, the fastest installed parser is used. If the chosen parser
+            isn't installed or fails, html.parser is used instead.
+        """,
+    )
+    parser.add_argument(
+        "--content-format",
+        choices=CONTENT_FORMATS,
+        default=HTML_FORMAT,
+        help="""
+            Format to convert cleaned pages to before extraction. Markdown keeps
+            headings, lists, links and dates but uses far fewer tokens than HTML.
+        """,
+    )
+    parser.add_argument(
+        "--source-format",
+        action="append",
+        default=[],
+        metavar="HOST=FORMAT",
+        help="""
+            Use a different content format for pages from the given host, e.g.
+            cigionline.org=markdown. May be given more than once.
+        """,
+    )
+    parser.add_argument(
+        "--no-structured-data",
+        action="store_true",
+        help="""
+            Always use the model to extract events, even from pages which describe
+            their events with schema.org JSON-LD or microdata.
+        """,
+    )
+    parser.add_argument(
+        "--cleaner",
+        choices=CLEANERS,
+        default=TREE_CLEANER,
+        help="""
+            How to clean pages before sending them to the model. The streaming
+            cleaner produces the same output as the tree cleaner with html.parser,
+            but never builds a tree of the whole page, which is several times the
+            size of the page itself. Pages are still downloaded in full first.
+            Pages from sites with a profile are always cleaned with the tree cleaner.
+        """,
+    )
+    parser.add_argument(
+        "--no-site-profiles",
+        action="store_true",
+        help="""
+            Send the whole body of every page to the model, instead of only the parts
+            selected by the site's profile in sources.py. Detail pages are fetched for
+            every site as well.
+        """,
+    )
+    archive_group = parser.add_mutually_exclusive_group()
+    archive_group.add_argument(
+        "--record",
+        type=Path,
+        metavar="DIR",
+        help="""
+            Save every page fetched and every completion returned by the API to a
+            compressed archive in this directory, so the run can be replayed later.
+            Completions and events cached in --cache-dir aren't reused, so that every
+            page is extracted and recorded.
+        """,
+    )
+    archive_group.add_argument(
+        "--replay",
+        type=Path,
+        metavar="DIR",
+        help="""
+            Load pages from an archive created with --record instead of fetching them.
+            Completions are also loaded from the archive, unless the prompt, schema or
+            model have changed, in which case they're requested from the API and added
+            to the archive.
         """,
     )
     parser.add_argument(
@@ -77,11 +431,78 @@ def main() -> None:
         """,
     )
     args = parser.parse_args()
+    if args.sitemaps and not args.cache_dir:
+        parser.error("--sitemaps requires --cache-dir")
+    if args.batch and (args.use_asyncio or args.record or args.replay):
+        parser.error("--batch can't be used with --async, --record or --replay")
+    if args.pack_details > 1 and (
+        args.batch or args.use_asyncio or args.record or args.replay
+    ):
+        parser.error(
+            "--pack-details can't be used with --batch, --async, --record or --replay"
+        )
+    if args.stream and (args.batch or args.use_asyncio):
+        parser.error("--stream can't be used with --batch or --async")
+    if args.batch and (args.max_tokens is not None or args.max_cost is not None):
+        parser.error("--batch can't be used with --max-tokens or --max-cost")
+    if args.pack_details > args.workers:
+        parser.error("--pack-details can't be more than --workers")
+    source_formats = {}
+    for source_format in args.source_format:
+        host, _, content_format = source_format.partition("=")
+        if content_format not in CONTENT_FORMATS:
+            parser.error(f"Invalid --source-format: {source_format}")
+        source_formats[host.lower().removeprefix("www.")] = content_format
+    profiles = {} if args.no_site_profiles else SITE_PROFILES
 
     configure_logging()
     set_log_level()
     logger = logging.getLogger(__name__)
 
+    http.set_host_scheduler(
+        HostScheduler(
+            requests_per_second=args.host_rate,
+            robots_fetcher=http.fetch_robots_txt,
+        )
+    )
+    set_html_parser(args.html_parser)
+    http.set_max_response_bytes(args.max_page_size * 1024 * 1024)
+    http_cache = None
+    if args.cache_dir:
+        http_cache = HttpCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+        http.set_http_cache(http_cache)
+    archive = None
+    if args.record or args.replay:
+        archive = PageArchive(args.record or args.replay, replay=bool(args.replay))
+        http.set_page_archive(archive)
+    discovery = None
+    if args.sitemaps:
+        discovery = SitemapDiscovery(
+            last_run=load_last_run(args.cache_dir),
+            failed=load_failed_pages(args.cache_dir),
+        )
+    run_started = datetime.datetime.now(datetime.timezone.utc)
+    api = None
+    completion_cache = None
+    detail_batcher = None
+    ledger = UsageLedger(max_tokens=args.max_tokens, max_cost=args.max_cost)
+    scheduler = None
+    # Batches aren't subject to the per-minute rate limits
+    if not args.no_adaptive_concurrency and not args.batch:
+        scheduler = CompletionScheduler(initial=args.workers)
+    # Replayed runs should extract from the archive, not from earlier runs, and
+    # recorded runs need every completion in the archive, so they can't reuse any
+    reuse_extractions = args.cache_dir and not (args.replay or args.record)
+    if reuse_extractions:
+        completion_cache = CompletionCache(
+            SqliteStore(
+                args.cache_dir / "completions.sqlite3",
+                table="completions",
+                ttl=args.completion_cache_ttl * 24 * 60 * 60,
+                max_entries=args.completion_cache_entries,
+            )
+        )
+
     try:
         if not args.no_dot_env:
             if not dotenv.load_dotenv():
@@ -91,12 +512,64 @@ def main() -> None:
                 )
 
         api = OpenAIApi[EventList](
-            model="gpt-4o-mini",
+            model=args.model,
             prompt=EVENT_PROMPT_OVERVIEW,
             response_format=EventList,
+            archive=archive,
+            chunk_tokens=args.chunk_tokens or None,
+            merge=merge_event_lists,
+            content_format=args.content_format,
+            source_formats=source_formats,
+            profiles=profiles,
+            cleaner=args.cleaner,
+            structured_extractor=(
+                None if args.no_structured_data else parse_structured_events
+            ),
+            scheduler=scheduler,
+            completion_cache=completion_cache,
+            escalation_models=args.escalation_model,
+            quality_check=check_event_list,
+            ledger=ledger,
+            stream_field="events" if args.stream else None,
+            # The scheduler limits completions itself, adapting to the rate limits
+            max_completions=None if scheduler else args.workers,
         )
+        if args.pack_details > 1:
+            detail_batcher = PageBatcher(
+                OpenAIPackedApi(api),
+                max_pages=args.pack_details,
+                max_wait=args.pack_wait,
+            )
         event_sources = parse_url_list(args.sources or EVENT_SOURCES)
-        events = fetch_events(api=api, sources=event_sources, workers=args.workers)
+        events: Iterable[Event]
+        if args.batch:
+            events = fetch_events_batch(
+                api=api,
+                batch_api=OpenAIBatchApi(api, poll_interval=args.batch_poll_interval),
+                sources=event_sources,
+                workers=args.fetch_workers or args.workers,
+                discovery=discovery,
+                profiles=profiles,
+            )
+        elif args.use_asyncio:
+            events = asyncio.run(
+                fetch_events_with_asyncio(
+                    api, event_sources, args.workers, discovery, profiles, ledger
+                )
+            )
+        else:
+            events = fetch_events(
+                api=api,
+                sources=event_sources,
+                workers=args.workers,
+                discovery=discovery,
+                fetch_workers=args.fetch_workers,
+                clean_workers=args.clean_workers,
+                profiles=profiles,
+                detail_batcher=detail_batcher,
+                ledger=ledger,
+            )
+        events = count_events(events, ledger)
         events = exclude_old_items(
             events,
             cutoff=args.after,
@@ -106,9 +579,44 @@ def main() -> None:
             items=events,
             output_path=args.output_path,
         )
+        # Only a complete run over the usual sources tells us every page it would
+        # skip next time has been scraped. A replayed run doesn't tell us anything new
+        # about the pages. Pages which failed to fetch are retried next time
+        # regardless of their lastmod.
+        if (
+            args.cache_dir
+            and not args.replay
+            and not args.sources
+            and not ledger.exhausted
+        ):
+            failed = http.REQUEST_TIMINGS.failed_urls("GET")
+            save_last_run(args.cache_dir, run_started, failed)
     except Exception as e:
         logger.exception("Unhandled exception: %r", e)
         raise
+    finally:
+        http.SESSION_POOL.log_connection_stats()
+        http.HOST_SCHEDULER.log_stats()
+        http.DOWNLOAD_STATS.log_stats()
+        http.REQUEST_TIMINGS.write_report(args.run_report)
+        if http_cache:
+            http_cache.log_stats()
+        if discovery:
+            discovery.log_stats()
+        if archive:
+            archive.log_stats()
+        if api:
+            api.content_stats.log_stats()
+            if api.escalation_models:
+                api.cascade_stats.log_stats()
+        ledger.log_stats()
+        if scheduler:
+            scheduler.log_stats()
+        if detail_batcher:
+            detail_batcher.log_stats()
+        if completion_cache:
+            completion_cache.log_stats()
+            completion_cache.store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+# File in the archive directory which maps URLs and completion keys to blobs
+INDEX_FILE = "index.jsonl"
+
+
+@dataclass
+class ArchivedPage:
+    url: str
+    body: bytes
+    content_type: Optional[str]
+    encoding: Optional[str]
+
+
+@dataclass
+class ArchivedCompletion:
+    """A recorded completion, which is None if the model didn't return anything usable"""
+
+    content: Optional[str]
+
+
+def completion_key(
+    model: str, prompt: str, schema: Dict[str, Any], content: str
+) -> str:
+    """Identify a completion by everything which affects its result"""
+    key = json.dumps(
+        {"model": model, "prompt": prompt, "schema": schema, "content": content},
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class PageArchive:
+    """Compressed, content-addressed archive of fetched pages and LLM completions
+
+    Each page body or completion is gzipped and stored in a blob named after the hash
+    of its contents, so identical pages are only stored once. An append-only index
+    maps each URL or completion key to its blob. If a URL is recorded more than once,
+    the latest copy wins.
+
+    When recording, every page fetched with http.get() and every completion is added
+    to the archive. When replaying, pages are served from the archive without
+    touching the network, and pages which weren't recorded are treated as failed
+    requests. Completions are served from the archive when the model, prompt, schema
+    and content all match. Otherwise they're requested from the API as usual and added
+    to the archive, so extraction can be re-run after changing the prompt.
+    """
+
+    def __init__(self, directory: Path, replay: bool = False) -> None:
+        self.directory = directory
+        self.replay = replay
+        self.lock = threading.Lock()
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        self.completions: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_path = self.directory / INDEX_FILE
+        if index_path.exists():
+            with open(index_path, encoding="utf-8") as file:
+                for line in file:
+                    self.load_record(line)
+
+    def load_record(self, line: str) -> None:
+        logger = logging.getLogger(__name__)
+        try:
+            record = json.loads(line)
+            kind = record["kind"]
+            key = record["key"]
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Skipping invalid archive record: %r", line)
+            return
+        if kind == "page":
+            self.pages[key] = record
+        elif kind == "completion":
+            self.completions[key] = record
+
+    def blob_path(self, digest: str) -> Path:
+        return self.directory / "blobs" / digest[:2] / f"{digest}.gz"
+
+    def write_blob(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so that a blob is never half-written
+            temp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            # Fix the timestamp so that identical content gives identical files
+            temp_path.write_bytes(gzip.compress(content, mtime=0))
+            os.replace(temp_path, path)
+        return digest
+
+    def read_blob(self, digest: str) -> Optional[bytes]:
+        logger = logging.getLogger(__name__)
+        try:
+            return gzip.decompress(self.blob_path(digest).read_bytes())
+        except (OSError, EOFError) as error:
+            logger.warning("Failed to read archived blob %s: %r", digest, error)
+            return None
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Add a record to the index. Caller must hold the lock."""
+        with open(self.directory / INDEX_FILE, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+    def store_page(
+        self,
+        url: str,
+        body: bytes,
+        content_type: Optional[str],
+        encoding: Optional[str],
+    ) -> None:
+        record = {
+            "kind": "page",
+            "key": url,
+            "blob": self.write_blob(body),
+            "content_type": content_type,
+            "encoding": encoding,
+        }
+        with self.lock:
+            self.pages[url] = record
+            self.append(record)
+
+    def load_page(self, url: str) -> Optional[ArchivedPage]:
+        logger = logging.getLogger(__name__)
+        with self.lock:
+            record = self.pages.get(url)
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if record is None:
+            logger.warning("Page not found in archive: %s", url)
+            return None
+        body = self.read_blob(record["blob"])
+        if body is None:
+            return None
+        return ArchivedPage(
+            url=url,
+            body=body,
+            content_type=record.get("content_type"),
+            encoding=record.get("encoding"),
+        )
+
+    def iter_pages(self) -> Iterator[ArchivedPage]:
+        """Load every page in the archive, e.g. to use as a benchmark corpus"""
+        with self.lock:
+            urls = list(self.pages)
+        for url in urls:
+            page = self.load_page(url)
+            if page is not None:
+                yield page
+
+    def store_completion(self, key: str, url: str, content: Optional[str]) -> None:
+        record = {
+            "kind": "completion",
+            "key": key,
+            "url": url,
+            "blob": None if content is None else self.write_blob(content.encode()),
+        }
+        with self.lock:
+            self.completions[key] = record
+            self.append(record)
+
+    def load_completion(self, key: str) -> Optional[ArchivedCompletion]:
+        with self.lock:
+            record = self.completions.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if record["blob"] is None:
+            return ArchivedCompletion(content=None)
+        content = self.read_blob(record["blob"])
+        if content is None:
+            return None
+        return ArchivedCompletion(content=content.decode())
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "Page archive: %d pages, %d completions, %d hits, %d misses",
+            len(self.pages),
+            len(self.completions),
+            self.hits,
+            self.misses,
+        )
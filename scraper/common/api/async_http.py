@@ -0,0 +1,358 @@
+import asyncio
+import importlib.util
+import logging
+import time
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, Optional, Sequence
+from urllib.parse import urlparse
+
+import httpx
+from tenacity import retry, retry_if_exception_type, stop_after_attempt
+
+from . import http
+from .archive import PageArchive
+from .download import (
+    BodyBuffer,
+    CHUNK_SIZE,
+    DownloadLimits,
+    HTML_CONTENT_TYPES,
+    TRUNCATED_HEADER,
+)
+from .timing import current_timing
+from .http import (
+    archive_response,
+    check_error_status,
+    HttpRetryableError,
+    is_not_modified,
+    load_unmodified_body,
+    MAX_CONNECTIONS_PER_HOST,
+    pause_host_before_sleep,
+    revalidation_headers,
+    store_response,
+    wait_retry_after,
+)
+
+# HTTP/2 support requires the optional h2 package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+# Maximum number of connections open at once across all hosts
+MAX_CONNECTIONS = 200
+# Timeout for each request, in seconds
+TIMEOUT = 30.0
+
+RETRYABLE_ERRORS = (
+    HttpRetryableError,
+    httpx.TransportError,
+    TimeoutError,
+)
+
+
+# Events reported by httpcore while opening a new connection
+CONNECT_EVENTS = ("connection.connect_tcp", "connection.start_tls")
+
+
+async def trace_connect(event: str, info: Dict[str, Any]) -> None:
+    """Add the time taken to open new connections to the current request's timing"""
+    name, _, stage = event.rpartition(".")
+    if name not in CONNECT_EVENTS:
+        return
+    timing = current_timing()
+    if timing is None:
+        return
+    # Subtract the start time and add the end time to accumulate the duration
+    if stage == "started":
+        timing.connect -= time.perf_counter()
+    elif stage in ("complete", "failed"):
+        timing.connect += time.perf_counter()
+
+
+class AsyncSessionPool:
+    """Pool of connections for making HTTP requests from a single event loop
+
+    Connections are kept alive between requests and, if h2 is installed, requests to
+    the same host are multiplexed over HTTP/2. The number of requests in flight to
+    each host is limited in the same way as the synchronous SessionPool.
+    """
+
+    def __init__(
+        self,
+        max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+        max_connections: int = MAX_CONNECTIONS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=max_connections),
+            timeout=TIMEOUT,
+            follow_redirects=True,
+            transport=transport,
+        )
+        self.host_limits: DefaultDict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(max_connections_per_host)
+        )
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        limits: Optional[DownloadLimits] = None,
+        **kwargs: Any,
+    ) -> Optional[httpx.Response]:
+        """Send a request, reading the body within the given limits if any
+
+        Return None if the limits rejected the response.
+        """
+        async with self.host_limits[urlparse(url).netloc]:
+            request = self.client.build_request(
+                method,
+                url,
+                extensions={"trace": trace_connect},
+                **kwargs,
+            )
+            timing = current_timing()
+            connected = timing.connect if timing is not None else 0.0
+            sent = time.perf_counter()
+            # Always stream, so that reading the body is timed apart from waiting
+            response = await self.client.send(request, stream=True)
+            if timing is not None:
+                # Any new connection was opened during the request and timed already
+                waiting = time.perf_counter() - sent - (timing.connect - connected)
+                timing.first_byte += waiting
+                timing.status = response.status_code
+            if limits is None:
+                await read_whole_async_body(response)
+                return response
+            try:
+                return await read_async_body(url, response, limits)
+            finally:
+                await response.aclose()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+async def read_async_body(
+    url: str,
+    response: httpx.Response,
+    limits: DownloadLimits,
+) -> Optional[httpx.Response]:
+    """Asynchronous equivalent of http.read_body()"""
+    if not response.is_success:
+        # Error pages are needed in full to check whether to retry, and 304 Not
+        # Modified responses have no body
+        await response.aread()
+        return response
+    content_type = response.headers.get("Content-Type")
+    if not limits.accepts(content_type):
+        http.DOWNLOAD_STATS.record_rejected(url, content_type)
+        return None
+
+    start = time.perf_counter()
+    body = BodyBuffer(limits.max_bytes)
+    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+        if not body.add(chunk):
+            break
+    http.DOWNLOAD_STATS.record_download(url, body)
+    timing = current_timing()
+    if timing is not None:
+        timing.download += time.perf_counter() - start
+        timing.bytes += body.size
+    decoded = decoded_response(response, body.content())
+    if body.truncated:
+        decoded.headers[TRUNCATED_HEADER] = "1"
+    return decoded
+
+
+async def read_whole_async_body(response: httpx.Response) -> None:
+    """Asynchronous equivalent of http.read_whole_body()"""
+    start = time.perf_counter()
+    try:
+        content = await response.aread()
+    finally:
+        await response.aclose()
+    timing = current_timing()
+    if timing is not None:
+        timing.download += time.perf_counter() - start
+        timing.bytes += len(content)
+
+
+def decoded_response(response: httpx.Response, content: bytes) -> httpx.Response:
+    """Create a copy of the response with the given, already decoded, body"""
+    headers = response.headers.copy()
+    for header in ("Content-Encoding", "Content-Length"):
+        headers.pop(header, None)
+    return httpx.Response(
+        status_code=response.status_code,
+        headers=headers,
+        content=content,
+        request=response.request,
+    )
+
+
+# The pool belongs to the event loop it was created in. Use async_session_pool() to
+# access it and close_async_session_pool() to clean it up before the loop exits.
+ASYNC_SESSION_POOL: Optional[AsyncSessionPool] = None
+ASYNC_SESSION_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def async_session_pool() -> AsyncSessionPool:
+    global ASYNC_SESSION_POOL, ASYNC_SESSION_LOOP
+    loop = asyncio.get_running_loop()
+    if ASYNC_SESSION_POOL is None or ASYNC_SESSION_LOOP is not loop:
+        ASYNC_SESSION_POOL = AsyncSessionPool()
+        ASYNC_SESSION_LOOP = loop
+    return ASYNC_SESSION_POOL
+
+
+def set_async_session_pool(pool: Optional[AsyncSessionPool]) -> None:
+    global ASYNC_SESSION_POOL, ASYNC_SESSION_LOOP
+    ASYNC_SESSION_POOL = pool
+    ASYNC_SESSION_LOOP = asyncio.get_running_loop() if pool else None
+
+
+async def close_async_session_pool() -> None:
+    global ASYNC_SESSION_POOL, ASYNC_SESSION_LOOP
+    if ASYNC_SESSION_POOL is not None:
+        await ASYNC_SESSION_POOL.aclose()
+    ASYNC_SESSION_POOL = None
+    ASYNC_SESSION_LOOP = None
+
+
+def check_async_response(response: httpx.Response) -> Optional[httpx.Response]:
+    if response.is_success or response.status_code == 304:
+        return response
+    check_error_status(
+        status_code=response.status_code,
+        reason=response.reason_phrase,
+        text=response.text,
+        headers=response.headers,
+    )
+    # We hit an error that which isn't bad enough to make us exit but isn't worth
+    # retrying. Return None to skip this URL and continue to the next one.
+    return None
+
+
+@retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    stop=stop_after_attempt(3),
+    wait=wait_retry_after,
+    before_sleep=pause_host_before_sleep,
+    reraise=True,
+)
+async def async_request_with_retries(
+    method: str,
+    url: str,
+    paced: bool = False,
+    **kwargs: Any,
+) -> Optional[httpx.Response]:
+    """Asynchronous counterpart to http.request_with_retries()"""
+    timing = current_timing()
+    start = time.perf_counter()
+    if paced:
+        # The scheduler may need to fetch robots.txt, so don't block the event loop
+        delay = await asyncio.to_thread(http.HOST_SCHEDULER.reserve, url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    if timing is not None:
+        timing.attempts += 1
+        timing.waited += time.perf_counter() - start
+    response = await async_session_pool().request(method, url, **kwargs)
+    if response is None:
+        return None
+    return check_async_response(response)
+
+
+async def async_request_and_catch(
+    method: str,
+    url: str,
+    **kwargs: Any,
+) -> Optional[httpx.Response]:
+    logger = logging.getLogger(__name__)
+    with http.REQUEST_TIMINGS.measure(method, url) as timing:
+        try:
+            return await async_request_with_retries(method, url, **kwargs)
+        except RETRYABLE_ERRORS as error:
+            logger.warning("Retries exceeded for %s", url)
+            logger.warning("Last error: %r", error)
+            timing.error = repr(error)
+            # Return None so that we continue to the next request
+        return None
+
+
+async def async_get(
+    url: str,
+    content_types: Optional[Sequence[str]] = HTML_CONTENT_TYPES,
+    hold: bool = False,
+    **kwargs: Any,
+) -> Optional[httpx.Response]:
+    """Fetch the given URL
+
+    This behaves like http.get(), including the use of the HTTP cache and page archive
+    if they are set, and holding the page until it's committed if hold is set.
+    """
+    archive = http.PAGE_ARCHIVE
+    if archive is not None and archive.replay:
+        return replayed_async_response(archive, url)
+    response = await async_get_with_cache(url, content_types, hold, **kwargs)
+    if archive is not None and response is not None:
+        archive_response(archive, url, response)
+    return response
+
+
+async def async_get_with_cache(
+    url: str,
+    content_types: Optional[Sequence[str]],
+    hold: bool = False,
+    **kwargs: Any,
+) -> Optional[httpx.Response]:
+    kwargs["limits"] = DownloadLimits(http.MAX_RESPONSE_BYTES, content_types)
+    kwargs["paced"] = True
+    cache = http.HTTP_CACHE
+    if cache is None:
+        return await async_request_and_catch("GET", url, **kwargs)
+
+    headers = kwargs.pop("headers", None) or {}
+    entry, conditional_headers = revalidation_headers(cache, url, headers)
+    response = await async_request_and_catch(
+        "GET", url, headers=conditional_headers, **kwargs
+    )
+    if response is None:
+        return None
+
+    if is_not_modified(response) and entry is not None:
+        body = load_unmodified_body(cache, url, entry)
+        if body is None:
+            return await async_request_and_catch("GET", url, headers=headers, **kwargs)
+        # The cached body has already been decoded
+        cached = decoded_response(response, body)
+        if entry.content_type and "Content-Type" not in cached.headers:
+            cached.headers["Content-Type"] = entry.content_type
+        if entry.encoding:
+            cached.encoding = entry.encoding
+        return cached
+
+    store_response(cache, url, response, hold)
+    return response
+
+
+def replayed_async_response(
+    archive: PageArchive,
+    url: str,
+) -> Optional[httpx.Response]:
+    """Load a page from the archive, as if it had just been fetched"""
+    page = archive.load_page(url)
+    if page is None:
+        return None
+    headers = {"Content-Type": page.content_type} if page.content_type else {}
+    response = httpx.Response(
+        status_code=200,
+        headers=headers,
+        content=page.body,
+        request=httpx.Request("GET", url),
+    )
+    if page.encoding:
+        response.encoding = page.encoding
+    return response
+
+
+async def async_post(url: str, **kwargs: Any) -> Optional[httpx.Response]:
+    return await async_request_and_catch("POST", url, **kwargs)
@@ -0,0 +1,284 @@
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, Final, Iterable, List, Mapping, Optional, Tuple, Type
+
+import openai
+from pydantic import BaseModel
+
+from .archive import completion_key
+from .interface import ApiResponse, BatchApi, RichResponse
+from .openai import OpenAIApi
+
+BATCH_ENDPOINT: Final = "/v1/chat/completions"
+# Batches can't be given any longer than this to finish
+COMPLETION_WINDOW: Final = "24h"
+# Statuses of batches which won't change any more
+FINISHED_STATUSES = frozenset(("completed", "failed", "expired", "cancelled"))
+# OpenAI's limit on the number of requests in one batch
+MAX_BATCH_REQUESTS = 50000
+
+# (custom_id, content) of each request in a batch
+BatchRequest = Tuple[str, str]
+
+
+def response_format_param(response_format: Type[BaseModel]) -> Dict[str, Any]:
+    """Convert a model to the response_format of a request
+
+    This is the same strict JSON schema which client.beta.chat.completions.parse()
+    sends for interactive requests.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": strict_json_schema(response_format.model_json_schema()),
+            "name": response_format.__name__,
+            "strict": True,
+        },
+    }
+
+
+def strict_json_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Adapt a JSON schema to the subset which OpenAI's strict mode accepts
+
+    Every object has all of its properties required and no others allowed, and $refs
+    with other keywords alongside them, such as a description, are inlined.
+    """
+    return make_strict(schema, schema)
+
+
+def make_strict(node: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """Make a schema, or part of one, strict in place. root is the whole schema."""
+    for definition in (node.get("$defs") or {}).values():
+        make_strict(definition, root)
+    if node.get("type") == "object":
+        node.setdefault("additionalProperties", False)
+    properties = node.get("properties")
+    if isinstance(properties, dict):
+        node["required"] = list(properties)
+        for prop in properties.values():
+            make_strict(prop, root)
+    if isinstance(node.get("items"), dict):
+        make_strict(node["items"], root)
+    for variant in node.get("anyOf") or []:
+        make_strict(variant, root)
+    all_of = node.get("allOf")
+    if isinstance(all_of, list) and len(all_of) == 1:
+        node.update(make_strict(all_of[0], root))
+        del node["allOf"]
+    elif isinstance(all_of, list):
+        for entry in all_of:
+            make_strict(entry, root)
+    # The model fills in None itself, and defaults aren't allowed
+    if "default" in node and node["default"] is None:
+        del node["default"]
+    ref = node.get("$ref")
+    if isinstance(ref, str) and len(node) > 1:
+        resolved: Any = root
+        for key in ref.removeprefix("#/").split("/"):
+            resolved = resolved[key]
+        # Keywords alongside the $ref take priority over the referenced schema's
+        node.update({**resolved, **node})
+        del node["$ref"]
+        return make_strict(node, root)
+    return node
+
+
+class OpenAIBatchApi(BatchApi[RichResponse]):
+    """Extract information using OpenAI's Batch API
+
+    Batches cost half as much as individual completions and don't count towards the
+    per-minute rate limits, but can take up to a day to finish, so this suits
+    scheduled runs. Requests use the same model, prompt and response format as the
+    wrapped OpenAIApi, and long pages are split into chunks the same way. The batch
+    is checked every poll_interval seconds until it's finished.
+
+    If the API has a completion cache, chunks found in it aren't requested again, and
+    completions from the batch are added to it.
+    """
+
+    def __init__(
+        self,
+        api: OpenAIApi[RichResponse],
+        poll_interval: float = 60.0,
+        client: Optional[openai.OpenAI] = None,
+        max_requests: int = MAX_BATCH_REQUESTS,
+    ) -> None:
+        self.api = api
+        self.poll_interval = poll_interval
+        # The API's client may have retries turned off for its scheduler, but uploads
+        # and polls over the many hours a batch takes need them
+        self.client = client or api.client.with_options(
+            max_retries=openai.DEFAULT_MAX_RETRIES
+        )
+        self.max_requests = max_requests
+        self.response_format = response_format_param(api.response_format)
+
+    def extract_batch(
+        self, pages: Mapping[str, str]
+    ) -> Dict[str, ApiResponse[RichResponse]]:
+        logger = logging.getLogger(__name__)
+        urls: Dict[str, str] = {}
+        requests: List[BatchRequest] = []
+        keys: Dict[str, str] = {}
+        results: Dict[str, Optional[RichResponse]] = {}
+        for page, (url, content) in enumerate(pages.items()):
+            for chunk, chunk_content in enumerate(self.api.chunks(url, content)):
+                custom_id = f"{page}-{chunk}"
+                urls[custom_id] = url
+                if self.api.completion_cache is None:
+                    requests.append((custom_id, chunk_content))
+                    continue
+                # Only the first model is used, so its completions are cached on
+                # their own rather than as the result of the whole cascade
+                key = completion_key(
+                    self.api.model, self.api.prompt, self.api.schema, chunk_content
+                )
+                cached = self.api.load_cached(key, chunk_content)
+                if cached is not None:
+                    results[custom_id] = cached
+                else:
+                    keys[custom_id] = key
+                    requests.append((custom_id, chunk_content))
+        if results:
+            logger.info("Reusing %d cached completions", len(results))
+
+        for start in range(0, len(requests), self.max_requests):
+            completed = self.run(requests[start : start + self.max_requests])
+            results.update(completed)
+            # Refusals and failed requests aren't cached, so they're retried next time
+            if self.api.completion_cache is not None:
+                for custom_id, result in completed.items():
+                    if result is not None:
+                        self.api.completion_cache.put(
+                            keys[custom_id], result.model_dump_json()
+                        )
+
+        parsed: Dict[str, List[RichResponse]] = defaultdict(list)
+        for custom_id, result in results.items():
+            if result is not None:
+                parsed[urls[custom_id]].append(result)
+        responses: Dict[str, ApiResponse[RichResponse]] = {}
+        for url in pages:
+            chunks = parsed.get(url, [])
+            if len(chunks) > 1 and self.api.merge is not None:
+                responses[url] = self.api.merge(chunks)
+            else:
+                responses[url] = chunks[0] if chunks else None
+        return responses
+
+    def request(self, custom_id: str, content: str) -> Dict[str, Any]:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": self.api.model,
+                "messages": self.api.messages(content),
+                "response_format": self.response_format,
+            },
+        }
+
+    def run(self, requests: List[BatchRequest]) -> Dict[str, Optional[RichResponse]]:
+        """Submit a batch and wait for it to finish"""
+        logger = logging.getLogger(__name__)
+        if not requests:
+            return {}
+        lines = "".join(
+            json.dumps(self.request(custom_id, content)) + "\n"
+            for custom_id, content in requests
+        )
+        input_file = self.client.files.create(
+            file=("batch.jsonl", lines.encode()),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+        )
+        logger.info("Submitted batch %s with %d requests", batch.id, len(requests))
+        while batch.status not in FINISHED_STATUSES:
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            logger.info(
+                "Batch %s is %s: %d of %d requests done",
+                batch.id,
+                batch.status,
+                (counts.completed + counts.failed) if counts else 0,
+                len(requests),
+            )
+        if batch.status != "completed":
+            logger.error("Batch %s %s", batch.id, batch.status)
+
+        # Expired and cancelled batches still have results for the requests which
+        # finished in time
+        results: Dict[str, Optional[RichResponse]] = {}
+        usage: Dict[str, int] = defaultdict(int)
+        for line in self.read_lines(batch.output_file_id):
+            custom_id, result = self.parse_result(line, usage)
+            results[custom_id] = result
+        for line in self.read_lines(batch.error_file_id):
+            logger.error(
+                "Request %s in batch %s failed: %s",
+                line.get("custom_id"),
+                batch.id,
+                line.get("error") or line.get("response"),
+            )
+        logger.info(
+            "Batch %s finished with %d results, %d prompt tokens and %d completion "
+            "tokens",
+            batch.id,
+            sum(result is not None for result in results.values()),
+            usage["prompt_tokens"],
+            usage["completion_tokens"],
+        )
+        return results
+
+    def read_lines(self, file_id: Optional[str]) -> Iterable[Dict[str, Any]]:
+        if not file_id:
+            return
+        content = self.client.files.content(file_id).text
+        for line in content.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+    def parse_result(
+        self, line: Dict[str, Any], usage: Dict[str, int]
+    ) -> Tuple[str, Optional[RichResponse]]:
+        """Parse one line of a batch's output file into its custom ID and response"""
+        logger = logging.getLogger(__name__)
+        custom_id = str(line.get("custom_id"))
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            logger.error(
+                "Request %s failed: %s", custom_id, line.get("error") or response
+            )
+            return custom_id, None
+        body = response.get("body") or {}
+        for name, tokens in (body.get("usage") or {}).items():
+            if isinstance(tokens, int):
+                usage[name] += tokens
+        choices = body.get("choices") or []
+        if not choices:
+            logger.warning("Model returned no completions for request %s", custom_id)
+            return custom_id, None
+        choice = choices[0]
+        message = choice.get("message") or {}
+        if message.get("refusal"):
+            logger.warning(
+                "Model refused request %s: %r", custom_id, message["refusal"]
+            )
+            return custom_id, None
+        if choice.get("finish_reason") == "length":
+            logger.error("Completion for request %s was too long", custom_id)
+            return custom_id, None
+        try:
+            return custom_id, self.api.response_format.model_validate_json(
+                message.get("content") or ""
+            )
+        except ValueError as error:
+            logger.error("Invalid completion for request %s: %r", custom_id, error)
+            return custom_id, None
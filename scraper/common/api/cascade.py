@@ -0,0 +1,49 @@
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import DefaultDict, Optional, Tuple
+
+
+class CascadeStats:
+    """Counts completions and their latency for each model in a cascade
+
+    Also counts why pages were escalated from each model to the next.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls: Counter[str] = Counter()
+        self.seconds: DefaultDict[str, float] = defaultdict(float)
+        self.escalations: Counter[Tuple[str, str]] = Counter()
+
+    def record(self, model: str, seconds: float, escalation: Optional[str]) -> None:
+        """Record a completion, and the reason it was escalated if it was"""
+        with self.lock:
+            self.calls[model] += 1
+            self.seconds[model] += seconds
+        if escalation is not None:
+            self.record_escalation(model, escalation)
+
+    def record_escalation(self, model: str, escalation: str) -> None:
+        """Record that a page was escalated from the model after its completions"""
+        with self.lock:
+            self.escalations[(model, escalation)] += 1
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        with self.lock:
+            for model, calls in self.calls.items():
+                escalated = sum(
+                    count
+                    for (escalated_from, _), count in self.escalations.items()
+                    if escalated_from == model
+                )
+                logger.info(
+                    "Model %s: %d completions averaging %.2f s, %d escalated",
+                    model,
+                    calls,
+                    self.seconds[model] / calls,
+                    escalated,
+                )
+            for (model, reason), count in self.escalations.most_common():
+                logger.info("Escalated from %s %d times: %s", model, count, reason)
@@ -0,0 +1,98 @@
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+# Content types which can be passed on for scraping
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# Default limit on the size of a response body. Pages larger than this are truncated.
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+# Size of the pieces a response body is read in
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class DownloadLimits:
+    """Restrictions on which responses are downloaded and how much of them is kept
+
+    If content_types is None, responses of any type are accepted.
+    """
+
+    max_bytes: int = DEFAULT_MAX_BYTES
+    content_types: Optional[Sequence[str]] = HTML_CONTENT_TYPES
+
+    def accepts(self, content_type: Optional[str]) -> bool:
+        # Some servers don't send a content type, so give them the benefit of the doubt
+        if self.content_types is None or not content_type:
+            return True
+        media_type = content_type.split(";")[0].strip().lower()
+        return media_type in self.content_types
+
+
+# Header added to responses whose body was cut off at the size limit, so they aren't
+# cached or archived as if they were complete
+TRUNCATED_HEADER = "X-Scraper-Truncated"
+
+
+class BodyBuffer:
+    """Collects the chunks of a response body until it reaches the size limit"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.truncated = False
+
+    def add(self, chunk: bytes) -> bool:
+        """Add a chunk of the body, returning False once the limit has been reached"""
+        remaining = self.max_bytes - self.size
+        if len(chunk) > remaining:
+            chunk = chunk[:remaining]
+            self.truncated = True
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        return not self.truncated
+
+    def content(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+class DownloadStats:
+    """Thread-safe counts of what happened to the responses we downloaded"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.total_bytes = 0
+        self.truncated = 0
+        self.rejected = 0
+
+    def record_download(self, url: str, body: BodyBuffer) -> None:
+        logger = logging.getLogger(__name__)
+        if body.truncated:
+            logger.warning(
+                "Response from %s exceeded %d bytes and was truncated",
+                url,
+                body.max_bytes,
+            )
+        with self.lock:
+            self.downloaded += 1
+            self.total_bytes += body.size
+            if body.truncated:
+                self.truncated += 1
+
+    def record_rejected(self, url: str, content_type: Optional[str]) -> None:
+        logger = logging.getLogger(__name__)
+        logger.info("Skipping %s with unsupported content type %s", url, content_type)
+        with self.lock:
+            self.rejected += 1
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "Downloaded %d responses (%d bytes), %d truncated, %d rejected by type",
+            self.downloaded,
+            self.total_bytes,
+            self.truncated,
+            self.rejected,
+        )
@@ -1,16 +1,36 @@
 import logging
-from typing import Any, Optional
+import queue
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Mapping, Optional, Sequence, Tuple, Union
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from tenacity import (
     before_sleep_log,
     retry,
     retry_if_exception_type,
+    RetryCallState,
     stop_after_attempt,
     wait_chain,
     wait_fixed,
 )
 
+from .archive import PageArchive
+from .download import (
+    BodyBuffer,
+    CHUNK_SIZE,
+    DEFAULT_MAX_BYTES,
+    DownloadLimits,
+    DownloadStats,
+    HTML_CONTENT_TYPES,
+    TRUNCATED_HEADER,
+)
+from .http_cache import CacheEntry, HttpCache
+from .politeness import HostScheduler, parse_retry_after
+from .timing import current_timing, TIMED_POOL_CLASSES, TimingRecorder
+
 # HTTP headers to use when fetching web pages. Some sites block the default requests
 # user agent, even though their robots.txt allows scraping.
 HTTP_GET_HEADERS = {
@@ -22,10 +42,179 @@ HTTP_GET_HEADERS = {
 }
 
 
+# Maximum number of simultaneous connections to any one host. Further requests to the
+# same host wait until a connection is free.
+MAX_CONNECTIONS_PER_HOST = 4
+# Maximum number of hosts to keep idle connections open for
+MAX_POOLED_HOSTS = 100
+
+
+class SessionPool:
+    """Thread-safe pool of requests sessions which share keep-alive connections
+
+    Sessions aren't guaranteed to be thread-safe, so each thread borrows its own.
+    However, all sessions share a single HTTPAdapter. This means a connection opened
+    by one session can be reused by any other, and the limit on connections per host
+    applies across all threads.
+    """
+
+    def __init__(
+        self,
+        max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+        max_hosts: int = MAX_POOLED_HOSTS,
+    ) -> None:
+        self.adapter = HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=max_connections_per_host,
+            pool_block=True,
+        )
+        # Record how long it takes to open each new connection
+        self.adapter.poolmanager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+        # Reuse the most recently returned session first
+        self.sessions: queue.LifoQueue[requests.Session] = queue.LifoQueue()
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+        return session
+
+    @contextmanager
+    def session(self) -> Iterator[requests.Session]:
+        """Borrow a session from the pool, creating a new one if none are free"""
+        try:
+            session = self.sessions.get_nowait()
+        except queue.Empty:
+            session = self.create_session()
+        try:
+            yield session
+        finally:
+            self.sessions.put(session)
+
+    def connection_stats(self) -> Dict[str, Tuple[int, int]]:
+        """Return the number of requests and new connections made to each host"""
+        stats: Dict[str, Tuple[int, int]] = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_made, connections = stats.get(pool.host, (0, 0))
+            stats[pool.host] = (
+                requests_made + pool.num_requests,
+                connections + pool.num_connections,
+            )
+        return stats
+
+    def log_connection_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        stats = self.connection_stats()
+        for host, (requests_made, connections) in sorted(stats.items()):
+            logger.debug(
+                "Connections to %s: %d requests, %d reused connections",
+                host,
+                requests_made,
+                requests_made - connections,
+            )
+        total_requests = sum(requests_made for requests_made, _ in stats.values())
+        total_connections = sum(connections for _, connections in stats.values())
+        logger.info(
+            "Made %d HTTP requests to %d hosts over %d connections (%d reused)",
+            total_requests,
+            len(stats),
+            total_connections,
+            total_requests - total_connections,
+        )
+
+
+SESSION_POOL = SessionPool()
+
+# Optional on-disk cache used to make conditional GET requests. Set with
+# set_http_cache().
+HTTP_CACHE: Optional[HttpCache] = None
+
+
+def set_http_cache(cache: Optional[HttpCache]) -> None:
+    global HTTP_CACHE
+    HTTP_CACHE = cache
+
+
+# Maximum size of the response body kept by get(). Set with set_max_response_bytes().
+MAX_RESPONSE_BYTES = DEFAULT_MAX_BYTES
+DOWNLOAD_STATS = DownloadStats()
+# Timings of every request made with get() and post(), for the run report
+REQUEST_TIMINGS = TimingRecorder()
+
+
+def set_max_response_bytes(max_bytes: int) -> None:
+    global MAX_RESPONSE_BYTES
+    MAX_RESPONSE_BYTES = max_bytes
+
+
+# Optional archive which get() records pages to or replays them from. Set with
+# set_page_archive().
+PAGE_ARCHIVE: Optional[PageArchive] = None
+
+
+def set_page_archive(archive: Optional[PageArchive]) -> None:
+    global PAGE_ARCHIVE
+    PAGE_ARCHIVE = archive
+
+
+# Status codes which indicate the server wants us to slow down
+RATE_LIMIT_STATUS_CODES = {429, 503}
+# Timeout for fetching robots.txt, in seconds
+ROBOTS_TIMEOUT = 10
+
+
+def fetch_robots_txt(url: str) -> Optional[str]:
+    """Fetch a robots.txt file, without retries or rate limiting"""
+    logger = logging.getLogger(__name__)
+    archive = PAGE_ARCHIVE
+    if archive is not None and archive.replay:
+        page = archive.load_page(url)
+        return page.body.decode(page.encoding or "utf-8", "replace") if page else None
+    try:
+        with SESSION_POOL.session() as session:
+            response = session.get(
+                url,
+                headers=HTTP_GET_HEADERS,
+                timeout=ROBOTS_TIMEOUT,
+            )
+    except requests.RequestException as error:
+        logger.debug("Failed to fetch %s: %r", url, error)
+        return None
+    if not response.ok:
+        return None
+    if archive is not None:
+        archive_response(archive, url, response)
+    return response.text
+
+
+HOST_SCHEDULER = HostScheduler(robots_fetcher=fetch_robots_txt)
+
+
+def set_host_scheduler(scheduler: HostScheduler) -> None:
+    global HOST_SCHEDULER
+    HOST_SCHEDULER = scheduler
+
+
 class HttpRetryableError(Exception):
-    """The HTTP request failed and should be retried"""
+    """The HTTP request failed and should be retried
 
-    pass
+    If the server said how long to wait before retrying, retry_after holds the delay
+    in seconds.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
 
 
 class HttpFatalError(Exception):
@@ -40,6 +229,7 @@ class HttpFatalError(Exception):
 RETRYABLE_ERRORS = (
     HttpRetryableError,
     requests.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
     requests.Timeout,
     TimeoutError,
 )
@@ -48,42 +238,175 @@ RETRYABLE_ERRORS = (
 def check_response(response: requests.Response) -> Optional[requests.Response]:
     if response.ok:
         return response
+    check_error_status(
+        status_code=response.status_code,
+        reason=response.reason,
+        text=response.text,
+        headers=response.headers,
+    )
+    # We hit an error that which isn't bad enough to make us exit but isn't worth
+    # retrying. Return None to skip this URL and continue to the next one.
+    return None
+
+
+def check_error_status(
+    status_code: int,
+    reason: str,
+    text: str,
+    headers: Mapping[str, str],
+) -> None:
+    """Raise an exception if an unsuccessful response should be retried or is fatal
 
+    This is shared by the synchronous and asynchronous clients.
+    """
     logger = logging.getLogger(__name__)
-    logger.warning(
-        "Request returned response status %d: %s",
-        response.status_code,
-        response.reason,
-    )
-    logger.debug("Response text: %s", response.text)
+    logger.warning("Request returned response status %d: %s", status_code, reason)
+    logger.debug("Response text: %s", text)
 
-    if response.text.startswith("Your subscription is currently inactive"):
+    if text.startswith("Your subscription is currently inactive"):
         logger.error("API returned error. Check that the API key is valid.")
-        raise HttpFatalError(f"Received fatal API error {response.status_code}")
+        raise HttpFatalError(f"Received fatal API error {status_code}")
 
-    if response.status_code in {403, 408, 429, 502, 503, 504}:
-        raise HttpRetryableError(f"Received retryable error {response.status_code}")
+    if status_code in {403, 408, 429, 502, 503, 504}:
+        retry_after = None
+        if status_code in RATE_LIMIT_STATUS_CODES:
+            retry_after = parse_retry_after(headers.get("Retry-After"))
+        raise HttpRetryableError(
+            f"Received retryable error {status_code}",
+            status_code=status_code,
+            retry_after=retry_after,
+        )
 
-    # We hit an error that which isn't bad enough to make us exit but isn't worth
-    # retrying. Return None to skip this URL and continue to the next one.
-    return None
+
+# Delays to use when the server doesn't send Retry-After.
+# SquareSpace has a 1 minute cooldown if the rate limit is exceeded:
+# https://developers.squarespace.com/commerce-apis/rate-limits
+FALLBACK_WAIT = wait_chain(wait_fixed(10), wait_fixed(70))
+
+log_before_sleep = before_sleep_log(logging.getLogger(__name__), logging.INFO)
+
+
+def retry_error(retry_state: RetryCallState) -> Optional[BaseException]:
+    if retry_state.outcome is None or not retry_state.outcome.failed:
+        return None
+    return retry_state.outcome.exception()
+
+
+def wait_retry_after(retry_state: RetryCallState) -> float:
+    """Wait as long as the server asked, or fall back to fixed delays"""
+    error = retry_error(retry_state)
+    if isinstance(error, HttpRetryableError) and error.retry_after is not None:
+        return error.retry_after
+    return FALLBACK_WAIT(retry_state)
+
+
+def pause_host_before_sleep(retry_state: RetryCallState) -> None:
+    """If the server is rate limiting us, pause all requests to it while we wait
+
+    This stops other workers from sending requests to the same host in the meantime,
+    while leaving them free to make requests to other hosts. Only paced requests wait
+    for the host scheduler, so only they pause the host.
+    """
+    error = retry_error(retry_state)
+    if (
+        retry_state.kwargs.get("paced")
+        and isinstance(error, HttpRetryableError)
+        and error.status_code in RATE_LIMIT_STATUS_CODES
+        and retry_state.next_action is not None
+    ):
+        url = retry_state.kwargs.get("url") or retry_state.args[1]
+        HOST_SCHEDULER.defer(url, retry_state.next_action.sleep)
+    log_before_sleep(retry_state)
 
 
 @retry(
     retry=retry_if_exception_type(RETRYABLE_ERRORS),
     stop=stop_after_attempt(3),
-    # SquareSpace has a 1 minute cooldown if the rate limit is exceeded:
-    # https://developers.squarespace.com/commerce-apis/rate-limits
-    wait=wait_chain(wait_fixed(10), wait_fixed(70)),
-    before_sleep=before_sleep_log(logging.getLogger(__name__), logging.INFO),
+    wait=wait_retry_after,
+    before_sleep=pause_host_before_sleep,
     reraise=True,
 )
 def request_with_retries(
     method: str,
     url: str,
+    limits: Optional[DownloadLimits] = None,
+    paced: bool = False,
     **kwargs: Any,
 ) -> Optional[requests.Response]:
-    return check_response(requests.request(method, url, **kwargs))
+    """Send a request, retrying it if it fails in a way that might not last
+
+    If paced is set, the request waits until the host scheduler allows it, as pages
+    fetched from the sites we scrape should. API requests aren't paced.
+    """
+    timing = current_timing()
+    start = time.perf_counter()
+    if paced:
+        HOST_SCHEDULER.wait(url)
+    sent = time.perf_counter()
+    connected = 0.0
+    if timing is not None:
+        timing.attempts += 1
+        timing.waited += sent - start
+        connected = timing.connect
+    with SESSION_POOL.session() as session:
+        # Always stream, so that reading the body is timed apart from waiting for it
+        raw_response = session.request(method, url, stream=True, **kwargs)
+        if timing is not None:
+            # Any new connection was opened during the request and timed already
+            waiting = time.perf_counter() - sent - (timing.connect - connected)
+            timing.first_byte += waiting
+            timing.status = raw_response.status_code
+        if limits is None:
+            read_whole_body(raw_response)
+        response = check_response(raw_response)
+        if response is None or limits is None:
+            return response
+        return read_body(url, response, limits)
+
+
+def read_whole_body(response: requests.Response) -> None:
+    """Read a streamed response body without any limits, timing the download"""
+    start = time.perf_counter()
+    content = response.content
+    timing = current_timing()
+    if timing is not None:
+        timing.download += time.perf_counter() - start
+        timing.bytes += len(content)
+
+
+def read_body(
+    url: str,
+    response: requests.Response,
+    limits: DownloadLimits,
+) -> Optional[requests.Response]:
+    """Read a streamed response body, stopping early if it exceeds the limits
+
+    If the response has an unwanted content type, close it without reading the body
+    and return None. If the body is too large, keep only the start of it.
+    """
+    content_type = response.headers.get("Content-Type")
+    if response.status_code != 304 and not limits.accepts(content_type):
+        response.close()
+        DOWNLOAD_STATS.record_rejected(url, content_type)
+        return None
+
+    start = time.perf_counter()
+    body = BodyBuffer(limits.max_bytes)
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if not body.add(chunk):
+            break
+    # Closing a partially read response discards the connection rather than
+    # returning it to the pool, but that's cheaper than reading the rest
+    response.close()
+    response._content = body.content()
+    if body.truncated:
+        response.headers[TRUNCATED_HEADER] = "1"
+    DOWNLOAD_STATS.record_download(url, body)
+    timing = current_timing()
+    if timing is not None:
+        timing.download += time.perf_counter() - start
+        timing.bytes += body.size
+    return response
 
 
 def request_and_catch(
@@ -92,17 +415,187 @@ def request_and_catch(
     **kwargs: Any,
 ) -> Optional[requests.Response]:
     logger = logging.getLogger(__name__)
-    try:
-        return request_with_retries(method, url, **kwargs)
-    except RETRYABLE_ERRORS as error:
-        logger.warning("Retries exceeded for %s", url)
-        logger.warning("Last error: %r", error)
-        # Return None so that we continue to the next request
-    return None
+    with REQUEST_TIMINGS.measure(method, url) as timing:
+        try:
+            return request_with_retries(method, url, **kwargs)
+        except RETRYABLE_ERRORS as error:
+            logger.warning("Retries exceeded for %s", url)
+            logger.warning("Last error: %r", error)
+            timing.error = repr(error)
+            # Return None so that we continue to the next request
+        return None
+
+
+def get(
+    url: str,
+    content_types: Optional[Sequence[str]] = HTML_CONTENT_TYPES,
+    hold: bool = False,
+    **kwargs: Any,
+) -> Optional[requests.Response]:
+    """Fetch the given URL
+
+    The body is streamed so that responses whose Content-Type isn't one of
+    content_types can be abandoned before they're downloaded. In that case, return
+    None. Pass content_types=None to accept any type. Bodies longer than
+    MAX_RESPONSE_BYTES are truncated, and aren't cached or archived, so they're fetched
+    again in full next time.
+
+    If an HTTP cache has been set and it holds a previous copy of the page, ask the
+    server to only send the page if it has changed. If it hasn't, return a response
+    with status 304 Not Modified whose body is filled in from the cache. Use
+    is_not_modified() to check for this case. If hold is set, a new copy of the page
+    isn't stored in the cache until commit_cached() is called for it, which should be
+    once whatever was extracted from it has been saved.
+
+    If a page archive has been set, the page is recorded to it, or when replaying, is
+    loaded from it instead of the network.
+    """
+    archive = PAGE_ARCHIVE
+    if archive is not None and archive.replay:
+        return replayed_response(archive, url)
+    response = get_with_cache(url, content_types, hold, **kwargs)
+    if archive is not None and response is not None:
+        archive_response(archive, url, response)
+    return response
+
+
+def get_with_cache(
+    url: str,
+    content_types: Optional[Sequence[str]],
+    hold: bool = False,
+    **kwargs: Any,
+) -> Optional[requests.Response]:
+    kwargs["limits"] = DownloadLimits(MAX_RESPONSE_BYTES, content_types)
+    kwargs["paced"] = True
+    cache = HTTP_CACHE
+    if cache is None:
+        return request_and_catch("GET", url, **kwargs)
+
+    headers = kwargs.pop("headers", None) or {}
+    entry, conditional_headers = revalidation_headers(cache, url, headers)
+    response = request_and_catch("GET", url, headers=conditional_headers, **kwargs)
+    if response is None:
+        return None
+
+    if is_not_modified(response) and entry is not None:
+        body = load_unmodified_body(cache, url, entry)
+        if body is None:
+            return request_and_catch("GET", url, headers=headers, **kwargs)
+        response._content = body
+        response.encoding = entry.encoding
+        if entry.content_type:
+            response.headers.setdefault("Content-Type", entry.content_type)
+        return response
+
+    store_response(cache, url, response, hold)
+    return response
+
+
+def revalidation_headers(
+    cache: HttpCache, url: str, headers: Mapping[str, str]
+) -> Tuple[Optional[CacheEntry], Dict[str, str]]:
+    """Look up the page in the cache, and the headers to revalidate it with
+
+    If there's a cached copy, the headers ask the server to only send the page if it
+    has changed since.
+    """
+    entry = cache.lookup(url)
+    conditional_headers = entry.conditional_headers() if entry else {}
+    return entry, {**headers, **conditional_headers}
+
+
+def load_unmodified_body(
+    cache: HttpCache, url: str, entry: CacheEntry
+) -> Optional[bytes]:
+    """Load the cached body of a page which the server says hasn't changed
+
+    If it's missing, the entry is dropped and None returned, so the page should be
+    fetched again in full.
+    """
+    logger = logging.getLogger(__name__)
+    body = cache.load_body(entry)
+    if body is None:
+        logger.warning("Cached body missing for %s", url)
+        cache.invalidate(url)
+        return None
+    logger.info("Not modified since last fetch: %s", url)
+    return body
+
+
+def store_response(
+    cache: HttpCache,
+    url: str,
+    response: Union[requests.Response, httpx.Response],
+    hold: bool = False,
+) -> None:
+    """Store the response in the cache, or hold it until it's committed"""
+    # A truncated page would be reused as if it were complete
+    if is_truncated(response):
+        cache.invalidate(url)
+        return
+    if hold:
+        cache.hold(url, response.content, response.headers, response.encoding)
+        return
+    cache.store(url, response.content, response.headers, response.encoding)
+
+
+def archive_response(
+    archive: PageArchive,
+    url: str,
+    response: Union[requests.Response, httpx.Response],
+) -> None:
+    if is_truncated(response):
+        return
+    archive.store_page(
+        url,
+        response.content,
+        response.headers.get("Content-Type"),
+        response.encoding,
+    )
+
+
+def replayed_response(archive: PageArchive, url: str) -> Optional[requests.Response]:
+    """Load a page from the archive, as if it had just been fetched"""
+    page = archive.load_page(url)
+    if page is None:
+        return None
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = page.body
+    response.encoding = page.encoding
+    if page.content_type:
+        response.headers["Content-Type"] = page.content_type
+    return response
+
+
+def is_not_modified(response: Union[requests.Response, httpx.Response]) -> bool:
+    """Check whether the response is a cached page which hasn't changed"""
+    return response.status_code == 304
+
+
+def is_truncated(response: Union[requests.Response, httpx.Response]) -> bool:
+    """Check whether the response body was cut off at the size limit"""
+    return TRUNCATED_HEADER in response.headers
+
+
+def commit_cached(url: str, result: Optional[str] = None) -> None:
+    """Store a page fetched with hold set, along with what was extracted from it"""
+    if HTTP_CACHE is not None:
+        HTTP_CACHE.commit(url, result)
+
+
+def load_cached_result(url: str) -> Optional[str]:
+    """Load what was extracted from a page when it was committed, if anything"""
+    if HTTP_CACHE is None:
+        return None
+    return HTTP_CACHE.load_result(url)
 
 
-def get(url: str, **kwargs: Any) -> Optional[requests.Response]:
-    return request_and_catch("GET", url, **kwargs)
+def invalidate_cached(url: str) -> None:
+    """Make sure the next request for the given URL fetches the full page"""
+    if HTTP_CACHE is not None:
+        HTTP_CACHE.invalidate(url)
 
 
 def post(url: str, **kwargs: Any) -> Optional[requests.Response]:
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+
+# Default limit on the total size of cached bodies
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+
+@dataclass
+class CacheEntry:
+    """Metadata about a cached response"""
+
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_type: Optional[str]
+    encoding: Optional[str]
+    size: int
+    # What was extracted from the body, if it was saved by commit()
+    result: Optional[str] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Headers which ask the server to only send the body if it has changed"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """On-disk cache of response bodies used to make conditional GET requests
+
+    Each response is stored as a pair of files named after a hash of its URL: one
+    holding the body and one holding the metadata needed to revalidate it. Only
+    responses with an ETag or Last-Modified header are stored, since the server has no
+    way to tell us whether other responses have changed.
+
+    When the total size of the bodies exceeds max_bytes, the least recently used
+    entries are evicted. Recency is tracked using the modification time of the
+    metadata files so that it persists between runs.
+
+    A response can be held in memory instead of being stored straight away, until
+    commit() stores it along with what was extracted from it. If the run stops before
+    then, the page is fetched in full next time rather than looking unchanged.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Map from key to body size, ordered from least to most recently used
+        self.index: OrderedDict[str, int] = OrderedDict()
+        # Responses waiting for commit(), keyed by URL
+        self.held: Dict[str, Tuple[bytes, Dict[str, str], Optional[str]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        metadata_paths = sorted(
+            self.directory.glob("*.json"),
+            key=lambda path: path.stat().st_mtime,
+        )
+        for path in metadata_paths:
+            try:
+                entry = self.read_entry(path)
+            except (OSError, TypeError, ValueError):
+                continue
+            self.index[path.stem] = entry.size
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def metadata_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def body_path(self, key: str) -> Path:
+        return self.directory / f"{key}.body"
+
+    @staticmethod
+    def read_entry(path: Path) -> CacheEntry:
+        with open(path, encoding="utf-8") as file:
+            return CacheEntry(**json.load(file))
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """Return the metadata for a cached URL, if any"""
+        key = self.key(url)
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+            try:
+                entry = self.read_entry(self.metadata_path(key))
+            except (OSError, TypeError, ValueError):
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.touch(key)
+            self.hits += 1
+        return entry
+
+    def load_body(self, entry: CacheEntry) -> Optional[bytes]:
+        """Load the cached body after the server confirmed it hasn't changed"""
+        try:
+            body = self.body_path(self.key(entry.url)).read_bytes()
+        except OSError:
+            return None
+        with self.lock:
+            self.not_modified += 1
+        return body
+
+    def store(
+        self,
+        url: str,
+        body: bytes,
+        headers: Mapping[str, str],
+        encoding: Optional[str],
+        result: Optional[str] = None,
+    ) -> None:
+        """Save a response if the server provided a way to revalidate it"""
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        if len(body) > self.max_bytes:
+            return
+        entry = CacheEntry(
+            url=url,
+            etag=etag,
+            last_modified=last_modified,
+            content_type=headers.get("Content-Type"),
+            encoding=encoding,
+            size=len(body),
+            result=result,
+        )
+        key = self.key(url)
+        with self.lock:
+            self.body_path(key).write_bytes(body)
+            self.write_entry(key, entry)
+            self.index[key] = entry.size
+            self.touch(key)
+            self.evict()
+
+    def hold(
+        self,
+        url: str,
+        body: bytes,
+        headers: Mapping[str, str],
+        encoding: Optional[str],
+    ) -> None:
+        """Keep a response in memory until commit() stores it
+
+        Any older copy is dropped straight away, since the page has changed since.
+        """
+        with self.lock:
+            self.remove(self.key(url))
+            self.held[url] = (body, dict(headers), encoding)
+
+    def commit(self, url: str, result: Optional[str] = None) -> None:
+        """Store the response held for a URL, along with what was extracted from it
+
+        If no response is held, because the server said the page hasn't changed, save
+        result to the existing entry instead.
+        """
+        with self.lock:
+            held = self.held.pop(url, None)
+        if held is not None:
+            body, headers, encoding = held
+            self.store(url, body, headers, encoding, result)
+            return
+        key = self.key(url)
+        with self.lock:
+            if key not in self.index:
+                return
+            try:
+                entry = self.read_entry(self.metadata_path(key))
+            except (OSError, TypeError, ValueError):
+                self.remove(key)
+                return
+            entry.result = result
+            self.write_entry(key, entry)
+
+    def load_result(self, url: str) -> Optional[str]:
+        """Return what was extracted from a cached URL, if it was saved"""
+        key = self.key(url)
+        with self.lock:
+            if key not in self.index:
+                return None
+            try:
+                return self.read_entry(self.metadata_path(key)).result
+            except (OSError, TypeError, ValueError):
+                return None
+
+    def invalidate(self, url: str) -> None:
+        """Forget a cached URL so that it's fetched in full next time"""
+        with self.lock:
+            self.held.pop(url, None)
+            self.remove(self.key(url))
+
+    def write_entry(self, key: str, entry: CacheEntry) -> None:
+        """Write an entry's metadata. Caller must hold the lock."""
+        with open(self.metadata_path(key), "w", encoding="utf-8") as file:
+            json.dump(asdict(entry), file)
+
+    def touch(self, key: str) -> None:
+        """Mark an entry as the most recently used. Caller must hold the lock."""
+        self.index.move_to_end(key)
+        try:
+            os.utime(self.metadata_path(key))
+        except OSError:
+            pass
+
+    def remove(self, key: str) -> None:
+        """Delete an entry. Caller must hold the lock."""
+        self.index.pop(key, None)
+        for path in (self.metadata_path(key), self.body_path(key)):
+            path.unlink(missing_ok=True)
+
+    def evict(self) -> None:
+        """Remove least recently used entries until under the size limit
+
+        Caller must hold the lock.
+        """
+        logger = logging.getLogger(__name__)
+        total = sum(self.index.values())
+        while total > self.max_bytes and self.index:
+            key, size = next(iter(self.index.items()))
+            logger.debug("Evicting %s from HTTP cache", key)
+            self.remove(key)
+            total -= size
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "HTTP cache: %d hits, %d misses, %d not modified, %d entries (%d bytes)",
+            self.hits,
+            self.misses,
+            self.not_modified,
+            len(self.index),
+            sum(self.index.values()),
+        )
@@ -1,5 +1,16 @@
+import asyncio
 from abc import abstractmethod, ABC
-from typing import Any, Dict, Generic, List, Optional, TypeVar, Union
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Generic,
+    List,
+    Mapping,
+    Optional,
+    TypeVar,
+    Union,
+)
 
 from pydantic import BaseModel
 
@@ -8,6 +19,157 @@ RichResponse = TypeVar("RichResponse", bound=BaseModel)
 ApiResponse = Optional[Union[LeanResponse | RichResponse]]
 
 
+class PageNotModified(Exception):
+    """The page hasn't changed since the last time it was scraped
+
+    response is what was extracted from the page then, if the API saved it.
+    """
+
+    def __init__(self, url: str, response: ApiResponse[BaseModel] = None) -> None:
+        super().__init__(url)
+        self.response = response
+
+
 class Api(ABC, Generic[RichResponse]):
     @abstractmethod
     def scrape(self, url: str) -> ApiResponse[RichResponse]: ...
+
+    def scrape_if_modified(self, url: str) -> ApiResponse[RichResponse]:
+        """Scrape the page, unless it hasn't changed since it was last scraped
+
+        If it hasn't changed, raise PageNotModified, with the response from then if
+        the API saved it. APIs which can't tell whether a page has changed always
+        scrape it.
+        """
+        return self.scrape(url)
+
+
+class StagedApi(Api[RichResponse]):
+    """Api which fetches, cleans and extracts information from a page in separate steps
+
+    A pipeline can run each step in its own pool of workers, so that a worker waiting
+    on the network doesn't hold up extraction and vice versa. scrape() runs the steps
+    one after another.
+    """
+
+    @abstractmethod
+    def fetch(self, url: str, if_modified: bool = False) -> Optional[str]:
+        """Fetch the content of the page
+
+        If if_modified is set and the page hasn't changed since it was last scraped,
+        raise PageNotModified. It's only treated as scraped once remember() has been
+        called for it.
+        """
+        ...
+
+    def clean(self, url: str, content: str) -> Optional[str]:
+        """Remove irrelevant parts of the content before extraction"""
+        return content
+
+    @abstractmethod
+    def extract(self, url: str, content: str) -> ApiResponse[RichResponse]:
+        """Extract information from the cleaned content"""
+        ...
+
+    def extract_stream(
+        self, url: str, content: str
+    ) -> Generator[Dict[str, Any], None, ApiResponse[RichResponse]]:
+        """Extract information from the cleaned content, streaming a list within it
+
+        Each item of the list is yielded as soon as it's available, then the whole
+        response is returned. APIs which can't stream yield nothing and return the
+        result of extract().
+        """
+        yield from ()
+        return self.extract(url, content)
+
+    def forget(self, url: str) -> None:
+        """Make sure the page is scraped again next time, even if it hasn't changed
+
+        This is called when nothing could be extracted from the page.
+        """
+        pass
+
+    def remember(self, url: str, response: ApiResponse[RichResponse]) -> None:
+        """Save what was extracted from a page fetched with if_modified
+
+        If the page hasn't changed next time, fetch() raises PageNotModified with the
+        saved response. This is called once information has been extracted from the
+        page.
+        """
+        pass
+
+    def extract_structured(self, url: str, content: str) -> ApiResponse[RichResponse]:
+        """Extract information from machine-readable data embedded in the raw page
+
+        If this returns a response, the page isn't cleaned or passed to extract().
+        """
+        return None
+
+    def parse_content(self, url: str, content: str) -> ApiResponse[RichResponse]:
+        """Clean and extract information from a page which has already been fetched"""
+        structured = self.extract_structured(url, content)
+        if structured is not None:
+            return structured
+        cleaned = self.clean(url, content)
+        if not cleaned:
+            return None
+        return self.extract(url, cleaned)
+
+    def scrape(self, url: str) -> ApiResponse[RichResponse]:
+        content = self.fetch(url)
+        if content is None:
+            return None
+        return self.parse_content(url, content)
+
+    def scrape_if_modified(self, url: str) -> ApiResponse[RichResponse]:
+        content = self.fetch(url, if_modified=True)
+        if content is None:
+            return None
+        parsed = self.parse_content(url, content)
+        if parsed is None:
+            self.forget(url)
+        else:
+            self.remember(url, parsed)
+        return parsed
+
+
+class BatchApi(ABC, Generic[RichResponse]):
+    """Api which extracts information from many pages in one request
+
+    Used with a StagedApi, which fetches and cleans the pages first.
+    """
+
+    @abstractmethod
+    def extract_batch(
+        self, pages: Mapping[str, str]
+    ) -> Dict[str, ApiResponse[RichResponse]]:
+        """Extract information from the cleaned content of each page, keyed by URL"""
+        ...
+
+
+class AsyncApi(ABC, Generic[RichResponse]):
+    """Asynchronous counterpart to Api"""
+
+    @abstractmethod
+    async def scrape(self, url: str) -> ApiResponse[RichResponse]: ...
+
+    async def scrape_if_modified(self, url: str) -> ApiResponse[RichResponse]:
+        """Scrape the page, unless it hasn't changed since it was last scraped
+
+        See Api.scrape_if_modified().
+        """
+        return await self.scrape(url)
+
+
+class ThreadedAsyncApi(AsyncApi[RichResponse]):
+    """Adapter which runs a synchronous Api in worker threads"""
+
+    def __init__(self, api: Api[RichResponse]) -> None:
+        self.api = api
+
+    async def scrape(self, url: str) -> ApiResponse[RichResponse]:
+        return await asyncio.to_thread(self.api.scrape, url)
+
+    async def scrape_if_modified(self, url: str) -> ApiResponse[RichResponse]:
+        return await asyncio.to_thread(self.api.scrape_if_modified, url)
@@ -1,10 +1,21 @@
-from .interface import Api, ApiResponse, RichResponse
+import time
+from typing import Optional
+
+from .interface import Api, ApiResponse, RichResponse, StagedApi
 
 
 class MockApi(Api[RichResponse]):
-    """Mock API for testing the pipeline with dummy data"""
+    """Mock API for testing the pipeline with dummy data
+
+    Set latency to simulate the time taken by a real API call, in seconds.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
 
     def scrape(self, _: str) -> ApiResponse[RichResponse]:
+        if self.latency:
+            time.sleep(self.latency)
         return {
             "events": [
                 {
@@ -119,3 +130,24 @@ class MockApi(Api[RichResponse]):
                 },
             ],
         }
+
+
+class MockStagedApi(StagedApi[RichResponse]):
+    """Mock StagedApi which simulates separate latencies for fetching and extraction"""
+
+    def __init__(
+        self, fetch_latency: float = 0.0, extract_latency: float = 0.0
+    ) -> None:
+        self.fetch_latency = fetch_latency
+        self.extract_latency = extract_latency
+        self.mock = MockApi[RichResponse]()
+
+    def fetch(self, url: str, if_modified: bool = False) -> Optional[str]:
+        if self.fetch_latency:
+            time.sleep(self.fetch_latency)
+        return f"<html><body>{url}</body></html>"
+
+    def extract(self, url: str, content: str) -> ApiResponse[RichResponse]:
+        if self.extract_latency:
+            time.sleep(self.extract_latency)
+        return self.mock.scrape(url)
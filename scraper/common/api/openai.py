@@ -1,64 +1,569 @@
+import asyncio
+import contextlib
+import contextvars
 import logging
-from typing import Type
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+)
 
 import openai
+from openai.types.chat import ChatCompletionMessageParam, ParsedChatCompletion
+from pydantic import BaseModel
 
-from scraper.common.text_processors.html import clean_content
+from scraper.common.parsers.json_stream import JsonArrayItems
+from scraper.common.stores.completions import CompletionCache
+from scraper.common.text_processors.html import clean_content, HTML_FORMAT
+from scraper.common.text_processors.profiles import (
+    find_profile,
+    site_key,
+    SiteProfile,
+)
+from scraper.common.text_processors.streaming import (
+    clean_content_streaming,
+    STREAMING_CLEANER,
+    TREE_CLEANER,
+)
+from scraper.common.text_processors.tokens import (
+    ContentStats,
+    estimate_tokens,
+    split_content,
+)
+from scraper.common.types.date_and_time import SERIALIZED
 
-from .interface import Api, ApiResponse, RichResponse
-from .http import get, HTTP_GET_HEADERS
+from .archive import completion_key, PageArchive
+from .async_http import async_get
+from .cascade import CascadeStats
+from .interface import (
+    ApiResponse,
+    AsyncApi,
+    PageNotModified,
+    RichResponse,
+    StagedApi,
+)
+from .http import (
+    commit_cached,
+    get,
+    HTTP_GET_HEADERS,
+    invalidate_cached,
+    is_not_modified,
+    load_cached_result,
+)
+from .rate_limits import CompletionScheduler, parse_rate_limits
+from .timing import current_source
+from .usage import UsageLedger
 
+# Fraction of each chunk which repeats the end of the previous one
+CHUNK_OVERLAP = 0.1
+# Don't split content which is smaller than this any further
+MIN_CHUNK_TOKENS = 500
+# Rough number of tokens in a completion, which count towards the token rate limit
+COMPLETION_TOKENS_ESTIMATE = 2000
+# Number of times to retry a completion which was rate limited or failed to connect
+MAX_COMPLETION_RETRIES = 5
+# Upper limit on the delay between retries after a connection or server error
+MAX_RETRY_DELAY = 30.0
 
-class OpenAIApi(Api[RichResponse]):
-    """Class for scraping webpages using OpenAI"""
+Response = TypeVar("Response", bound=BaseModel)
+
+
+class OpenAIApi(StagedApi[RichResponse]):
+    """Class for scraping webpages using OpenAI
+
+    We fetch the page ourselves, then submit its cleaned contents to the API for
+    parsing.
+
+    If an archive is given, completions are recorded to it, and any completion already
+    in it for the same model, prompt, schema and content is reused. Similarly,
+    if completion_cache is given, parsed completions are saved to it and reused from
+    it by later runs.
+
+    If chunk_tokens and merge are given, pages estimated to be longer than chunk_tokens
+    are split into overlapping chunks which are extracted concurrently, using up to
+    chunk_workers threads per page. merge combines the results into one response.
+    Chunks whose completion is cut off for being too long are split further. Token
+    counts are estimated from the length of the content, not with the model's
+    tokenizer, so chunk_tokens should leave some room below the model's limits.
+
+    If structured_extractor is given, it's tried on the raw page first, and the model
+    is only used if it returns None.
+
+    Pages are cleaned into content_format, unless their host is in source_formats, which
+    maps host names (without www.) to the format to use for that site instead. Pages
+    from hosts in profiles are reduced to the parts selected by that site's profile.
+    With the streaming cleaner, pages without a profile are cleaned without building
+    a tree of the whole page, since selecting parts of a page needs the tree.
+
+    If a scheduler is given, it limits how many completions are in flight at once
+    based on the rate limits reported by the API, and completions which are rate
+    limited are retried by us rather than by the OpenAI client. If max_completions is
+    given, no more than that many are in flight at once either way. Both limits are
+    shared by every page and every chunk of a page, so chunks extracted in parallel
+    don't add to the number of completions in flight.
+
+    If escalation_models are given, each completion is requested from model first,
+    then from each escalation model in turn until one's response passes
+    quality_check. quality_check takes the content and the response for the whole
+    page, after any chunks are merged, and returns a reason to escalate, or None if
+    the response is acceptable. Refusals, invalid responses and failed requests are
+    escalated for each chunk.
+
+    If a ledger is given, the usage and estimated cost of each completion is recorded
+    to it.
+
+    If stream_field is given, extract_stream() streams completions, yielding each item
+    of the list in that field of the response as soon as it has been generated.
+    """
 
     def __init__(
         self,
         model: str,
         prompt: str,
         response_format: Type[RichResponse],
+        archive: Optional[PageArchive] = None,
+        chunk_tokens: Optional[int] = None,
+        merge: Optional[Callable[[List[RichResponse]], RichResponse]] = None,
+        chunk_workers: int = 4,
+        content_format: str = HTML_FORMAT,
+        source_formats: Optional[Mapping[str, str]] = None,
+        profiles: Optional[Mapping[str, SiteProfile]] = None,
+        cleaner: str = TREE_CLEANER,
+        structured_extractor: Optional[
+            Callable[[str, str], ApiResponse[RichResponse]]
+        ] = None,
+        scheduler: Optional[CompletionScheduler] = None,
+        completion_cache: Optional[CompletionCache] = None,
+        escalation_models: Sequence[str] = (),
+        quality_check: Optional[Callable[[str, RichResponse], Optional[str]]] = None,
+        ledger: Optional[UsageLedger] = None,
+        stream_field: Optional[str] = None,
+        max_completions: Optional[int] = None,
     ) -> None:
         self.model = model
+        self.escalation_models = list(escalation_models)
+        self.quality_check = quality_check
+        self.cascade_stats = CascadeStats()
+        # Identifies the models which completions can come from, for caching
+        self.model_key = self.cascade_key(0)
         self.prompt = prompt
         self.response_format = response_format
-        self.client = openai.OpenAI()
+        self.archive = archive
+        self.chunk_tokens = chunk_tokens
+        self.merge = merge
+        self.chunk_workers = chunk_workers
+        self.content_format = content_format
+        self.source_formats = source_formats or {}
+        self.profiles = profiles or {}
+        self.cleaner = cleaner
+        self.content_stats = ContentStats()
+        self.structured_extractor = structured_extractor
+        self.schema = response_format.model_json_schema()
+        self.scheduler = scheduler
+        self.completion_cache = completion_cache
+        self.ledger = ledger
+        self.stream_field = stream_field
+        self.completion_slots = (
+            threading.BoundedSemaphore(max_completions) if max_completions else None
+        )
+        # The client's own retries would ignore the scheduler
+        self.client = openai.OpenAI(max_retries=0) if scheduler else openai.OpenAI()
 
-    def scrape(self, url: str) -> ApiResponse[RichResponse]:
-        logger = logging.getLogger(__name__)
-        # We need to make two requests: first we fetch the page we want to scrape. Then
-        # we submit its contents to the API for parsing.
-        response = get(url, headers=HTTP_GET_HEADERS)
+    def fetch(self, url: str, if_modified: bool = False) -> Optional[str]:
+        response = get(url, headers=HTTP_GET_HEADERS, hold=if_modified)
         if not response:
             return None
+        if if_modified and is_not_modified(response):
+            self.check_previous(url)
+        return response.text
+
+    def check_previous(self, url: str) -> None:
+        """Raise PageNotModified for an unchanged page, if its response was saved
+
+        Otherwise, the page needs extracting again.
+        """
+        logger = logging.getLogger(__name__)
+        result = load_cached_result(url)
+        if result is None:
+            logger.info("No saved response for unchanged page: %s", url)
+            return
+        try:
+            previous = self.response_format.model_validate_json(
+                result, context=SERIALIZED
+            )
+        except ValueError as error:
+            logger.warning("Ignoring invalid saved response for %s: %r", url, error)
+            return
+        raise PageNotModified(url, previous)
+
+    def extract_structured(self, url: str, content: str) -> ApiResponse[RichResponse]:
+        if self.structured_extractor is None:
+            return None
+        return self.structured_extractor(url, content)
+
+    def clean(self, url: str, content: str) -> Optional[str]:
+        logger = logging.getLogger(__name__)
         # Remove irrelevant portions to reduce token count
-        cleaned = clean_content(response.text)
+        content_format = self.content_format_for(url)
+        profile = find_profile(self.profiles, url)
+        if self.cleaner == STREAMING_CLEANER and profile is None:
+            cleaned = clean_content_streaming(content, content_format)
+        else:
+            cleaned = clean_content(
+                content, content_format=content_format, profile=profile
+            )
         if not cleaned:
             logger.warning("No content found for %s", url)
+            return cleaned
+        self.content_stats.record(content_format, content, cleaned)
+        return cleaned
+
+    def content_format_for(self, url: str) -> str:
+        return self.source_formats.get(site_key(url), self.content_format)
+
+    def forget(self, url: str) -> None:
+        invalidate_cached(url)
+
+    def remember(self, url: str, response: ApiResponse[RichResponse]) -> None:
+        if isinstance(response, self.response_format):
+            commit_cached(url, response.model_dump_json())
+        else:
+            commit_cached(url)
+
+    @property
+    def models(self) -> List[str]:
+        """The models of the cascade, from the cheapest to the strongest"""
+        return [self.model, *self.escalation_models]
+
+    def cascade_key(self, tier: int) -> str:
+        """Identify the models which completions starting from tier can come from"""
+        return ">".join(self.models[tier:])
+
+    def extract(self, url: str, content: str) -> ApiResponse[RichResponse]:
+        return self.extract_from(url, content, 0)
+
+    def extract_from(
+        self, url: str, content: str, tier: int
+    ) -> ApiResponse[RichResponse]:
+        """Extract the page with the models of the cascade from tier onwards
+
+        The quality check runs on the response for the whole page, once any chunks
+        have been merged, and the page is extracted again with the next model if it
+        fails.
+        """
+        logger = logging.getLogger(__name__)
+        models = self.models
+        chunks = self.chunks(url, content)
+        while True:
+            if len(chunks) > 1:
+                response = self.extract_chunks(url, chunks, tier)
+            else:
+                response = self.extract_chunk(url, content, tier)
+            if (
+                tier == len(models) - 1
+                or self.quality_check is None
+                or not isinstance(response, self.response_format)
+            ):
+                return response
+            escalation = self.quality_check(content, response)
+            if escalation is None:
+                return response
+            self.cascade_stats.record_escalation(models[tier], escalation)
+            logger.info(
+                "Escalating %s from %s to %s: %s",
+                url,
+                models[tier],
+                models[tier + 1],
+                escalation,
+            )
+            tier += 1
+
+    def chunks(self, url: str, content: str) -> List[str]:
+        """Split the content into chunks to extract separately, if it's too long"""
+        logger = logging.getLogger(__name__)
+        if self.chunk_tokens and estimate_tokens(content) > self.chunk_tokens:
+            chunks = self.split(content, self.chunk_tokens)
+            if len(chunks) > 1:
+                logger.info("Splitting %s into %d chunks", url, len(chunks))
+                return chunks
+        return [content]
+
+    def split(self, content: str, max_tokens: int) -> List[str]:
+        if self.merge is None:
+            return [content]
+        return split_content(content, max_tokens, int(max_tokens * CHUNK_OVERLAP))
+
+    def extract_chunks(
+        self, url: str, chunks: List[str], tier: int = 0
+    ) -> ApiResponse[RichResponse]:
+        """Extract the chunks of a page in parallel and merge the results"""
+        assert self.merge is not None
+        # Run each chunk in a copy of this thread's context, so its completion is
+        # attributed to the same source
+        contexts = [contextvars.copy_context() for _ in chunks]
+        with ThreadPoolExecutor(
+            max_workers=min(len(chunks), self.chunk_workers),
+            thread_name_prefix="chunk",
+        ) as executor:
+            results = list(
+                executor.map(
+                    lambda context, chunk: context.run(
+                        self.extract_chunk, url, chunk, tier
+                    ),
+                    contexts,
+                    chunks,
+                )
+            )
+        parsed = [
+            result for result in results if isinstance(result, self.response_format)
+        ]
+        if not parsed:
             return None
+        return self.merge(parsed)
 
-        try:
-            completion = self.client.beta.chat.completions.parse(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self.prompt,
-                    },
-                    {
-                        "role": "user",
-                        "content": cleaned,
-                    },
-                ],
-                response_format=self.response_format,
+    def extract_chunk(
+        self, url: str, content: str, tier: int = 0
+    ) -> ApiResponse[RichResponse]:
+        logger = logging.getLogger(__name__)
+        key = None
+        if self.archive is not None or self.completion_cache is not None:
+            key = completion_key(
+                self.cascade_key(tier), self.prompt, self.schema, content
             )
+        if self.archive is not None and key is not None:
+            archived = self.archive.load_completion(key)
+            if archived is not None:
+                logger.debug("Using archived completion for %s", url)
+                if archived.content is None:
+                    return None
+                return self.response_format.model_validate_json(
+                    archived.content, context=SERIALIZED
+                )
+        if self.completion_cache is not None and key is not None:
+            cached = self.load_cached(key, content)
+            if cached is not None:
+                logger.debug("Using cached completion for %s", url)
+                return cached
+
+        try:
+            parsed = self.complete(url, content, tier)
         except openai.AuthenticationError:
             raise
+        except openai.LengthFinishReasonError:
+            tokens = estimate_tokens(content)
+            chunks = (
+                self.split(content, tokens // 2) if tokens >= MIN_CHUNK_TOKENS else []
+            )
+            if len(chunks) < 2:
+                logger.error("Completion for %s was too long", url)
+                return None
+            logger.warning("Completion for %s was too long, splitting it", url)
+            return self.extract_chunks(url, chunks, tier)
         except openai.OpenAIError as error:
             logger.error("Failed to scrape %s: %r", url, error)
             return None
 
+        if self.archive is not None and key is not None:
+            self.archive.store_completion(
+                key,
+                url,
+                None if parsed is None else parsed.model_dump_json(),
+            )
+        # Refusals and empty completions aren't cached, so they're retried next time
+        if self.completion_cache is not None and key is not None and parsed is not None:
+            self.completion_cache.put(key, parsed.model_dump_json())
+        return parsed
+
+    def load_cached(self, key: str, content: str) -> Optional[RichResponse]:
+        logger = logging.getLogger(__name__)
+        assert self.completion_cache is not None
+        cached = self.completion_cache.get(key, current_source())
+        if cached is None:
+            return None
+        try:
+            parsed = self.response_format.model_validate_json(
+                cached, context=SERIALIZED
+            )
+        except ValueError as error:
+            logger.warning("Ignoring invalid cached completion: %r", error)
+            return None
+        self.completion_cache.record_saved(
+            estimate_tokens(self.prompt)
+            + estimate_tokens(content)
+            + estimate_tokens(cached)
+        )
+        return parsed
+
+    def extract_stream(
+        self, url: str, content: str
+    ) -> Generator[Dict[str, Any], None, ApiResponse[RichResponse]]:
+        """Stream the completion, yielding each item of stream_field as it's generated
+
+        Only pages whose response can be used as it's generated are streamed. Without
+        a stream_field, with an archive or escalation models, or if the page is split
+        into chunks, this yields nothing and returns the result of extract(), as it
+        does if the stream fails or is invalid before any items arrive.
+
+        The scheduler's slot is held until the stream ends, including while the caller
+        handles each item, so callers should hand items off rather than process them
+        before asking for the next one.
+        """
+        logger = logging.getLogger(__name__)
+        if (
+            self.stream_field is None
+            or self.archive is not None
+            or self.escalation_models
+            or len(self.chunks(url, content)) > 1
+        ):
+            return self.extract(url, content)
+        key = completion_key(self.model_key, self.prompt, self.schema, content)
+        if self.completion_cache is not None:
+            cached = self.load_cached(key, content)
+            if cached is not None:
+                logger.debug("Using cached completion for %s", url)
+                return cached
+
+        items = JsonArrayItems(self.stream_field)
+        streamed = 0
+        messages = self.messages(content)
+        start = time.monotonic()
+        try:
+            with self.completion_slots or contextlib.nullcontext(), (
+                self.scheduler.slot(self.estimate_request_tokens(messages))
+                if self.scheduler is not None
+                else contextlib.nullcontext()
+            ):
+                with self.client.beta.chat.completions.stream(
+                    model=self.model,
+                    messages=messages,
+                    response_format=self.response_format,
+                    stream_options={"include_usage": True},
+                ) as stream:
+                    for event in stream:
+                        if event.type != "content.delta":
+                            continue
+                        for item in items.feed(event.delta):
+                            streamed += 1
+                            yield item
+                    completion = stream.get_final_completion()
+        except openai.AuthenticationError:
+            raise
+        except (openai.OpenAIError, ValueError) as error:
+            # Responses which don't match the schema raise a ValidationError
+            if not streamed:
+                logger.warning(
+                    "Failed to stream %s, extracting it without streaming: %r",
+                    url,
+                    error,
+                )
+                return self.extract(url, content)
+            logger.error(
+                "Failed to scrape %s after streaming %d items: %r", url, streamed, error
+            )
+            return None
+
         logger.debug("Usage information: %s", completion.usage)
+        if self.ledger is not None:
+            self.ledger.record(
+                self.model, url, completion.usage, time.monotonic() - start
+            )
+        parsed = self.parse_completion(url, completion)
+        if self.completion_cache is not None and parsed is not None:
+            self.completion_cache.put(key, parsed.model_dump_json())
+        return parsed
+
+    def complete(self, url: str, content: str, tier: int = 0) -> Optional[RichResponse]:
+        """Request a completion for the content from the API
+
+        Starting from the model at tier, the completion is escalated to the next model
+        of the cascade if it's refused, invalid or the request fails. The last model's
+        response is used regardless, and its errors are raised. The quality check is
+        left to extract_from(), which sees the whole page.
+        """
+        logger = logging.getLogger(__name__)
+        models = self.models
+        for current in range(tier, len(models)):
+            model = models[current]
+            last = current == len(models) - 1
+            start = time.monotonic()
+            parsed = None
+            escalation = None
+            try:
+                parsed = self.complete_as(
+                    url, self.messages(content), self.response_format, model
+                )
+            # Completions which are too long are split rather than escalated
+            except (openai.AuthenticationError, openai.LengthFinishReasonError):
+                raise
+            except openai.OpenAIError as error:
+                if last:
+                    self.cascade_stats.record(model, time.monotonic() - start, None)
+                    raise
+                logger.warning(
+                    "Completion from %s for %s failed: %r", model, url, error
+                )
+                escalation = f"failed with {type(error).__name__}"
+            except ValueError as error:
+                logger.error("Invalid completion from %s for %s: %r", model, url, error)
+            if parsed is None and escalation is None:
+                escalation = "refused or invalid"
+            self.cascade_stats.record(
+                model, time.monotonic() - start, None if last else escalation
+            )
+            if last or escalation is None:
+                return parsed
+            logger.info(
+                "Escalating %s from %s to %s: %s",
+                url,
+                model,
+                models[current + 1],
+                escalation,
+            )
+        return None
+
+    def needs_escalation(self, content: str, response: RichResponse) -> bool:
+        """Check whether a response from the first model would have been escalated"""
+        return (
+            bool(self.escalation_models)
+            and self.quality_check is not None
+            and self.quality_check(content, response) is not None
+        )
+
+    def complete_as(
+        self,
+        url: str,
+        messages: List[ChatCompletionMessageParam],
+        response_format: Type[Response],
+        model: Optional[str] = None,
+    ) -> Optional[Response]:
+        """Request a completion of the messages, parsed into response_format
+
+        By default, the first model of the cascade is used.
+        """
+        logger = logging.getLogger(__name__)
+        model = model or self.model
+        start = time.monotonic()
+        completion = self.request_completion(url, messages, response_format, model)
 
+        logger.debug("Usage information: %s", completion.usage)
+        if self.ledger is not None:
+            self.ledger.record(model, url, completion.usage, time.monotonic() - start)
+        return self.parse_completion(url, completion)
+
+    def parse_completion(
+        self, url: str, completion: ParsedChatCompletion[Response]
+    ) -> Optional[Response]:
+        logger = logging.getLogger(__name__)
         if len(completion.choices) == 0:
             logger.warning("Model returned no completions for %s", url)
             return None
@@ -74,3 +579,123 @@ class OpenAIApi(Api[RichResponse]):
             logger.warning("Model refused to scrape %s: %r", url, reply.refusal)
             return None
         return reply.parsed
+
+    def request_completion(
+        self,
+        url: str,
+        messages: List[ChatCompletionMessageParam],
+        response_format: Type[Response],
+        model: str,
+    ) -> ParsedChatCompletion[Response]:
+        """Send the request, waiting for the scheduler to allow it if there is one"""
+        with self.completion_slots or contextlib.nullcontext():
+            return self.send_completion(url, messages, response_format, model)
+
+    def send_completion(
+        self,
+        url: str,
+        messages: List[ChatCompletionMessageParam],
+        response_format: Type[Response],
+        model: str,
+    ) -> ParsedChatCompletion[Response]:
+        logger = logging.getLogger(__name__)
+        if self.scheduler is None:
+            return self.client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+            )
+
+        tokens = self.estimate_request_tokens(messages)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self.scheduler.slot(tokens):
+                    response = (
+                        self.client.beta.chat.completions.with_raw_response.parse(
+                            model=model,
+                            messages=messages,
+                            response_format=response_format,
+                        )
+                    )
+            except openai.RateLimitError as error:
+                # Running out of credit won't be fixed by waiting
+                if (
+                    error.code == "insufficient_quota"
+                    or attempt > MAX_COMPLETION_RETRIES
+                ):
+                    raise
+                self.scheduler.rate_limited(parse_rate_limits(error.response.headers))
+                continue
+            except (openai.APIConnectionError, openai.InternalServerError) as error:
+                if attempt > MAX_COMPLETION_RETRIES:
+                    raise
+                delay = min(2.0**attempt, MAX_RETRY_DELAY)
+                logger.warning(
+                    "Completion for %s failed, retrying in %.0f s: %r",
+                    url,
+                    delay,
+                    error,
+                )
+                time.sleep(delay)
+                continue
+            self.scheduler.completed(parse_rate_limits(response.headers))
+            return response.parse()
+
+    def estimate_request_tokens(
+        self, messages: List[ChatCompletionMessageParam]
+    ) -> int:
+        """Estimate the tokens a request counts towards the token rate limit"""
+        return (
+            sum(
+                estimate_tokens(str(message.get("content", ""))) for message in messages
+            )
+            + COMPLETION_TOKENS_ESTIMATE
+        )
+
+    def messages(
+        self, content: str, prompt: Optional[str] = None
+    ) -> List[ChatCompletionMessageParam]:
+        return [
+            {
+                "role": "system",
+                "content": self.prompt if prompt is None else prompt,
+            },
+            {
+                "role": "user",
+                "content": content,
+            },
+        ]
+
+
+class AsyncOpenAIApi(AsyncApi[RichResponse]):
+    """Asynchronous wrapper around OpenAIApi
+
+    Pages are fetched with async_get, so many of them can be in flight at once without
+    needing a thread each. Cleaning and completions are handed to the wrapped
+    OpenAIApi in worker threads, since their throughput is bounded by CPU and OpenAI's
+    rate limits rather than by how many requests are waiting.
+    """
+
+    def __init__(self, api: OpenAIApi[RichResponse]) -> None:
+        self.api = api
+
+    async def scrape(self, url: str) -> ApiResponse[RichResponse]:
+        response = await async_get(url, headers=HTTP_GET_HEADERS)
+        if response is None:
+            return None
+        return await asyncio.to_thread(self.api.parse_content, url, response.text)
+
+    async def scrape_if_modified(self, url: str) -> ApiResponse[RichResponse]:
+        response = await async_get(url, headers=HTTP_GET_HEADERS, hold=True)
+        if response is None:
+            return None
+        if is_not_modified(response):
+            self.api.check_previous(url)
+        parsed = await asyncio.to_thread(self.api.parse_content, url, response.text)
+        if parsed is None:
+            self.api.forget(url)
+        else:
+            self.api.remember(url, parsed)
+        return parsed
@@ -0,0 +1,241 @@
+import concurrent.futures
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Generic, List, Mapping, Optional, Type
+
+import openai
+from pydantic import BaseModel, create_model
+
+from scraper.common.text_processors.tokens import estimate_tokens
+
+from .archive import completion_key
+from .interface import ApiResponse, BatchApi, RichResponse
+from .openai import OpenAIApi
+
+# Maximum estimated tokens of the content packed into one completion
+MAX_PACK_TOKENS = 8000
+PACKING_PROMPT = """
+
+The content contains several web pages, each between <page id="N"> and </page>.
+Extract the information from each page separately, as if it was the only page, into
+the field page_N of the response. Never combine information from different pages.
+"""
+
+
+def page_field(page: int) -> str:
+    return f"page_{page}"
+
+
+def pack_pages(pages: List[str]) -> str:
+    return "\n".join(
+        f'<page id="{page}">\n{content}\n</page>'
+        for page, content in enumerate(pages, 1)
+    )
+
+
+class OpenAIPackedApi(BatchApi[RichResponse]):
+    """Extract information from several small pages with one completion
+
+    Each page is delimited by a numbered tag, and the response has a field for each
+    page holding what was extracted from it, so the prompt and schema are only sent
+    once for all of them. If the packed completion fails, each page is extracted with
+    its own completion instead, as are pages whose response fails the API's quality
+    check when it has models to escalate to.
+
+    Pages whose completion is in the API's completion cache aren't packed, and the
+    response for each packed page is added to the cache.
+    """
+
+    def __init__(self, api: OpenAIApi[RichResponse]) -> None:
+        self.api = api
+        self.prompt = api.prompt + PACKING_PROMPT
+        self.lock = threading.Lock()
+        # Response formats for each number of pages in a pack
+        self.formats: Dict[int, Type[BaseModel]] = {}
+
+    def packed_format(self, size: int) -> Type[BaseModel]:
+        with self.lock:
+            if size not in self.formats:
+                fields: Dict[str, Any] = {
+                    page_field(page): (self.api.response_format, ...)
+                    for page in range(1, size + 1)
+                }
+                self.formats[size] = create_model(
+                    f"Packed{self.api.response_format.__name__}", **fields
+                )
+            return self.formats[size]
+
+    def extract_batch(
+        self, pages: Mapping[str, str]
+    ) -> Dict[str, ApiResponse[RichResponse]]:
+        responses: Dict[str, ApiResponse[RichResponse]] = {}
+        keys: Dict[str, str] = {}
+        if self.api.completion_cache is not None:
+            for url, content in pages.items():
+                keys[url] = completion_key(
+                    self.api.model_key, self.api.prompt, self.api.schema, content
+                )
+                cached = self.api.load_cached(keys[url], content)
+                if cached is not None:
+                    responses[url] = cached
+        uncached = {url: pages[url] for url in pages if url not in responses}
+        if uncached:
+            responses.update(self.extract_packed(uncached, keys))
+        return responses
+
+    def extract_packed(
+        self, pages: Mapping[str, str], keys: Mapping[str, str]
+    ) -> Dict[str, ApiResponse[RichResponse]]:
+        """Extract the pages with one completion, caching each page's response
+
+        keys holds the completion cache key of each page, if there's a cache.
+        """
+        logger = logging.getLogger(__name__)
+        urls = list(pages)
+        if len(urls) == 1:
+            return {urls[0]: self.api.extract(urls[0], pages[urls[0]])}
+
+        description = f"{len(urls)} pages packed with {urls[0]}"
+        packed: Optional[BaseModel] = None
+        start = time.monotonic()
+        try:
+            packed = self.api.complete_as(
+                description,
+                self.api.messages(
+                    pack_pages([pages[url] for url in urls]), self.prompt
+                ),
+                self.packed_format(len(urls)),
+            )
+        except openai.AuthenticationError:
+            raise
+        except openai.OpenAIError as error:
+            logger.warning("Failed to scrape %s: %r", description, error)
+        self.api.cascade_stats.record(self.api.model, time.monotonic() - start, None)
+        if packed is None:
+            logger.info("Extracting %s separately", description)
+            return {url: self.api.extract(url, pages[url]) for url in urls}
+
+        responses: Dict[str, ApiResponse[RichResponse]] = {}
+        for page, url in enumerate(urls, 1):
+            response: RichResponse = getattr(packed, page_field(page))
+            # Cached like the first model's completion for the page on its own, so
+            # pages which are escalated below start from the next model
+            if self.api.completion_cache is not None:
+                self.api.completion_cache.put(keys[url], response.model_dump_json())
+            # Pages which would have been escalated go through the cascade on their own
+            if self.api.needs_escalation(pages[url], response):
+                logger.info("Extracting %s separately from its pack", url)
+                responses[url] = self.api.extract(url, pages[url])
+            else:
+                responses[url] = response
+        return responses
+
+
+@dataclass
+class PendingBatch(Generic[RichResponse]):
+    """Pages waiting in a PageBatcher to be extracted together"""
+
+    # Monotonic time at which to send the batch even if it isn't full
+    deadline: float
+    pages: Dict[str, str] = field(default_factory=dict)
+    tokens: int = 0
+    results: Dict[str, "concurrent.futures.Future[ApiResponse[RichResponse]]"] = field(
+        default_factory=dict
+    )
+
+
+class PageBatcher(Generic[RichResponse]):
+    """Collects pages extracted by different threads into batches for a BatchApi
+
+    extract() blocks until the batch holding the page has been extracted. A batch is
+    sent once it has max_pages pages or no room for another page within max_tokens,
+    or max_wait seconds after its first page was added. It's sent by the thread which
+    filled it, or the first thread to stop waiting for it.
+
+    Each thread waiting on a batch is one that could be doing other work, so
+    max_pages should be no more than the number of threads calling extract().
+    """
+
+    def __init__(
+        self,
+        batch_api: BatchApi[RichResponse],
+        max_pages: int,
+        max_tokens: int = MAX_PACK_TOKENS,
+        max_wait: float = 2.0,
+    ) -> None:
+        self.batch_api = batch_api
+        self.max_pages = max_pages
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.pending: Optional[PendingBatch[RichResponse]] = None
+        self.batches = 0
+        self.pages = 0
+        self.full_batches = 0
+
+    def extract(self, url: str, content: str) -> ApiResponse[RichResponse]:
+        tokens = estimate_tokens(content)
+        if tokens > self.max_tokens:
+            return self.batch_api.extract_batch({url: content}).get(url)
+
+        ready: List[PendingBatch[RichResponse]] = []
+        with self.lock:
+            batch = self.pending
+            if (
+                batch is not None
+                and url not in batch.pages
+                and batch.tokens + tokens > self.max_tokens
+            ):
+                ready.append(batch)
+                self.full_batches += 1
+                batch = None
+            if batch is None:
+                batch = PendingBatch(deadline=time.monotonic() + self.max_wait)
+            self.pending = batch
+            if url not in batch.pages:
+                batch.pages[url] = content
+                batch.tokens += tokens
+                batch.results[url] = concurrent.futures.Future()
+            result = batch.results[url]
+            if len(batch.pages) >= self.max_pages:
+                ready.append(batch)
+                self.pending = None
+                self.full_batches += 1
+        for full in ready:
+            self.send(full)
+
+        try:
+            return result.result(timeout=max(0.0, batch.deadline - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            with self.lock:
+                expired = self.pending is batch
+                if expired:
+                    self.pending = None
+            if expired:
+                self.send(batch)
+            return result.result()
+
+    def send(self, batch: PendingBatch[RichResponse]) -> None:
+        with self.lock:
+            self.batches += 1
+            self.pages += len(batch.pages)
+        try:
+            responses = self.batch_api.extract_batch(batch.pages)
+        except Exception as error:
+            for result in batch.results.values():
+                result.set_exception(error)
+            return
+        for url, result in batch.results.items():
+            result.set_result(responses.get(url))
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        with self.lock:
+            logger.info(
+                "Packed %d pages into %d requests, %d of which were full",
+                self.pages,
+                self.batches,
+                self.full_batches,
+            )
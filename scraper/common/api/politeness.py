@@ -0,0 +1,193 @@
+import datetime
+import email.utils
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+# Default request rate allowed for each host, in requests per second
+DEFAULT_REQUESTS_PER_SECOND = 1.0
+# Number of requests which can be sent to a host in quick succession before the rate
+# limit applies
+DEFAULT_BURST = 2
+# Upper limit on how long a server can ask us to wait, in seconds. Anything longer than
+# this isn't worth waiting for in a single run.
+MAX_DELAY = 300.0
+
+RobotsFetcher = Callable[[str], Optional[str]]
+Clock = Callable[[], float]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse the value of a Retry-After header into a delay in seconds
+
+    The header can either be a number of seconds or an HTTP date. If it's missing or
+    can't be parsed, return None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_DELAY)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    delay = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(max(delay, 0.0), MAX_DELAY)
+
+
+class TokenBucket:
+    """Token bucket which spaces out requests to a steady rate
+
+    Tokens are reserved ahead of time, so the bucket can go into debt. Each caller is
+    told how long to wait for its own token, which keeps requests in order without
+    needing to hold a lock while sleeping. This class is not thread-safe on its own.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Take a token and return how many seconds to wait before using it"""
+        if now > self.updated:
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        self.tokens -= 1
+        # If the bucket is paused, updated is in the future
+        delay = self.updated - now
+        if self.tokens < 0:
+            delay += -self.tokens / self.rate
+        return delay
+
+    def pause_until(self, until: float) -> None:
+        """Stop handing out tokens until the given time, then allow one request"""
+        if until <= self.updated:
+            return
+        self.updated = until
+        self.tokens = min(self.tokens, 1)
+
+
+class HostState:
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.lock = threading.Lock()
+        self.bucket = bucket
+        self.robots: Optional[RobotFileParser] = None
+        self.robots_checked = False
+
+
+class HostScheduler:
+    """Rate limiter which paces the requests sent to each host independently
+
+    Each host (netloc) gets its own token bucket. If the host's robots.txt specifies
+    a Crawl-delay, that is used to set the bucket's rate instead of the default. A
+    host can also be paused for a period, e.g. when it responds with Retry-After.
+
+    Waiting on one host never delays requests to other hosts.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+        burst: int = DEFAULT_BURST,
+        robots_fetcher: Optional[RobotsFetcher] = None,
+        user_agent: str = "*",
+        clock: Clock = time.monotonic,
+    ) -> None:
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.robots_fetcher = robots_fetcher
+        self.user_agent = user_agent
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.hosts: Dict[str, HostState] = {}
+        self.total_delay = 0.0
+
+    def host_state(self, netloc: str) -> HostState:
+        with self.lock:
+            state = self.hosts.get(netloc)
+            if state is None:
+                bucket = TokenBucket(
+                    rate=self.requests_per_second,
+                    capacity=self.burst,
+                    now=self.clock(),
+                )
+                state = HostState(bucket)
+                self.hosts[netloc] = state
+            return state
+
+    def robots(self, url: str) -> Optional[RobotFileParser]:
+        """Return the parsed robots.txt for the URL's host, fetching it if needed"""
+        parsed = urlparse(url)
+        state = self.host_state(parsed.netloc)
+        with state.lock:
+            self.load_robots(parsed.scheme, parsed.netloc, state)
+            return state.robots
+
+    def load_robots(self, scheme: str, netloc: str, state: HostState) -> None:
+        """Fetch robots.txt and apply its Crawl-delay. Caller must hold state.lock."""
+        if state.robots_checked or self.robots_fetcher is None:
+            return
+        state.robots_checked = True
+        logger = logging.getLogger(__name__)
+        text = self.robots_fetcher(f"{scheme}://{netloc}/robots.txt")
+        if text is None:
+            return
+        robots = RobotFileParser()
+        robots.parse(text.splitlines())
+        state.robots = robots
+
+        crawl_delay = robots.crawl_delay(self.user_agent)
+        if crawl_delay:
+            delay = min(float(crawl_delay), MAX_DELAY)
+            logger.info("Using crawl delay of %gs for %s", delay, netloc)
+            state.bucket = TokenBucket(
+                rate=min(1 / delay, self.requests_per_second),
+                capacity=1,
+                now=self.clock(),
+            )
+
+    def reserve(self, url: str) -> float:
+        """Reserve a slot to send a request and return how long to wait for it"""
+        parsed = urlparse(url)
+        state = self.host_state(parsed.netloc)
+        with state.lock:
+            self.load_robots(parsed.scheme, parsed.netloc, state)
+            delay = state.bucket.reserve(self.clock())
+        with self.lock:
+            self.total_delay += delay
+        return delay
+
+    def wait(self, url: str) -> None:
+        """Block until a request can be sent to the URL's host"""
+        delay = self.reserve(url)
+        if delay > 0:
+            logger = logging.getLogger(__name__)
+            logger.debug("Waiting %.1fs before requesting %s", delay, url)
+            time.sleep(delay)
+
+    def defer(self, url: str, seconds: float) -> None:
+        """Block requests to the URL's host for the given number of seconds"""
+        logger = logging.getLogger(__name__)
+        netloc = urlparse(url).netloc
+        state = self.host_state(netloc)
+        seconds = min(seconds, MAX_DELAY)
+        with state.lock:
+            state.bucket.pause_until(self.clock() + seconds)
+        logger.info("Pausing requests to %s for %.0fs", netloc, seconds)
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "Waited a total of %.1fs for rate limits across %d hosts",
+            self.total_delay,
+            len(self.hosts),
+        )
@@ -0,0 +1,233 @@
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Mapping, Optional
+
+from .politeness import MAX_DELAY, parse_retry_after
+
+# Fraction of each rate limit to keep in reserve, since token estimates are rough
+HEADROOM = 0.1
+# Grow the concurrency while more than this fraction of each limit remains
+PLENTY_REMAINING = 0.5
+# Don't shrink the concurrency more than once in this many seconds, so a burst of
+# responses near the limit only halves it once
+DECREASE_INTERVAL = 1.0
+# How long to pause when rate limited without being told how long to wait
+DEFAULT_PAUSE = 1.0
+RESET_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Parse a rate limit reset time like "1s", "6m0s" or "20ms" into seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    parts = RESET_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * UNIT_SECONDS[unit] for number, unit in parts)
+
+
+def parse_count(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """The state of OpenAI's rate limits, as reported with a response"""
+
+    limit_requests: Optional[int]
+    limit_tokens: Optional[int]
+    remaining_requests: Optional[int]
+    remaining_tokens: Optional[int]
+    # Seconds until each limit is fully replenished
+    reset_requests: Optional[float]
+    reset_tokens: Optional[float]
+    # Seconds the server asked us to wait before retrying
+    retry_after: Optional[float] = None
+
+
+def parse_rate_limits(headers: Mapping[str, str]) -> RateLimits:
+    return RateLimits(
+        limit_requests=parse_count(headers.get("x-ratelimit-limit-requests")),
+        limit_tokens=parse_count(headers.get("x-ratelimit-limit-tokens")),
+        remaining_requests=parse_count(headers.get("x-ratelimit-remaining-requests")),
+        remaining_tokens=parse_count(headers.get("x-ratelimit-remaining-tokens")),
+        reset_requests=parse_reset(headers.get("x-ratelimit-reset-requests")),
+        reset_tokens=parse_reset(headers.get("x-ratelimit-reset-tokens")),
+        retry_after=parse_retry_after(headers.get("retry-after")),
+    )
+
+
+def fraction_remaining(
+    remaining: Optional[int], limit: Optional[int]
+) -> Optional[float]:
+    if remaining is None or not limit:
+        return None
+    return remaining / limit
+
+
+class CompletionScheduler:
+    """Adapts how many completions are in flight at once to OpenAI's rate limits
+
+    The concurrency grows by one after each completion which leaves plenty of both
+    the request and token limits remaining, and halves when a response shows either
+    is nearly used up, or when we're rate limited anyway. Before being sent, each
+    request also waits until the tokens it's estimated to use are available in the
+    current window, so we stay just under the limits instead of hitting them.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 64,
+        headroom: float = HEADROOM,
+    ) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.headroom = headroom
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        # Estimated tokens of the requests in flight
+        self.reserved_tokens = 0
+        # Limits reported with the latest response, which apply until the reset times
+        self.remaining_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+        self.paused_until = 0.0
+        self.decreased_at = 0.0
+        self.completions = 0
+        self.rate_limited_count = 0
+        self.peak_limit = initial
+        self.waited = 0.0
+
+    @contextmanager
+    def slot(self, tokens: int) -> Iterator[None]:
+        """Wait until a request estimated to use this many tokens can be sent"""
+        self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release(tokens)
+
+    def delay(self, tokens: int, now: float) -> Optional[float]:
+        """How long to wait before sending a request, or None until one finishes"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if (
+            self.remaining_requests is not None
+            and now < self.requests_reset_at
+            and self.in_flight >= self.remaining_requests * (1 - self.headroom)
+        ):
+            return self.requests_reset_at - now
+        if (
+            self.remaining_tokens is not None
+            and now < self.tokens_reset_at
+            and self.reserved_tokens + tokens
+            > self.remaining_tokens * (1 - self.headroom)
+        ):
+            return self.tokens_reset_at - now
+        return 0.0
+
+    def acquire(self, tokens: int) -> None:
+        with self.condition:
+            start = time.monotonic()
+            while True:
+                delay = self.delay(tokens, time.monotonic())
+                if delay == 0.0:
+                    break
+                self.condition.wait(timeout=delay)
+            self.waited += time.monotonic() - start
+            self.in_flight += 1
+            self.reserved_tokens += tokens
+
+    def release(self, tokens: int) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            self.reserved_tokens -= tokens
+            self.condition.notify_all()
+
+    def record(self, limits: RateLimits, now: float) -> None:
+        if limits.remaining_requests is not None:
+            self.remaining_requests = limits.remaining_requests
+            self.requests_reset_at = now + (limits.reset_requests or 0.0)
+        if limits.remaining_tokens is not None:
+            self.remaining_tokens = limits.remaining_tokens
+            self.tokens_reset_at = now + (limits.reset_tokens or 0.0)
+
+    def decrease(self, now: float) -> None:
+        if now - self.decreased_at < DECREASE_INTERVAL:
+            return
+        self.decreased_at = now
+        self.limit = max(float(self.minimum), self.limit / 2)
+
+    def completed(self, limits: RateLimits) -> None:
+        """Adjust the concurrency after a successful completion"""
+        with self.condition:
+            now = time.monotonic()
+            self.completions += 1
+            self.record(limits, now)
+            fractions = [
+                fraction
+                for fraction in (
+                    fraction_remaining(
+                        limits.remaining_requests, limits.limit_requests
+                    ),
+                    fraction_remaining(limits.remaining_tokens, limits.limit_tokens),
+                )
+                if fraction is not None
+            ]
+            if any(fraction < self.headroom for fraction in fractions):
+                self.decrease(now)
+            elif all(fraction > PLENTY_REMAINING for fraction in fractions):
+                self.limit = min(float(self.maximum), self.limit + 1)
+                self.peak_limit = max(self.peak_limit, int(self.limit))
+            self.condition.notify_all()
+
+    def rate_limited(self, limits: RateLimits) -> float:
+        """Shrink the concurrency and pause after a 429, returning the pause length"""
+        logger = logging.getLogger(__name__)
+        with self.condition:
+            now = time.monotonic()
+            self.rate_limited_count += 1
+            self.record(limits, now)
+            self.decrease(now)
+            pause = min(
+                limits.retry_after
+                or max(limits.reset_requests or 0.0, limits.reset_tokens or 0.0)
+                or DEFAULT_PAUSE,
+                MAX_DELAY,
+            )
+            self.paused_until = max(self.paused_until, now + pause)
+            logger.info(
+                "Rate limited by OpenAI, pausing for %.1f s with up to %d completions "
+                "in flight",
+                pause,
+                int(self.limit),
+            )
+            return pause
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        with self.condition:
+            logger.info(
+                "Completions: %d, rate limited %d times, waited %.1f s in total; "
+                "concurrency reached %d and ended at %d",
+                self.completions,
+                self.rate_limited_count,
+                self.waited,
+                self.peak_limit,
+                int(self.limit),
+            )
@@ -0,0 +1,176 @@
+import datetime
+import json
+import logging
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import (
+    Callable,
+    DefaultDict,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+)
+from urllib.parse import urlparse
+
+from scraper.common.parsers.sitemap import is_under_path, normalize_url, parse_sitemap
+
+from . import http
+from .http import HTTP_GET_HEADERS
+
+# Maximum number of sitemaps to fetch from each host. Large sites split their sitemaps
+# into many pieces, most of which are irrelevant.
+MAX_SITEMAPS_PER_HOST = 10
+# File in the cache directory which records when the last successful run started, and
+# which pages it failed to fetch
+LAST_RUN_FILE = "last_run.json"
+
+SitemapFetcher = Callable[[str], Optional[bytes]]
+Pages = Dict[str, Optional[datetime.datetime]]
+
+
+def fetch_sitemap(url: str) -> Optional[bytes]:
+    response = http.get(url, content_types=None, headers=HTTP_GET_HEADERS)
+    if not response:
+        return None
+    return response.content
+
+
+def load_last_run(directory: Path) -> Optional[datetime.datetime]:
+    """Return the time the last successful run started, if known"""
+    try:
+        with open(directory / LAST_RUN_FILE, encoding="utf-8") as file:
+            return datetime.datetime.fromisoformat(json.load(file)["last_run"])
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+
+def load_failed_pages(directory: Path) -> List[str]:
+    """Return the pages which couldn't be fetched in the last successful run"""
+    try:
+        with open(directory / LAST_RUN_FILE, encoding="utf-8") as file:
+            failed = json.load(file)["failed"]
+    except (OSError, KeyError, TypeError, ValueError):
+        return []
+    if not isinstance(failed, list):
+        return []
+    return [url for url in failed if isinstance(url, str)]
+
+
+def save_last_run(
+    directory: Path, started: datetime.datetime, failed: Iterable[str] = ()
+) -> None:
+    with open(directory / LAST_RUN_FILE, "w", encoding="utf-8") as file:
+        json.dump({"last_run": started.isoformat(), "failed": sorted(failed)}, file)
+
+
+class SitemapDiscovery:
+    """Finds pages in each site's sitemaps and checks whether they've changed
+
+    The sitemaps for each host are fetched once per run, from the locations listed in
+    robots.txt or from /sitemap.xml if there are none. They're fetched with
+    http.get(), so they're rate limited and revalidated against the HTTP cache like any
+    other page.
+
+    Pages whose lastmod is earlier than last_run haven't changed since the last
+    successful run, so there's no need to scrape them again, unless they're among the
+    failed pages which couldn't be fetched in that run.
+    """
+
+    def __init__(
+        self,
+        last_run: Optional[datetime.datetime],
+        fetcher: SitemapFetcher = fetch_sitemap,
+        failed: Iterable[str] = (),
+    ) -> None:
+        self.last_run = last_run
+        self.failed = {normalize_url(url) for url in failed}
+        self.fetcher = fetcher
+        self.lock = threading.Lock()
+        self.host_locks: DefaultDict[str, threading.Lock] = defaultdict(threading.Lock)
+        self.hosts: Dict[str, Pages] = {}
+        # Last modification time of each page found under a source, by normalized URL
+        self.lastmods: Pages = {}
+        self.unchanged = 0
+
+    def discover(self, source: str) -> Pages:
+        """Return the pages listed in the sitemaps which are under the source's path"""
+        logger = logging.getLogger(__name__)
+        pages = {
+            url: lastmod
+            for url, lastmod in self.host_pages(source).items()
+            if is_under_path(url, source)
+        }
+        logger.info("Found %d pages under %s in sitemaps", len(pages), source)
+        with self.lock:
+            for url, lastmod in pages.items():
+                self.lastmods[normalize_url(url)] = lastmod
+        return pages
+
+    def host_pages(self, url: str) -> Pages:
+        netloc = urlparse(url).netloc
+        with self.lock:
+            host_lock = self.host_locks[netloc]
+        # Only fetch each host's sitemaps once, even if it has several sources
+        with host_lock:
+            if netloc not in self.hosts:
+                self.hosts[netloc] = self.fetch_pages(url)
+            return self.hosts[netloc]
+
+    def sitemap_urls(self, url: str) -> List[str]:
+        robots = http.HOST_SCHEDULER.robots(url)
+        listed = robots.site_maps() if robots else None
+        if listed:
+            return listed
+        parsed = urlparse(url)
+        return [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"]
+
+    def fetch_pages(self, url: str) -> Pages:
+        """Fetch all the sitemaps for the URL's host, following sitemap indexes"""
+        logger = logging.getLogger(__name__)
+        pages: Pages = {}
+        pending: Deque[str] = deque(self.sitemap_urls(url))
+        fetched: Set[str] = set()
+        while pending and len(fetched) < MAX_SITEMAPS_PER_HOST:
+            sitemap_url = pending.popleft()
+            if sitemap_url in fetched:
+                continue
+            fetched.add(sitemap_url)
+            logger.debug("Fetching sitemap %s", sitemap_url)
+            content = self.fetcher(sitemap_url)
+            if content is None:
+                continue
+            sitemap = parse_sitemap(content)
+            pages.update(sitemap.pages)
+            # Sitemaps dedicated to events are the most likely to be useful
+            pending.extend(
+                sorted(sitemap.sitemaps, key=lambda child: "event" not in child.lower())
+            )
+        if pending:
+            logger.info("Stopped after %d sitemaps for %s", len(fetched), url)
+        return pages
+
+    def unchanged_since_last_run(self, url: str) -> bool:
+        """Check whether the sitemap says the page hasn't changed since the last run"""
+        if self.last_run is None:
+            return False
+        normalized = normalize_url(url)
+        if normalized in self.failed:
+            return False
+        with self.lock:
+            lastmod = self.lastmods.get(normalized)
+            unchanged = lastmod is not None and lastmod < self.last_run
+            if unchanged:
+                self.unchanged += 1
+        return unchanged
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "Sitemaps listed %d pages under sources, %d skipped as unchanged",
+            len(self.lastmods),
+            self.unchanged,
+        )
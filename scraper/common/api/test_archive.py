@@ -0,0 +1,133 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .archive import completion_key, PageArchive
+from .async_http import async_get
+from .download import TRUNCATED_HEADER
+from .http import get, set_page_archive
+from .test_http_cache import create_response
+
+
+class TestPageArchive(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def test_store_and_load_page(self) -> None:
+        archive = PageArchive(self.directory)
+        archive.store_page(
+            "https://example.com", b"<html></html>", "text/html", "utf-8"
+        )
+        page = archive.load_page("https://example.com")
+        assert page is not None
+        self.assertEqual(page.body, b"<html></html>")
+        self.assertEqual(page.content_type, "text/html")
+        self.assertEqual(page.encoding, "utf-8")
+        self.assertIsNone(archive.load_page("https://example.com/missing"))
+
+    def test_identical_pages_share_blob(self) -> None:
+        archive = PageArchive(self.directory)
+        archive.store_page("https://example.com/a", b"same", None, None)
+        archive.store_page("https://example.com/b", b"same", None, None)
+        self.assertEqual(len(list(self.directory.glob("blobs/*/*.gz"))), 1)
+
+    def test_persists_between_runs(self) -> None:
+        archive = PageArchive(self.directory)
+        archive.store_page("https://example.com", b"old", None, None)
+        archive.store_page("https://example.com", b"new", None, None)
+        archive.store_completion("key", "https://example.com", '{"events": []}')
+
+        reloaded = PageArchive(self.directory, replay=True)
+        page = reloaded.load_page("https://example.com")
+        assert page is not None
+        self.assertEqual(page.body, b"new")
+        completion = reloaded.load_completion("key")
+        assert completion is not None
+        self.assertEqual(completion.content, '{"events": []}')
+        self.assertEqual([page.url for page in reloaded.iter_pages()], [page.url])
+
+    def test_empty_completion(self) -> None:
+        """Should distinguish a recorded empty completion from a missing one"""
+        archive = PageArchive(self.directory)
+        archive.store_completion("key", "https://example.com", None)
+        completion = archive.load_completion("key")
+        assert completion is not None
+        self.assertIsNone(completion.content)
+        self.assertIsNone(archive.load_completion("other"))
+
+    def test_completion_key(self) -> None:
+        key = completion_key("model", "prompt", {"type": "object"}, "content")
+        self.assertEqual(
+            key, completion_key("model", "prompt", {"type": "object"}, "content")
+        )
+        self.assertNotEqual(
+            key, completion_key("model", "new prompt", {"type": "object"}, "content")
+        )
+        self.assertNotEqual(
+            key, completion_key("model", "prompt", {"type": "array"}, "content")
+        )
+
+
+class TestRecordAndReplay(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        set_page_archive(None)
+        self.temp_dir.cleanup()
+
+    def test_record_then_replay(self) -> None:
+        url = "https://example.com"
+        set_page_archive(PageArchive(self.directory))
+        with patch(
+            "scraper.common.api.http.request_and_catch",
+            return_value=create_response(
+                text="<html>événement</html>",
+                headers={"Content-Type": "text/html; charset=utf-8"},
+            ),
+        ):
+            get(url)
+
+        set_page_archive(PageArchive(self.directory, replay=True))
+        with patch("scraper.common.api.http.request_and_catch") as request:
+            response = get(url)
+            missing = get("https://example.com/missing")
+        request.assert_not_called()
+        assert response is not None
+        self.assertEqual(response.text, "<html>événement</html>")
+        self.assertEqual(response.headers["Content-Type"], "text/html; charset=utf-8")
+        self.assertIsNone(missing)
+
+    def test_truncated_not_recorded(self) -> None:
+        url = "https://example.com"
+        archive = PageArchive(self.directory)
+        set_page_archive(archive)
+        with patch(
+            "scraper.common.api.http.request_and_catch",
+            return_value=create_response(
+                text="<html>", headers={TRUNCATED_HEADER: "1"}
+            ),
+        ):
+            self.assertIsNotNone(get(url))
+        self.assertIsNone(archive.load_page(url))
+
+    def test_async_replay(self) -> None:
+        url = "https://example.com"
+        archive = PageArchive(self.directory, replay=True)
+        archive.store_page(url, "<html>é</html>".encode(), "text/html", "utf-8")
+        set_page_archive(archive)
+        response = asyncio.run(async_get(url))
+        assert response is not None
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "<html>é</html>")
+
+
+if __name__ == "__main__":
+    unittest.main()
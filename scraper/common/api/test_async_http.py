@@ -0,0 +1,139 @@
+import asyncio
+import unittest
+from typing import AsyncIterator, List
+from unittest.mock import patch
+
+import httpx
+
+from . import http
+from .async_http import (
+    async_get,
+    async_post,
+    AsyncSessionPool,
+    close_async_session_pool,
+    set_async_session_pool,
+)
+from .http import HttpFatalError
+from .politeness import HostScheduler
+from .timing import current_timing, TimingRecorder
+
+
+class TestAsyncRequests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.original_scheduler = http.HOST_SCHEDULER
+        # Don't rate limit or fetch robots.txt during tests
+        http.set_host_scheduler(HostScheduler(requests_per_second=1000, burst=1000))
+        self.requests: List[httpx.Request] = []
+
+    def tearDown(self) -> None:
+        http.set_host_scheduler(self.original_scheduler)
+
+    def run_with_responses(
+        self,
+        statuses: List[int],
+        method: str = "GET",
+        text: str = "<html></html>",
+        content_type: str = "text/html",
+    ) -> httpx.Response | None:
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            status = statuses[min(len(self.requests), len(statuses)) - 1]
+            # Tell the client not to wait before retrying
+            headers = {"Retry-After": "0", "Content-Type": content_type}
+            return httpx.Response(status, text=text, headers=headers)
+
+        async def run() -> httpx.Response | None:
+            pool = AsyncSessionPool(transport=httpx.MockTransport(handler))
+            set_async_session_pool(pool)
+            try:
+                if method == "GET":
+                    return await async_get("https://example.com/page")
+                return await async_post("https://example.com/api", json={})
+            finally:
+                await close_async_session_pool()
+
+        return asyncio.run(run())
+
+    def test_success(self) -> None:
+        response = self.run_with_responses([200], text="hello")
+        assert response is not None
+        self.assertEqual(response.text, "hello")
+        self.assertEqual(len(self.requests), 1)
+
+    def test_other_content_type_rejected(self) -> None:
+        response = self.run_with_responses([200], content_type="image/png")
+        self.assertIsNone(response)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_post(self) -> None:
+        response = self.run_with_responses([200], method="POST")
+        self.assertIsNotNone(response)
+        self.assertEqual(self.requests[0].method, "POST")
+
+    def test_only_pages_paced(self) -> None:
+        """Should wait for the host scheduler before page fetches but not API calls"""
+        with patch.object(http.HOST_SCHEDULER, "reserve", return_value=0.0) as reserve:
+            self.run_with_responses([200], method="POST")
+            reserve.assert_not_called()
+            self.run_with_responses([200])
+            reserve.assert_called_once_with("https://example.com/page")
+
+    def test_retry_then_success(self) -> None:
+        response = self.run_with_responses([429, 200])
+        self.assertIsNotNone(response)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_retries_exceeded(self) -> None:
+        response = self.run_with_responses([503])
+        self.assertIsNone(response)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_not_retryable(self) -> None:
+        response = self.run_with_responses([404])
+        self.assertIsNone(response)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_fatal(self) -> None:
+        with self.assertRaises(HttpFatalError):
+            self.run_with_responses(
+                [403],
+                text="Your subscription is currently inactive",
+            )
+
+    def test_phases_timed_separately(self) -> None:
+        """Should time connecting, waiting and reading the body of a POST apart"""
+
+        async def body() -> AsyncIterator[bytes]:
+            for _ in range(2):
+                await asyncio.sleep(0.01)
+                yield b"x" * 50
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            timing = current_timing()
+            assert timing is not None
+            await asyncio.sleep(0.05)
+            timing.connect += 0.05
+            return httpx.Response(200, content=body())
+
+        async def run() -> httpx.Response | None:
+            pool = AsyncSessionPool(transport=httpx.MockTransport(handler))
+            set_async_session_pool(pool)
+            try:
+                return await async_post("https://example.com/api", json={})
+            finally:
+                await close_async_session_pool()
+
+        recorder = TimingRecorder()
+        with patch("scraper.common.api.http.REQUEST_TIMINGS", recorder):
+            response = asyncio.run(run())
+        assert response is not None
+        self.assertEqual(response.content, b"x" * 100)
+        [timing] = recorder.timings
+        self.assertEqual(timing.connect, 0.05)
+        self.assertLess(timing.first_byte, 0.04)
+        self.assertGreaterEqual(timing.download, 0.02)
+        self.assertEqual(timing.bytes, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+import json
+import os
+import re
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, cast, Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+import openai
+from pydantic import BaseModel, Field
+
+from scraper.common.stores.completions import CompletionCache
+from scraper.common.stores.sqlite import SqliteStore
+from .batch import OpenAIBatchApi, strict_json_schema
+from .openai import OpenAIApi
+from .rate_limits import CompletionScheduler
+
+
+class Items(BaseModel):
+    items: List[str]
+
+
+class Price(BaseModel):
+    amount: Optional[float] = None
+
+
+class Listing(BaseModel):
+    price: Price = Field(description="The price")
+
+
+def merge_items(responses: List[Items]) -> Items:
+    return Items(
+        items=sorted({item for response in responses for item in response.items})
+    )
+
+
+def list_items(content: str) -> Dict[str, Any]:
+    """Reply to a request like the model would"""
+    items = re.findall(r"<li>(.*?)</li>", content)
+    return {
+        "status_code": 200,
+        "body": {
+            "choices": [
+                {
+                    "finish_reason": "stop",
+                    "message": {
+                        "role": "assistant",
+                        "content": json.dumps({"items": items}),
+                        "refusal": None,
+                    },
+                }
+            ],
+            "usage": {"prompt_tokens": len(content), "completion_tokens": 10},
+        },
+    }
+
+
+class FakeBatchClient:
+    """Local stand-in for the files and batches endpoints of the OpenAI API
+
+    Each batch is in progress the first time it's retrieved, then completed.
+    """
+
+    def __init__(self, reply: Callable[[str], Optional[Dict[str, Any]]]) -> None:
+        self.reply = reply
+        self.files = SimpleNamespace(create=self.create_file, content=self.file_content)
+        self.batches = SimpleNamespace(
+            create=self.create_batch, retrieve=self.retrieve_batch
+        )
+        self.contents: Dict[str, str] = {}
+        self.created: Dict[str, SimpleNamespace] = {}
+        self.requests: List[Dict[str, Any]] = []
+        self.batch_sizes: List[int] = []
+
+    def create_file(self, file: Tuple[str, bytes], purpose: str) -> SimpleNamespace:
+        file_id = f"file-{len(self.contents)}"
+        self.contents[file_id] = file[1].decode()
+        return SimpleNamespace(id=file_id)
+
+    def file_content(self, file_id: str) -> SimpleNamespace:
+        return SimpleNamespace(text=self.contents[file_id])
+
+    def create_batch(
+        self, input_file_id: str, endpoint: str, completion_window: str
+    ) -> SimpleNamespace:
+        requests = [
+            json.loads(line) for line in self.contents[input_file_id].splitlines()
+        ]
+        self.requests.extend(requests)
+        self.batch_sizes.append(len(requests))
+        output: List[str] = []
+        errors: List[str] = []
+        for request in requests:
+            response = self.reply(request["body"]["messages"][-1]["content"])
+            line = {"custom_id": request["custom_id"], "response": response}
+            (output if response else errors).append(json.dumps(line))
+        output_id = f"file-{len(self.contents)}"
+        self.contents[output_id] = "\n".join(output)
+        error_id = f"file-{len(self.contents)}"
+        self.contents[error_id] = "\n".join(errors)
+        batch = SimpleNamespace(
+            id=f"batch-{len(self.batch_sizes)}",
+            status="in_progress",
+            request_counts=SimpleNamespace(completed=len(output), failed=len(errors)),
+            output_file_id=output_id,
+            error_file_id=error_id,
+        )
+        self.created[batch.id] = batch
+        return SimpleNamespace(**vars(batch))
+
+    def retrieve_batch(self, batch_id: str) -> SimpleNamespace:
+        batch = self.created[batch_id]
+        batch.status = "completed"
+        return SimpleNamespace(**vars(batch))
+
+
+def create_batch_api(
+    client: FakeBatchClient,
+    chunk_tokens: Optional[int] = None,
+    max_requests: int = 100,
+    completion_cache: Optional[CompletionCache] = None,
+) -> OpenAIBatchApi[Items]:
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+        api = OpenAIApi[Items](
+            model="test",
+            prompt="List the items",
+            response_format=Items,
+            chunk_tokens=chunk_tokens,
+            merge=merge_items,
+            completion_cache=completion_cache,
+        )
+    return OpenAIBatchApi(
+        api,
+        poll_interval=0,
+        client=cast(openai.OpenAI, client),
+        max_requests=max_requests,
+    )
+
+
+PAGES = {
+    f"https://example.com/{page}": "<body><ul>{}</ul></body>".format(
+        "".join(f"<li>Item {page}-{i:02d}</li>" for i in range(30))
+    )
+    for page in range(3)
+}
+
+
+class TestOpenAIBatchApi(unittest.TestCase):
+    def test_extract_batch(self) -> None:
+        client = FakeBatchClient(list_items)
+        responses = create_batch_api(client).extract_batch(PAGES)
+        self.assertEqual(client.batch_sizes, [3])
+        self.assertEqual(set(responses), set(PAGES))
+        response = responses["https://example.com/1"]
+        assert isinstance(response, Items)
+        self.assertEqual(response.items, [f"Item 1-{i:02d}" for i in range(30)])
+
+    def test_request_format(self) -> None:
+        client = FakeBatchClient(list_items)
+        create_batch_api(client).extract_batch(PAGES)
+        request = client.requests[0]
+        self.assertEqual(request["url"], "/v1/chat/completions")
+        self.assertEqual(request["body"]["model"], "test")
+        self.assertEqual(request["body"]["messages"][0]["content"], "List the items")
+        response_format = request["body"]["response_format"]
+        self.assertEqual(response_format["type"], "json_schema")
+        self.assertTrue(response_format["json_schema"]["strict"])
+        self.assertEqual(response_format["json_schema"]["name"], "Items")
+        schema = response_format["json_schema"]["schema"]
+        self.assertFalse(schema["additionalProperties"])
+
+    def test_chunks_merged(self) -> None:
+        client = FakeBatchClient(list_items)
+        responses = create_batch_api(client, chunk_tokens=50).extract_batch(PAGES)
+        self.assertGreater(client.batch_sizes[0], 3)
+        response = responses["https://example.com/2"]
+        assert isinstance(response, Items)
+        self.assertEqual(response.items, [f"Item 2-{i:02d}" for i in range(30)])
+
+    def test_split_into_batches(self) -> None:
+        client = FakeBatchClient(list_items)
+        responses = create_batch_api(client, max_requests=2).extract_batch(PAGES)
+        self.assertEqual(client.batch_sizes, [2, 1])
+        self.assertTrue(all(responses.values()))
+
+    def test_failed_requests(self) -> None:
+        def reply(content: str) -> Optional[Dict[str, Any]]:
+            if "Item 0-" in content:
+                return None
+            if "Item 1-" in content:
+                return {"status_code": 500, "body": {}}
+            return list_items(content)
+
+        client = FakeBatchClient(reply)
+        with self.assertLogs(level="ERROR"):
+            responses = create_batch_api(client).extract_batch(PAGES)
+        self.assertIsNone(responses["https://example.com/0"])
+        self.assertIsNone(responses["https://example.com/1"])
+        self.assertIsNotNone(responses["https://example.com/2"])
+
+    def test_cached_completions_reused(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = SqliteStore(Path(directory.name) / "completions.sqlite3")
+        self.addCleanup(store.close)
+        cache = CompletionCache(store)
+        first = {url: PAGES[url] for url in list(PAGES)[:2]}
+        create_batch_api(
+            FakeBatchClient(list_items), completion_cache=cache
+        ).extract_batch(first)
+
+        client = FakeBatchClient(list_items)
+        responses = create_batch_api(client, completion_cache=cache).extract_batch(
+            PAGES
+        )
+        self.assertEqual(client.batch_sizes, [1])
+        self.assertEqual(cache.hits, 2)
+        response = responses["https://example.com/0"]
+        assert isinstance(response, Items)
+        self.assertEqual(response.items, [f"Item 0-{i:02d}" for i in range(30)])
+
+    def test_client_retries(self) -> None:
+        """Should retry uploads and polls even if completions aren't retried"""
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](
+                model="test",
+                prompt="List the items",
+                response_format=Items,
+                scheduler=CompletionScheduler(initial=2),
+            )
+        self.assertEqual(api.client.max_retries, 0)
+        batch_api = OpenAIBatchApi(api)
+        self.assertEqual(batch_api.client.max_retries, openai.DEFAULT_MAX_RETRIES)
+
+
+class TestStrictJsonSchema(unittest.TestCase):
+    def test_nested_model(self) -> None:
+        schema = strict_json_schema(Listing.model_json_schema())
+        self.assertFalse(schema["additionalProperties"])
+        price = schema["properties"]["price"]
+        # A $ref can't have a description alongside it, so it's inlined
+        self.assertNotIn("$ref", price)
+        self.assertEqual(price["description"], "The price")
+        self.assertFalse(price["additionalProperties"])
+        self.assertEqual(price["required"], ["amount"])
+        self.assertNotIn("default", price["properties"]["amount"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,26 +1,39 @@
+import io
+import threading
+import time
 import unittest
+from typing import Any, Dict, Optional
 from unittest.mock import patch
 
 import requests
 
+from . import http
+from .download import DownloadLimits
 from .http import (
     check_response,
+    is_truncated,
+    post,
+    read_body,
     request_and_catch,
     HttpRetryableError,
     HttpFatalError,
     RETRYABLE_ERRORS,
+    SessionPool,
 )
+from .timing import current_timing, TimingRecorder
 
 
 def create_response(
     status_code: int,
     reason: str = "",
     text: str = "",
+    headers: Optional[Dict[str, str]] = None,
 ) -> requests.Response:
     response = requests.Response()
     response.status_code = status_code
     response._content = text.encode()  # Response text is stored as bytes
     response.reason = reason
+    response.headers.update(headers or {})
     return response
 
 
@@ -49,6 +62,19 @@ class TestCheckResponse(unittest.TestCase):
                 with self.assertRaises(HttpRetryableError):
                     check_response(response)
 
+    def test_retry_after(self) -> None:
+        """Should report how long the server asked us to wait"""
+        response = create_response(429, headers={"Retry-After": "30"})
+        with self.assertRaises(HttpRetryableError) as context:
+            check_response(response)
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertEqual(context.exception.retry_after, 30.0)
+
+        response = create_response(502, headers={"Retry-After": "30"})
+        with self.assertRaises(HttpRetryableError) as context:
+            check_response(response)
+        self.assertIsNone(context.exception.retry_after)
+
     def test_check_response_other_error(self) -> None:
         """Should return None for non-retryable errors"""
         response = create_response(400)
@@ -66,6 +92,19 @@ class TestRequestAndCatch(unittest.TestCase):
             result = request_and_catch("GET", "https://example.com")
         self.assertEqual(result, response)
 
+    def test_only_pages_paced(self) -> None:
+        """Should wait for the host scheduler before page fetches but not API calls"""
+        with patch(
+            "scraper.common.api.http.SessionPool.session"
+        ) as session, patch.object(http.HOST_SCHEDULER, "wait") as wait:
+            session.return_value.__enter__.return_value.request.return_value = (
+                create_response(200)
+            )
+            post("https://api.example.com/v1", json={})
+            wait.assert_not_called()
+            request_and_catch("GET", "https://example.com/page", paced=True)
+            wait.assert_called_once_with("https://example.com/page")
+
     def test_request_and_catch_retryable_error(self) -> None:
         """Should return None when a retryable error is encountered"""
         for exception_cls in RETRYABLE_ERRORS:
@@ -87,5 +126,126 @@ class TestRequestAndCatch(unittest.TestCase):
                     request_and_catch("GET", "https://example.com")
 
 
+def create_streamed_response(body: bytes, content_type: str) -> requests.Response:
+    response = create_response(200, headers={"Content-Type": content_type})
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class TestReadBody(unittest.TestCase):
+    def test_html_read_in_full(self) -> None:
+        response = create_streamed_response(
+            b"<html></html>", "text/html; charset=utf-8"
+        )
+        result = read_body("https://example.com", response, DownloadLimits())
+        assert result is not None
+        self.assertEqual(result.text, "<html></html>")
+
+    def test_other_content_type_rejected(self) -> None:
+        response = create_streamed_response(b"%PDF-1.4", "application/pdf")
+        result = read_body("https://example.com", response, DownloadLimits())
+        self.assertIsNone(result)
+        # The connection should be closed without reading the body
+        self.assertTrue(response.raw.closed)
+
+    def test_any_content_type(self) -> None:
+        response = create_streamed_response(b"<urlset/>", "application/xml")
+        limits = DownloadLimits(content_types=None)
+        self.assertIsNotNone(read_body("https://example.com", response, limits))
+
+    def test_large_body_truncated(self) -> None:
+        response = create_streamed_response(b"x" * 1000, "text/html")
+        limits = DownloadLimits(max_bytes=100)
+        result = read_body("https://example.com", response, limits)
+        assert result is not None
+        self.assertEqual(result.content, b"x" * 100)
+        self.assertTrue(is_truncated(result))
+
+    def test_complete_body_not_truncated(self) -> None:
+        response = create_streamed_response(b"x" * 100, "text/html")
+        limits = DownloadLimits(max_bytes=100)
+        result = read_body("https://example.com", response, limits)
+        assert result is not None
+        self.assertFalse(is_truncated(result))
+
+
+class SlowBody(io.BytesIO):
+    """Response body which takes a while to read"""
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        time.sleep(0.01)
+        return super().read(size)
+
+
+class TestRequestTiming(unittest.TestCase):
+    def test_phases_timed_separately(self) -> None:
+        """Should time connecting, waiting and reading the body of a POST apart"""
+
+        def send(*args: Any, **kwargs: Any) -> requests.Response:
+            timing = current_timing()
+            assert timing is not None
+            time.sleep(0.05)
+            timing.connect += 0.05
+            response = requests.Response()
+            response.status_code = 200
+            response.raw = SlowBody(b"x" * 100)
+            return response
+
+        recorder = TimingRecorder()
+        with patch("scraper.common.api.http.SessionPool.session") as session, patch(
+            "scraper.common.api.http.REQUEST_TIMINGS", recorder
+        ):
+            session.return_value.__enter__.return_value.request.side_effect = send
+            response = post("https://api.example.com/v1", json={})
+        assert response is not None
+        self.assertEqual(response.content, b"x" * 100)
+        [timing] = recorder.timings
+        self.assertEqual(timing.connect, 0.05)
+        self.assertLess(timing.first_byte, 0.04)
+        self.assertGreaterEqual(timing.download, 0.01)
+        self.assertEqual(timing.bytes, 100)
+
+
+class TestSessionPool(unittest.TestCase):
+    def test_session_reused(self) -> None:
+        """Should hand out the same session once it has been returned"""
+        pool = SessionPool()
+        with pool.session() as first:
+            pass
+        with pool.session() as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_concurrent_sessions_distinct(self) -> None:
+        """Should give each borrower its own session"""
+        pool = SessionPool()
+        with pool.session() as first, pool.session() as second:
+            self.assertIsNot(first, second)
+
+    def test_sessions_share_adapter(self) -> None:
+        """Should share connections between all sessions"""
+        pool = SessionPool()
+        sessions = []
+        lock = threading.Lock()
+
+        def borrow() -> None:
+            with pool.session() as session:
+                with lock:
+                    sessions.append(session)
+
+        threads = [threading.Thread(target=borrow) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for session in sessions:
+            self.assertIs(session.get_adapter("https://example.com"), pool.adapter)
+            self.assertIs(session.get_adapter("http://example.com"), pool.adapter)
+
+    def test_connection_stats_empty(self) -> None:
+        """Should report no connections before any requests are made"""
+        self.assertEqual(SessionPool().connection_stats(), {})
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,280 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict, List, Optional
+from unittest.mock import ANY, patch
+
+import httpx
+import requests
+from pydantic import BaseModel
+
+from .async_http import async_get
+from .download import TRUNCATED_HEADER
+from .http import (
+    commit_cached,
+    get,
+    is_not_modified,
+    load_cached_result,
+    set_http_cache,
+    store_response,
+)
+from .http_cache import HttpCache
+from .interface import PageNotModified
+from .openai import OpenAIApi
+
+
+class Items(BaseModel):
+    items: List[str]
+
+
+def create_response(
+    status_code: int = 200,
+    text: str = "",
+    headers: Optional[Dict[str, str]] = None,
+) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = text.encode()
+    response.encoding = "utf-8"
+    response.headers.update(headers or {})
+    return response
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def test_store_and_lookup(self) -> None:
+        cache = HttpCache(self.directory)
+        response = create_response(
+            text="<html></html>",
+            headers={"ETag": '"abc"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+        )
+        store_response(cache, "https://example.com", response)
+        entry = cache.lookup("https://example.com")
+        assert entry is not None
+        self.assertEqual(
+            entry.conditional_headers(),
+            {
+                "If-None-Match": '"abc"',
+                "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+            },
+        )
+        self.assertEqual(cache.load_body(entry), b"<html></html>")
+
+    def test_not_stored_without_validators(self) -> None:
+        cache = HttpCache(self.directory)
+        store_response(cache, "https://example.com", create_response(text="abc"))
+        self.assertIsNone(cache.lookup("https://example.com"))
+
+    def test_truncated_not_stored(self) -> None:
+        """Should drop any cached copy rather than store a truncated page"""
+        cache = HttpCache(self.directory)
+        url = "https://example.com"
+        store_response(
+            cache, url, create_response(text="<html>", headers={"ETag": '"v1"'})
+        )
+        truncated = create_response(
+            text="<ht", headers={"ETag": '"v2"', TRUNCATED_HEADER: "1"}
+        )
+        store_response(cache, url, truncated)
+        self.assertIsNone(cache.lookup(url))
+
+    def test_persists_between_instances(self) -> None:
+        cache = HttpCache(self.directory)
+        store_response(
+            cache,
+            "https://example.com",
+            create_response(text="abc", headers={"ETag": '"1"'}),
+        )
+        reloaded = HttpCache(self.directory)
+        self.assertIsNotNone(reloaded.lookup("https://example.com"))
+
+    def test_lru_eviction(self) -> None:
+        cache = HttpCache(self.directory, max_bytes=10)
+        headers = {"ETag": '"1"'}
+        store_response(
+            cache, "https://a.com", create_response(text="aaaa", headers=headers)
+        )
+        store_response(
+            cache, "https://b.com", create_response(text="bbbb", headers=headers)
+        )
+        # Use a.com so that b.com becomes the least recently used
+        self.assertIsNotNone(cache.lookup("https://a.com"))
+        store_response(
+            cache, "https://c.com", create_response(text="cccc", headers=headers)
+        )
+        self.assertIsNotNone(cache.lookup("https://a.com"))
+        self.assertIsNone(cache.lookup("https://b.com"))
+        self.assertIsNotNone(cache.lookup("https://c.com"))
+
+    def test_invalidate(self) -> None:
+        cache = HttpCache(self.directory)
+        store_response(
+            cache,
+            "https://example.com",
+            create_response(text="abc", headers={"ETag": '"1"'}),
+        )
+        cache.invalidate("https://example.com")
+        self.assertIsNone(cache.lookup("https://example.com"))
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_held_until_committed(self) -> None:
+        cache = HttpCache(self.directory)
+        url = "https://example.com"
+        response = create_response(text="<html>", headers={"ETag": '"v1"'})
+        store_response(cache, url, response, hold=True)
+        self.assertIsNone(cache.lookup(url))
+        self.assertIsNone(HttpCache(self.directory).lookup(url))
+        cache.commit(url, '{"events": []}')
+        entry = cache.lookup(url)
+        assert entry is not None
+        self.assertEqual(cache.load_body(entry), b"<html>")
+        self.assertEqual(cache.load_result(url), '{"events": []}')
+
+    def test_hold_drops_older_copy(self) -> None:
+        """Should fetch the page in full next time if the new copy isn't committed"""
+        cache = HttpCache(self.directory)
+        url = "https://example.com"
+        store_response(cache, url, create_response(headers={"ETag": '"v1"'}))
+        store_response(cache, url, create_response(headers={"ETag": '"v2"'}), True)
+        self.assertIsNone(cache.lookup(url))
+        cache.invalidate(url)
+        cache.commit(url, "result")
+        self.assertIsNone(cache.lookup(url))
+
+    def test_commit_unchanged(self) -> None:
+        """Should save the result to the existing entry if nothing is held"""
+        cache = HttpCache(self.directory)
+        url = "https://example.com"
+        store_response(cache, url, create_response(headers={"ETag": '"v1"'}))
+        self.assertIsNone(cache.load_result(url))
+        cache.commit(url, "result")
+        self.assertEqual(HttpCache(self.directory).load_result(url), "result")
+
+
+class TestConditionalGet(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = HttpCache(Path(self.temp_dir.name))
+        set_http_cache(self.cache)
+
+    def tearDown(self) -> None:
+        set_http_cache(None)
+        self.temp_dir.cleanup()
+
+    def test_not_modified(self) -> None:
+        """Should send validators and fill in the body from the cache on 304"""
+        url = "https://example.com"
+        first = create_response(
+            text="<html>cached</html>",
+            headers={"ETag": '"v1"', "Content-Type": "text/html"},
+        )
+        with patch(
+            "scraper.common.api.http.request_and_catch",
+            return_value=first,
+        ):
+            response = get(url, headers={"Accept": "text/html"})
+        assert response is not None
+        self.assertFalse(is_not_modified(response))
+
+        with patch(
+            "scraper.common.api.http.request_and_catch",
+            return_value=create_response(status_code=304),
+        ) as request:
+            response = get(url, headers={"Accept": "text/html"})
+        request.assert_called_once_with(
+            "GET",
+            url,
+            headers={"Accept": "text/html", "If-None-Match": '"v1"'},
+            limits=ANY,
+            paced=True,
+        )
+        assert response is not None
+        self.assertTrue(is_not_modified(response))
+        self.assertEqual(response.text, "<html>cached</html>")
+        self.assertEqual(response.headers["Content-Type"], "text/html")
+
+    def test_hold(self) -> None:
+        """Should only store a held page once it's committed"""
+        url = "https://example.com"
+        with patch(
+            "scraper.common.api.http.request_and_catch",
+            return_value=create_response(text="<html>", headers={"ETag": '"v1"'}),
+        ):
+            get(url, hold=True)
+        self.assertIsNone(self.cache.lookup(url))
+        commit_cached(url, "result")
+        self.assertIsNotNone(self.cache.lookup(url))
+        self.assertEqual(load_cached_result(url), "result")
+
+    def test_previous_response_reused(self) -> None:
+        """Should raise PageNotModified with the saved response of an unchanged page"""
+        url = "https://example.com"
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](model="test", prompt="", response_format=Items)
+        page = create_response(text="<li>a", headers={"ETag": '"v1"'})
+        not_modified = create_response(status_code=304)
+        with patch("scraper.common.api.http.request_and_catch", return_value=page):
+            api.fetch(url, if_modified=True)
+        api.remember(url, Items(items=["a"]))
+        with patch(
+            "scraper.common.api.http.request_and_catch", return_value=not_modified
+        ), self.assertRaises(PageNotModified) as raised:
+            api.fetch(url, if_modified=True)
+        self.assertEqual(raised.exception.response, Items(items=["a"]))
+
+    def test_unchanged_page_without_response(self) -> None:
+        """Should return an unchanged page if nothing was saved from it"""
+        url = "https://example.com"
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](model="test", prompt="", response_format=Items)
+        page = create_response(text="<li>a", headers={"ETag": '"v1"'})
+        not_modified = create_response(status_code=304)
+        with patch("scraper.common.api.http.request_and_catch", return_value=page):
+            api.fetch(url, if_modified=True)
+        api.remember(url, None)
+        with patch(
+            "scraper.common.api.http.request_and_catch", return_value=not_modified
+        ):
+            self.assertEqual(api.fetch(url, if_modified=True), "<li>a")
+
+    def test_not_modified_async(self) -> None:
+        """Should revalidate pages fetched asynchronously the same way"""
+        url = "https://example.com"
+        store_response(
+            self.cache,
+            url,
+            create_response(
+                text="<html>cached</html>",
+                headers={"ETag": '"v1"', "Content-Type": "text/html"},
+            ),
+        )
+        with patch(
+            "scraper.common.api.async_http.async_request_and_catch",
+            return_value=httpx.Response(
+                304, request=httpx.Request("GET", url), headers={"ETag": '"v1"'}
+            ),
+        ) as request:
+            response = asyncio.run(async_get(url, headers={"Accept": "text/html"}))
+        request.assert_called_once_with(
+            "GET",
+            url,
+            headers={"Accept": "text/html", "If-None-Match": '"v1"'},
+            limits=ANY,
+            paced=True,
+        )
+        assert response is not None
+        self.assertTrue(is_not_modified(response))
+        self.assertEqual(response.text, "<html>cached</html>")
+        self.assertEqual(response.headers["Content-Type"], "text/html")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,602 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Set
+from unittest.mock import patch
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+from scraper.common.stores.completions import CompletionCache
+from scraper.common.stores.sqlite import SqliteStore
+
+from .interface import ApiResponse
+from .openai import AsyncOpenAIApi, OpenAIApi
+from .rate_limits import CompletionScheduler
+from .timing import request_source
+from .usage import UsageLedger
+
+
+class Items(BaseModel):
+    items: List[str]
+
+
+def merge_items(responses: List[Items]) -> Items:
+    return Items(
+        items=sorted({item for response in responses for item in response.items})
+    )
+
+
+def create_api(chunk_tokens: Optional[int]) -> OpenAIApi[Items]:
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+        return OpenAIApi[Items](
+            model="test",
+            prompt="List the items",
+            response_format=Items,
+            chunk_tokens=chunk_tokens,
+            merge=merge_items,
+        )
+
+
+def list_items(content: str) -> Items:
+    return Items(items=re.findall(r"<li>(.*?)</li>", content))
+
+
+PAGE = "<body><ul>{}</ul></body>".format(
+    "".join(f"<li>Item {i:02d}</li>" for i in range(30))
+)
+ALL_ITEMS = [f"Item {i:02d}" for i in range(30)]
+
+
+class TestChunkedExtraction(unittest.TestCase):
+    def test_small_page(self) -> None:
+        api = create_api(chunk_tokens=10000)
+        with patch.object(
+            api, "complete", side_effect=lambda url, content, tier: list_items(content)
+        ) as complete:
+            response = api.extract("https://example.com", PAGE)
+        complete.assert_called_once()
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+
+    def test_chunked_page(self) -> None:
+        api = create_api(chunk_tokens=50)
+        threads: Set[str] = set()
+
+        def complete(url: str, content: str, tier: int) -> Items:
+            threads.add(threading.current_thread().name)
+            # Give the other chunks a chance to start in parallel
+            time.sleep(0.02)
+            return list_items(content)
+
+        with patch.object(api, "complete", side_effect=complete) as mock:
+            response = api.extract("https://example.com", PAGE)
+        self.assertGreater(mock.call_count, 1)
+        self.assertGreater(len(threads), 1)
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+
+    def test_completions_limited_across_chunks(self) -> None:
+        lock = threading.Lock()
+        in_flight = [0]
+        peak = [0]
+
+        def handle(request: httpx.Request) -> httpx.Response:
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            content = json.loads(request.content)["messages"][-1]["content"]
+            return completion_response(content, {})
+
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](
+                model="test",
+                prompt="List the items",
+                response_format=Items,
+                chunk_tokens=50,
+                merge=merge_items,
+                max_completions=2,
+            )
+            api.client = openai.OpenAI(
+                http_client=httpx.Client(transport=httpx.MockTransport(handle))
+            )
+        with self.assertLogs(level="INFO"):
+            response = api.extract("https://example.com", PAGE)
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+        self.assertEqual(peak[0], 2)
+
+    def test_chunking_disabled(self) -> None:
+        api = create_api(chunk_tokens=None)
+        with patch.object(
+            api, "complete", side_effect=lambda url, content, tier: list_items(content)
+        ) as complete:
+            api.extract("https://example.com", PAGE)
+        complete.assert_called_once()
+
+    def test_split_when_too_long(self) -> None:
+        """Should split the content further if the completion was cut off"""
+        api = create_api(chunk_tokens=None)
+        # The whole page is too long, but halves of it are fine
+        big_page = "<body><ul>{}</ul></body>".format(
+            "".join(f"<li>Item {i:03d} {'x' * 50}</li>" for i in range(100))
+        )
+
+        def complete(url: str, content: str, tier: int) -> Items:
+            if len(content) > len(big_page) * 0.6:
+                raise openai.LengthFinishReasonError(
+                    completion=ChatCompletion.model_construct(usage=None)
+                )
+            return list_items(content)
+
+        with patch.object(api, "complete", side_effect=complete):
+            response = api.extract("https://example.com", big_page)
+        assert isinstance(response, Items)
+        self.assertEqual(len(response.items), 100)
+
+
+class TestContentFormat(unittest.TestCase):
+    def test_source_formats(self) -> None:
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](
+                model="test",
+                prompt="List the items",
+                response_format=Items,
+                source_formats={"example.com": "markdown"},
+            )
+        page = '<html><body><h1>Items</h1><a href="/a">A</a></body></html>'
+        self.assertEqual(
+            api.clean("https://www.example.com/events", page),
+            "# Items\n[A](/a)",
+        )
+        self.assertEqual(
+            api.clean("https://example.org/events", page),
+            '<body><h1>Items</h1><a href="/a">A</a></body>',
+        )
+
+
+def completion_response(content: str, headers: dict[str, str]) -> httpx.Response:
+    return httpx.Response(
+        200,
+        headers=headers,
+        json={
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "test",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {
+                        "role": "assistant",
+                        "content": json.dumps(list_items(content).model_dump()),
+                    },
+                }
+            ],
+            "usage": {
+                "prompt_tokens": len(content),
+                "completion_tokens": 10,
+                "total_tokens": len(content) + 10,
+            },
+        },
+    )
+
+
+class TestUsageLedger(unittest.TestCase):
+    def test_usage_recorded(self) -> None:
+        ledger = UsageLedger()
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](
+                model="gpt-4o-mini",
+                prompt="List the items",
+                response_format=Items,
+                ledger=ledger,
+            )
+            api.client = openai.OpenAI(
+                http_client=httpx.Client(
+                    transport=httpx.MockTransport(
+                        lambda request: completion_response(
+                            json.loads(request.content)["messages"][-1]["content"], {}
+                        )
+                    )
+                ),
+            )
+        with request_source("https://example.com"):
+            api.extract("https://example.com/events", PAGE)
+        self.assertEqual(ledger.sources["https://example.com"].calls, 1)
+        page = ledger.pages["https://example.com/events"]
+        self.assertEqual(page.prompt_tokens, len(PAGE))
+        self.assertEqual(page.completion_tokens, 10)
+        self.assertGreater(page.cost, 0)
+
+
+class TestCompletionCache(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "completions.sqlite3"
+
+    def create_api(self, prompt: str = "List the items") -> OpenAIApi[Items]:
+        store = SqliteStore(self.path)
+        self.addCleanup(store.close)
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            return OpenAIApi[Items](
+                model="test",
+                prompt=prompt,
+                response_format=Items,
+                completion_cache=CompletionCache(store),
+            )
+
+    def test_reused_by_later_run(self) -> None:
+        api = self.create_api()
+        with patch.object(
+            api, "complete", side_effect=lambda url, content, tier: list_items(content)
+        ):
+            api.extract("https://example.com", PAGE)
+        api = self.create_api()
+        with patch.object(api, "complete") as complete:
+            response = api.extract("https://example.com/other", PAGE)
+        complete.assert_not_called()
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+        assert api.completion_cache is not None
+        self.assertEqual(api.completion_cache.hits, 1)
+        self.assertGreater(api.completion_cache.saved_tokens, 0)
+        with self.assertLogs(level="INFO") as logs:
+            api.completion_cache.log_stats()
+        self.assertIn("1 hits of 1 lookups (100%)", logs.output[0])
+
+    def test_hits_per_source(self) -> None:
+        api = self.create_api()
+        with patch.object(
+            api, "complete", side_effect=lambda url, content, tier: list_items(content)
+        ), request_source("https://example.com/events"):
+            api.extract("https://example.com", PAGE)
+            api.extract("https://example.com", PAGE)
+        assert api.completion_cache is not None
+        self.assertEqual(
+            api.completion_cache.source_hits["https://example.com/events"], 1
+        )
+        self.assertEqual(
+            api.completion_cache.source_misses["https://example.com/events"], 1
+        )
+        with self.assertLogs(level="INFO") as logs:
+            api.completion_cache.log_stats()
+        self.assertIn("https://example.com/events: 1 hits, 1 misses", logs.output[1])
+
+    def test_reused_by_async_scrape(self) -> None:
+        """Should reuse completions for unchanged pages when scraping with asyncio"""
+
+        async def fetch_page(url: str, **kwargs: Any) -> httpx.Response:
+            return httpx.Response(200, text=PAGE, request=httpx.Request("GET", url))
+
+        async def scrape(api: OpenAIApi[Items]) -> ApiResponse[Items]:
+            with request_source("https://example.com/events"):
+                return await AsyncOpenAIApi(api).scrape("https://example.com")
+
+        first = self.create_api()
+        with patch("scraper.common.api.openai.async_get", fetch_page), patch.object(
+            first,
+            "complete",
+            side_effect=lambda url, content, tier: list_items(content),
+        ):
+            asyncio.run(scrape(first))
+        second = self.create_api()
+        with patch("scraper.common.api.openai.async_get", fetch_page), patch.object(
+            second, "complete"
+        ) as complete:
+            response = asyncio.run(scrape(second))
+        complete.assert_not_called()
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+        assert second.completion_cache is not None
+        self.assertEqual(
+            second.completion_cache.source_hits["https://example.com/events"], 1
+        )
+
+    def test_prompt_changed(self) -> None:
+        api = self.create_api()
+        with patch.object(
+            api, "complete", side_effect=lambda url, content, tier: list_items(content)
+        ):
+            api.extract("https://example.com", PAGE)
+        api = self.create_api(prompt="List the items again")
+        with patch.object(
+            api, "complete", side_effect=lambda url, content, tier: list_items(content)
+        ) as complete:
+            api.extract("https://example.com", PAGE)
+        complete.assert_called_once()
+
+    def test_refusals_not_cached(self) -> None:
+        api = self.create_api()
+        with patch.object(api, "complete", return_value=None):
+            self.assertIsNone(api.extract("https://example.com", PAGE))
+        with patch.object(
+            api, "complete", side_effect=lambda url, content, tier: list_items(content)
+        ) as complete:
+            api.extract("https://example.com", PAGE)
+        complete.assert_called_once()
+
+
+def check_items(content: str, response: Items) -> Optional[str]:
+    if "<li>" in content and not response.items:
+        return "no items"
+    return None
+
+
+class TestModelCascade(unittest.TestCase):
+    def create_api(self, escalation_models: List[str]) -> OpenAIApi[Items]:
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            return OpenAIApi[Items](
+                model="cheap",
+                prompt="List the items",
+                response_format=Items,
+                escalation_models=escalation_models,
+                quality_check=check_items,
+            )
+
+    def test_cheap_model_accepted(self) -> None:
+        api = self.create_api(["strong"])
+        with patch.object(
+            api,
+            "complete_as",
+            side_effect=lambda url, messages, response_format, model: list_items(
+                messages[-1]["content"]
+            ),
+        ) as complete_as:
+            response = api.extract("https://example.com", PAGE)
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+        self.assertEqual(complete_as.call_args.args[3], "cheap")
+        self.assertEqual(api.cascade_stats.calls, {"cheap": 1})
+
+    def test_escalated(self) -> None:
+        api = self.create_api(["medium", "strong"])
+        replies = {"cheap": Items(items=[]), "medium": None}
+
+        def complete_as(
+            url: str, messages: Any, response_format: Any, model: str
+        ) -> Optional[Items]:
+            if model in replies:
+                return replies[model]
+            return list_items(messages[-1]["content"])
+
+        with patch.object(api, "complete_as", side_effect=complete_as):
+            with self.assertLogs(level="INFO") as logs:
+                response = api.extract("https://example.com", PAGE)
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+        self.assertEqual(
+            api.cascade_stats.calls, {"cheap": 1, "medium": 1, "strong": 1}
+        )
+        self.assertEqual(
+            api.cascade_stats.escalations,
+            {("cheap", "no items"): 1, ("medium", "refused or invalid"): 1},
+        )
+        self.assertIn("from cheap to medium: no items", logs.output[0])
+
+    def test_last_model_used_regardless(self) -> None:
+        api = self.create_api([])
+        with patch.object(api, "complete_as", return_value=Items(items=[])):
+            response = api.extract("https://example.com", PAGE)
+        self.assertEqual(response, Items(items=[]))
+        self.assertEqual(api.cascade_stats.escalations, {})
+
+    def test_checked_after_merging_chunks(self) -> None:
+        """Should only escalate if the merged response for the page fails the check"""
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](
+                model="cheap",
+                prompt="List the items",
+                response_format=Items,
+                chunk_tokens=50,
+                merge=merge_items,
+                escalation_models=["strong"],
+                quality_check=check_items,
+            )
+
+        def complete_as(
+            url: str, messages: Any, response_format: Any, model: str
+        ) -> Optional[Items]:
+            content = messages[-1]["content"]
+            # One chunk on its own has no items
+            if "Item 00" in content:
+                return Items(items=[])
+            return list_items(content)
+
+        with patch.object(api, "complete_as", side_effect=complete_as):
+            response = api.extract("https://example.com", PAGE)
+        assert isinstance(response, Items)
+        self.assertIn("Item 29", response.items)
+        self.assertEqual(set(api.cascade_stats.calls), {"cheap"})
+        self.assertEqual(api.cascade_stats.escalations, {})
+
+    def test_failed_request_escalated(self) -> None:
+        api = self.create_api(["strong"])
+
+        def complete_as(
+            url: str, messages: Any, response_format: Any, model: str
+        ) -> Optional[Items]:
+            if model == "cheap":
+                raise openai.APIConnectionError(
+                    request=httpx.Request("POST", "https://api.openai.com")
+                )
+            return list_items(messages[-1]["content"])
+
+        with patch.object(api, "complete_as", side_effect=complete_as):
+            with self.assertLogs(level="WARNING"):
+                response = api.extract("https://example.com", PAGE)
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+        self.assertEqual(
+            api.cascade_stats.escalations,
+            {("cheap", "failed with APIConnectionError"): 1},
+        )
+
+    def test_last_model_errors_raised(self) -> None:
+        api = self.create_api([])
+        error = openai.APIConnectionError(
+            request=httpx.Request("POST", "https://api.openai.com")
+        )
+        with patch.object(api, "complete_as", side_effect=error):
+            with self.assertLogs(level="ERROR"):
+                self.assertIsNone(api.extract("https://example.com", PAGE))
+        self.assertEqual(api.cascade_stats.calls, {"cheap": 1})
+
+    def test_model_in_cache_key(self) -> None:
+        self.assertEqual(self.create_api([]).model_key, "cheap")
+        self.assertEqual(self.create_api(["strong"]).model_key, "cheap>strong")
+
+
+class TestScheduledCompletions(unittest.TestCase):
+    def test_rate_limited_retry(self) -> None:
+        """Should wait and retry a rate limited completion itself"""
+        requests: List[httpx.Request] = []
+        limit_headers = {
+            "x-ratelimit-limit-requests": "100",
+            "x-ratelimit-remaining-requests": "99",
+            "x-ratelimit-reset-requests": "10ms",
+        }
+
+        def handle(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            if len(requests) == 1:
+                return httpx.Response(
+                    429,
+                    headers={**limit_headers, "x-ratelimit-remaining-requests": "0"},
+                    json={"error": {"message": "Slow down", "code": None}},
+                )
+            content = json.loads(request.content)["messages"][-1]["content"]
+            return completion_response(content, limit_headers)
+
+        scheduler = CompletionScheduler(initial=2)
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Items](
+                model="test",
+                prompt="List the items",
+                response_format=Items,
+                scheduler=scheduler,
+            )
+            api.client = openai.OpenAI(
+                max_retries=0,
+                http_client=httpx.Client(transport=httpx.MockTransport(handle)),
+            )
+        with self.assertLogs(level="INFO"):
+            response = api.extract("https://example.com", PAGE)
+        self.assertEqual(response, Items(items=ALL_ITEMS))
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(scheduler.rate_limited_count, 1)
+        self.assertEqual(scheduler.completions, 1)
+
+
+class Entry(BaseModel):
+    name: str
+
+
+class Entries(BaseModel):
+    entries: List[Entry]
+
+
+def stream_response(deltas: List[str], sent: List[str]) -> httpx.Response:
+    """Stream a completion made of the deltas, recording each one as it's sent"""
+
+    def chunk(delta: dict[str, Any], **fields: Any) -> bytes:
+        body = {
+            "id": "chatcmpl-test",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "test",
+            "choices": [{"index": 0, "delta": delta, **fields}],
+        }
+        return f"data: {json.dumps(body)}\n\n".encode()
+
+    def events() -> Iterator[bytes]:
+        yield chunk({"role": "assistant", "content": ""})
+        for delta in deltas:
+            sent.append(delta)
+            yield chunk({"content": delta})
+        yield chunk({}, finish_reason="stop")
+        yield b"data: [DONE]\n\n"
+
+    return httpx.Response(
+        200, headers={"content-type": "text/event-stream"}, content=events()
+    )
+
+
+class TestStreamedCompletions(unittest.TestCase):
+    def create_api(
+        self, handle: Callable[[httpx.Request], httpx.Response]
+    ) -> OpenAIApi[Entries]:
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            api = OpenAIApi[Entries](
+                model="test",
+                prompt="List the entries",
+                response_format=Entries,
+                stream_field="entries",
+            )
+            api.client = openai.OpenAI(
+                max_retries=0,
+                http_client=httpx.Client(transport=httpx.MockTransport(handle)),
+            )
+        return api
+
+    def test_items_yielded_as_generated(self) -> None:
+        sent: List[str] = []
+        deltas = ['{"entries": [{"na', 'me": "a"},', ' {"name": "b"}', "]}"]
+        api = self.create_api(lambda request: stream_response(deltas, sent))
+        stream = api.extract_stream("https://example.com", "<p>a b</p>")
+        self.assertEqual(next(stream), {"name": "a"})
+        # The rest of the completion hasn't been generated yet
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(next(stream), {"name": "b"})
+        with self.assertRaises(StopIteration) as stop:
+            next(stream)
+        self.assertEqual(
+            stop.exception.value, Entries(entries=[Entry(name="a"), Entry(name="b")])
+        )
+
+    def test_failure_before_items_extracts_normally(self) -> None:
+        api = self.create_api(
+            lambda request: httpx.Response(
+                500, json={"error": {"message": "Failed", "code": None}}
+            )
+        )
+        with patch.object(
+            api, "extract", return_value=Entries(entries=[])
+        ) as extract, self.assertLogs(level="WARNING"):
+            stream = api.extract_stream("https://example.com", "<p></p>")
+            self.assertEqual(list(stream), [])
+        extract.assert_called_once()
+
+    def test_invalid_completion(self) -> None:
+        deltas = ['{"entries": [{"name": "a"}, {"name": 1}]}']
+        api = self.create_api(lambda request: stream_response(deltas, []))
+        with patch.object(api, "extract") as extract, self.assertLogs(level="ERROR"):
+            stream = api.extract_stream("https://example.com", "<p>a 1</p>")
+            self.assertEqual(list(stream), [{"name": "a"}, {"name": 1}])
+        extract.assert_not_called()
+
+    def test_invalid_before_items_extracts_normally(self) -> None:
+        deltas = ['{"entries": "none"}']
+        api = self.create_api(lambda request: stream_response(deltas, []))
+        with patch.object(
+            api, "extract", return_value=Entries(entries=[])
+        ) as extract, self.assertLogs(level="WARNING"):
+            stream = api.extract_stream("https://example.com", "<p>none</p>")
+            self.assertEqual(list(stream), [])
+        extract.assert_called_once()
+
+    def test_not_streamed_without_field(self) -> None:
+        api = self.create_api(lambda request: stream_response([], []))
+        api.stream_field = None
+        with patch.object(api, "extract", return_value=None) as extract:
+            self.assertEqual(list(api.extract_stream("https://example.com", "")), [])
+        extract.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,241 @@
+import os
+import re
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Type
+from unittest.mock import patch
+
+from pydantic import BaseModel
+
+from scraper.common.stores.completions import CompletionCache
+from scraper.common.stores.sqlite import SqliteStore
+from .interface import ApiResponse, BatchApi
+from .openai import OpenAIApi
+from .packing import OpenAIPackedApi, pack_pages, PageBatcher
+
+
+class Items(BaseModel):
+    items: List[str]
+
+
+def list_items(content: str) -> Items:
+    return Items(items=re.findall(r"<li>(.*?)</li>", content))
+
+
+def create_packed_api(
+    completion_cache: Optional[CompletionCache] = None,
+) -> OpenAIPackedApi[Items]:
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+        api = OpenAIApi[Items](
+            model="test",
+            prompt="List the items",
+            response_format=Items,
+            completion_cache=completion_cache,
+        )
+    return OpenAIPackedApi(api)
+
+
+def complete_packed(
+    url: str,
+    messages: Any,
+    response_format: Type[BaseModel],
+    model: Optional[str] = None,
+) -> BaseModel:
+    """Reply to a packed completion like the model would"""
+    pages = re.findall(
+        r'<page id="(\d+)">(.*?)</page>', messages[-1]["content"], re.DOTALL
+    )
+    return response_format(
+        **{f"page_{page}": list_items(content) for page, content in pages}
+    )
+
+
+PAGES = {
+    f"https://example.com/{page}": f"<ul><li>Item {page}</li></ul>" for page in range(3)
+}
+
+
+class TestOpenAIPackedApi(unittest.TestCase):
+    def test_one_completion(self) -> None:
+        packed_api = create_packed_api()
+
+        def complete_as(
+            url: str,
+            messages: Any,
+            response_format: Type[BaseModel],
+            model: Optional[str] = None,
+        ) -> BaseModel:
+            self.assertIn('<page id="1">', messages[-1]["content"])
+            self.assertIn("page_N", messages[0]["content"])
+            return complete_packed(url, messages, response_format, model)
+
+        with patch.object(
+            packed_api.api, "complete_as", side_effect=complete_as
+        ) as mock:
+            responses = packed_api.extract_batch(PAGES)
+        mock.assert_called_once()
+        self.assertEqual(
+            responses,
+            {url: Items(items=[f"Item {page}"]) for page, url in enumerate(PAGES)},
+        )
+
+    def test_cached_pages_not_packed(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = SqliteStore(Path(directory.name) / "completions.sqlite3")
+        self.addCleanup(store.close)
+        packed_api = create_packed_api(CompletionCache(store))
+        with patch.object(packed_api.api, "complete_as", side_effect=complete_packed):
+            packed_api.extract_batch(PAGES)
+
+        new_page = {"https://example.com/new": "<ul><li>New</li></ul>"}
+        with patch.object(packed_api.api, "complete_as") as complete_as, patch.object(
+            packed_api.api,
+            "complete",
+            side_effect=lambda url, content, tier: list_items(content),
+        ) as complete:
+            responses = packed_api.extract_batch({**PAGES, **new_page})
+        complete_as.assert_not_called()
+        complete.assert_called_once()
+        self.assertEqual(responses["https://example.com/1"], Items(items=["Item 1"]))
+        self.assertEqual(responses["https://example.com/new"], Items(items=["New"]))
+
+    def test_schema_defined_once(self) -> None:
+        schema = create_packed_api().packed_format(3).model_json_schema()
+        self.assertEqual(list(schema["properties"]), ["page_1", "page_2", "page_3"])
+        self.assertEqual(list(schema["$defs"]), ["Items"])
+
+    def test_failed_pack_extracted_separately(self) -> None:
+        packed_api = create_packed_api()
+        with patch.object(
+            packed_api.api, "complete_as", return_value=None
+        ), patch.object(
+            packed_api.api,
+            "complete",
+            side_effect=lambda url, content, tier: list_items(content),
+        ) as complete:
+            with self.assertLogs(level="INFO"):
+                responses = packed_api.extract_batch(PAGES)
+        self.assertEqual(complete.call_count, 3)
+        self.assertEqual(responses["https://example.com/2"], Items(items=["Item 2"]))
+
+    def test_doubtful_pages_escalated(self) -> None:
+        packed_api = create_packed_api()
+        packed_api.api.escalation_models = ["strong"]
+        packed_api.api.quality_check = lambda content, response: (
+            None if response.items else "no items"
+        )
+
+        def complete_as(
+            url: str,
+            messages: Any,
+            response_format: Type[BaseModel],
+            model: Optional[str] = None,
+        ) -> BaseModel:
+            if response_format is Items:
+                return list_items(messages[-1]["content"])
+            # The packed completion misses the items on the first page
+            return response_format(
+                page_1=Items(items=[]),
+                page_2=Items(items=["Item 1"]),
+                page_3=Items(items=["Item 2"]),
+            )
+
+        with patch.object(packed_api.api, "complete_as", side_effect=complete_as):
+            with self.assertLogs(level="INFO"):
+                responses = packed_api.extract_batch(PAGES)
+        self.assertEqual(responses["https://example.com/0"], Items(items=["Item 0"]))
+        self.assertEqual(packed_api.api.cascade_stats.calls["test"], 2)
+
+    def test_pack_pages(self) -> None:
+        self.assertEqual(
+            pack_pages(["a", "b"]),
+            '<page id="1">\na\n</page>\n<page id="2">\nb\n</page>',
+        )
+
+
+class RecordingBatchApi(BatchApi[Items]):
+    def __init__(self) -> None:
+        self.batches: List[List[str]] = []
+
+    def extract_batch(self, pages: Mapping[str, str]) -> Dict[str, ApiResponse[Items]]:
+        self.batches.append(list(pages))
+        return {url: list_items(content) for url, content in pages.items()}
+
+
+class TestPageBatcher(unittest.TestCase):
+    def extract_all(
+        self, batcher: PageBatcher[Items], pages: Mapping[str, str]
+    ) -> Dict[str, ApiResponse[Items]]:
+        responses: Dict[str, ApiResponse[Items]] = {}
+
+        def extract(url: str) -> None:
+            responses[url] = batcher.extract(url, pages[url])
+
+        threads = [threading.Thread(target=extract, args=(url,)) for url in pages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_sent_when_full(self) -> None:
+        batch_api = RecordingBatchApi()
+        batcher = PageBatcher(batch_api, max_pages=3, max_wait=10)
+        responses = self.extract_all(batcher, PAGES)
+        self.assertEqual(len(batch_api.batches), 1)
+        self.assertEqual(sorted(batch_api.batches[0]), sorted(PAGES))
+        self.assertEqual(responses["https://example.com/1"], Items(items=["Item 1"]))
+
+    def test_sent_after_waiting(self) -> None:
+        batch_api = RecordingBatchApi()
+        batcher = PageBatcher(batch_api, max_pages=5, max_wait=0.01)
+        response = batcher.extract(
+            "https://example.com/0", PAGES["https://example.com/0"]
+        )
+        self.assertEqual(response, Items(items=["Item 0"]))
+        self.assertEqual(batch_api.batches, [["https://example.com/0"]])
+
+    def test_token_limit(self) -> None:
+        batch_api = RecordingBatchApi()
+        pages = {url: content + " " * 300 for url, content in PAGES.items()}
+        batcher = PageBatcher(batch_api, max_pages=3, max_tokens=250, max_wait=0.05)
+        self.extract_all(batcher, pages)
+        self.assertEqual(sorted(len(batch) for batch in batch_api.batches), [1, 2])
+
+    def test_large_page_alone(self) -> None:
+        batch_api = RecordingBatchApi()
+        batcher = PageBatcher(batch_api, max_pages=3, max_tokens=5, max_wait=10)
+        batcher.extract("https://example.com/0", PAGES["https://example.com/0"])
+        self.assertEqual(batch_api.batches, [["https://example.com/0"]])
+
+    def test_errors_raised_in_each_thread(self) -> None:
+        class FailingBatchApi(BatchApi[Items]):
+            def extract_batch(
+                self, pages: Mapping[str, str]
+            ) -> Dict[str, ApiResponse[Items]]:
+                raise RuntimeError("Failed")
+
+        batcher = PageBatcher(FailingBatchApi(), max_pages=2, max_wait=10)
+        errors: List[Exception] = []
+
+        def extract(url: str) -> None:
+            try:
+                batcher.extract(url, PAGES[url])
+            except RuntimeError as error:
+                errors.append(error)
+
+        threads = [
+            threading.Thread(target=extract, args=(url,)) for url in list(PAGES)[:2]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from typing import Optional
+
+from .politeness import HostScheduler, parse_retry_after, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestParseRetryAfter(unittest.TestCase):
+    def test_seconds(self) -> None:
+        self.assertEqual(parse_retry_after("120"), 120.0)
+
+    def test_http_date_in_past(self) -> None:
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+    def test_capped(self) -> None:
+        self.assertEqual(parse_retry_after("999999"), 300.0)
+
+    def test_invalid(self) -> None:
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after(""))
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self) -> None:
+        bucket = TokenBucket(rate=2.0, capacity=2, now=0.0)
+        self.assertEqual(bucket.reserve(0.0), 0.0)
+        self.assertEqual(bucket.reserve(0.0), 0.0)
+        self.assertAlmostEqual(bucket.reserve(0.0), 0.5)
+        self.assertAlmostEqual(bucket.reserve(0.0), 1.0)
+
+    def test_refill(self) -> None:
+        bucket = TokenBucket(rate=1.0, capacity=1, now=0.0)
+        self.assertEqual(bucket.reserve(0.0), 0.0)
+        self.assertEqual(bucket.reserve(1.0), 0.0)
+
+    def test_pause(self) -> None:
+        bucket = TokenBucket(rate=1.0, capacity=5, now=0.0)
+        bucket.pause_until(10.0)
+        self.assertAlmostEqual(bucket.reserve(0.0), 10.0)
+        self.assertAlmostEqual(bucket.reserve(0.0), 11.0)
+        self.assertAlmostEqual(bucket.reserve(12.0), 0.0)
+
+
+class TestHostScheduler(unittest.TestCase):
+    def test_hosts_independent(self) -> None:
+        clock = FakeClock()
+        scheduler = HostScheduler(requests_per_second=1, burst=1, clock=clock)
+        self.assertEqual(scheduler.reserve("https://a.com/1"), 0.0)
+        self.assertAlmostEqual(scheduler.reserve("https://a.com/2"), 1.0)
+        self.assertEqual(scheduler.reserve("https://b.com/1"), 0.0)
+
+    def test_defer(self) -> None:
+        clock = FakeClock()
+        scheduler = HostScheduler(requests_per_second=10, burst=10, clock=clock)
+        scheduler.defer("https://a.com/page", 30)
+        self.assertAlmostEqual(scheduler.reserve("https://a.com/other"), 30.0)
+        self.assertEqual(scheduler.reserve("https://b.com/page"), 0.0)
+
+    def test_crawl_delay(self) -> None:
+        fetched = []
+
+        def fetch_robots(url: str) -> Optional[str]:
+            fetched.append(url)
+            return "User-agent: *\nCrawl-delay: 5\nSitemap: https://a.com/sitemap.xml"
+
+        clock = FakeClock()
+        scheduler = HostScheduler(
+            requests_per_second=10,
+            burst=10,
+            robots_fetcher=fetch_robots,
+            clock=clock,
+        )
+        self.assertEqual(scheduler.reserve("https://a.com/1"), 0.0)
+        self.assertAlmostEqual(scheduler.reserve("https://a.com/2"), 5.0)
+        # robots.txt should only be fetched once per host
+        self.assertEqual(fetched, ["https://a.com/robots.txt"])
+        robots = scheduler.robots("https://a.com/3")
+        assert robots is not None
+        self.assertEqual(robots.site_maps(), ["https://a.com/sitemap.xml"])
+
+    def test_missing_robots(self) -> None:
+        scheduler = HostScheduler(
+            requests_per_second=1,
+            burst=1,
+            robots_fetcher=lambda url: None,
+            clock=FakeClock(),
+        )
+        self.assertEqual(scheduler.reserve("https://a.com/1"), 0.0)
+        self.assertIsNone(scheduler.robots("https://a.com/1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
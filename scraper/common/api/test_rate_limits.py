@@ -0,0 +1,134 @@
+import threading
+import time
+import unittest
+
+from .rate_limits import (
+    CompletionScheduler,
+    parse_rate_limits,
+    parse_reset,
+    RateLimits,
+)
+
+
+def limits(remaining_requests: int, remaining_tokens: int) -> RateLimits:
+    return RateLimits(
+        limit_requests=100,
+        limit_tokens=10000,
+        remaining_requests=remaining_requests,
+        remaining_tokens=remaining_tokens,
+        reset_requests=0.01,
+        reset_tokens=0.01,
+    )
+
+
+class TestParseRateLimits(unittest.TestCase):
+    def test_parse_reset(self) -> None:
+        self.assertEqual(parse_reset("1s"), 1.0)
+        self.assertEqual(parse_reset("6m0s"), 360.0)
+        self.assertEqual(parse_reset("20ms"), 0.02)
+        self.assertEqual(parse_reset("1h2m3.5s"), 3723.5)
+        self.assertIsNone(parse_reset(""))
+        self.assertIsNone(parse_reset("soon"))
+        self.assertIsNone(parse_reset("1s later"))
+
+    def test_parse_headers(self) -> None:
+        parsed = parse_rate_limits(
+            {
+                "x-ratelimit-limit-requests": "500",
+                "x-ratelimit-limit-tokens": "200000",
+                "x-ratelimit-remaining-requests": "499",
+                "x-ratelimit-remaining-tokens": "invalid",
+                "x-ratelimit-reset-requests": "120ms",
+                "x-ratelimit-reset-tokens": "1m30s",
+                "retry-after": "2",
+            }
+        )
+        self.assertEqual(
+            parsed,
+            RateLimits(
+                limit_requests=500,
+                limit_tokens=200000,
+                remaining_requests=499,
+                remaining_tokens=None,
+                reset_requests=0.12,
+                reset_tokens=90.0,
+                retry_after=2.0,
+            ),
+        )
+
+
+class TestCompletionScheduler(unittest.TestCase):
+    def test_additive_increase(self) -> None:
+        scheduler = CompletionScheduler(initial=2, maximum=4)
+        for _ in range(5):
+            scheduler.completed(limits(90, 9000))
+        self.assertEqual(int(scheduler.limit), 4)
+
+    def test_multiplicative_decrease(self) -> None:
+        scheduler = CompletionScheduler(initial=8)
+        scheduler.completed(limits(90, 500))
+        self.assertEqual(int(scheduler.limit), 4)
+        # Further responses in the same burst don't shrink it again
+        scheduler.completed(limits(90, 400))
+        self.assertEqual(int(scheduler.limit), 4)
+
+    def test_hold_steady(self) -> None:
+        scheduler = CompletionScheduler(initial=4)
+        scheduler.completed(limits(30, 9000))
+        self.assertEqual(int(scheduler.limit), 4)
+
+    def test_rate_limited(self) -> None:
+        scheduler = CompletionScheduler(initial=4, minimum=1)
+        with self.assertLogs(level="INFO"):
+            pause = scheduler.rate_limited(limits(0, 0))
+        self.assertEqual(pause, 0.01)
+        self.assertEqual(int(scheduler.limit), 2)
+        self.assertEqual(scheduler.rate_limited_count, 1)
+
+    def test_concurrency_bounded(self) -> None:
+        scheduler = CompletionScheduler(initial=2)
+        lock = threading.Lock()
+        in_flight = 0
+        max_in_flight = 0
+
+        def request() -> None:
+            nonlocal in_flight, max_in_flight
+            with scheduler.slot(tokens=1):
+                with lock:
+                    in_flight += 1
+                    max_in_flight = max(max_in_flight, in_flight)
+                time.sleep(0.01)
+                with lock:
+                    in_flight -= 1
+
+        threads = [threading.Thread(target=request) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max_in_flight, 2)
+
+    def test_wait_for_tokens(self) -> None:
+        """Requests which would use more tokens than remain wait for the reset"""
+        scheduler = CompletionScheduler(initial=4)
+        scheduler.completed(
+            RateLimits(
+                limit_requests=None,
+                limit_tokens=None,
+                remaining_requests=None,
+                remaining_tokens=100,
+                reset_requests=None,
+                reset_tokens=0.05,
+            )
+        )
+        start = time.monotonic()
+        with scheduler.slot(tokens=50):
+            pass
+        self.assertLess(time.monotonic() - start, 0.04)
+        with scheduler.slot(tokens=200):
+            pass
+        self.assertGreater(time.monotonic() - start, 0.04)
+
+
+if __name__ == "__main__":
+    unittest.main()
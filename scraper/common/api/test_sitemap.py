@@ -0,0 +1,146 @@
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from . import http
+from .politeness import HostScheduler
+from .sitemap import (
+    load_failed_pages,
+    load_last_run,
+    save_last_run,
+    SitemapDiscovery,
+)
+
+LAST_RUN = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+
+SITEMAPS = {
+    "https://example.com/sitemap.xml": b"""
+        <sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+          <sitemap><loc>https://example.com/page-sitemap.xml</loc></sitemap>
+          <sitemap><loc>https://example.com/event-sitemap.xml</loc></sitemap>
+        </sitemapindex>
+    """,
+    "https://example.com/event-sitemap.xml": b"""
+        <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+          <url>
+            <loc>https://example.com/events/old/</loc>
+            <lastmod>2024-05-01</lastmod>
+          </url>
+          <url>
+            <loc>https://example.com/events/new/</loc>
+            <lastmod>2024-07-01</lastmod>
+          </url>
+          <url><loc>https://example.com/events/undated/</loc></url>
+        </urlset>
+    """,
+    "https://example.com/page-sitemap.xml": b"""
+        <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+          <url>
+            <loc>https://example.com/about/</loc>
+            <lastmod>2020-01-01</lastmod>
+          </url>
+        </urlset>
+    """,
+}
+
+
+class FakeFetcher:
+    def __init__(self, sitemaps: Dict[str, bytes]) -> None:
+        self.sitemaps = sitemaps
+        self.fetched: List[str] = []
+
+    def __call__(self, url: str) -> Optional[bytes]:
+        self.fetched.append(url)
+        return self.sitemaps.get(url)
+
+
+class TestSitemapDiscovery(unittest.TestCase):
+    def setUp(self) -> None:
+        self.original_scheduler = http.HOST_SCHEDULER
+        # Without a robots.txt fetcher, sitemaps are looked for at /sitemap.xml
+        http.set_host_scheduler(HostScheduler())
+        self.fetcher = FakeFetcher(SITEMAPS)
+
+    def tearDown(self) -> None:
+        http.set_host_scheduler(self.original_scheduler)
+
+    def test_discover_under_source(self) -> None:
+        discovery = SitemapDiscovery(LAST_RUN, fetcher=self.fetcher)
+        pages = discovery.discover("https://example.com/events")
+        self.assertEqual(
+            set(pages),
+            {
+                "https://example.com/events/old/",
+                "https://example.com/events/new/",
+                "https://example.com/events/undated/",
+            },
+        )
+        # The event sitemap should be fetched before other sitemaps
+        self.assertEqual(
+            self.fetcher.fetched[1],
+            "https://example.com/event-sitemap.xml",
+        )
+
+    def test_sitemaps_fetched_once_per_host(self) -> None:
+        discovery = SitemapDiscovery(LAST_RUN, fetcher=self.fetcher)
+        discovery.discover("https://example.com/events")
+        discovery.discover("https://example.com/about")
+        self.assertEqual(len(self.fetcher.fetched), 3)
+
+    def test_unchanged_since_last_run(self) -> None:
+        discovery = SitemapDiscovery(LAST_RUN, fetcher=self.fetcher)
+        discovery.discover("https://example.com/events")
+        self.assertTrue(
+            discovery.unchanged_since_last_run("https://www.example.com/events/old")
+        )
+        self.assertFalse(
+            discovery.unchanged_since_last_run("https://example.com/events/new/")
+        )
+        self.assertFalse(
+            discovery.unchanged_since_last_run("https://example.com/events/undated/")
+        )
+        # Pages outside the source's path aren't considered
+        self.assertFalse(
+            discovery.unchanged_since_last_run("https://example.com/about/")
+        )
+
+    def test_failed_pages_fetched_again(self) -> None:
+        discovery = SitemapDiscovery(
+            LAST_RUN,
+            fetcher=self.fetcher,
+            failed=["https://www.example.com/events/old"],
+        )
+        discovery.discover("https://example.com/events")
+        self.assertFalse(
+            discovery.unchanged_since_last_run("https://example.com/events/old/")
+        )
+
+    def test_first_run(self) -> None:
+        discovery = SitemapDiscovery(None, fetcher=self.fetcher)
+        discovery.discover("https://example.com/events")
+        self.assertFalse(
+            discovery.unchanged_since_last_run("https://example.com/events/old/")
+        )
+
+
+class TestLastRun(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(load_last_run(Path(directory)))
+            save_last_run(Path(directory), LAST_RUN)
+            self.assertEqual(load_last_run(Path(directory)), LAST_RUN)
+            self.assertEqual(load_failed_pages(Path(directory)), [])
+
+    def test_failed_pages(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(load_failed_pages(Path(directory)), [])
+            save_last_run(Path(directory), LAST_RUN, {"https://example.com/b", "a"})
+            self.assertEqual(
+                load_failed_pages(Path(directory)), ["a", "https://example.com/b"]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
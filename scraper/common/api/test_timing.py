@@ -0,0 +1,98 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from .timing import (
+    current_timing,
+    percentile,
+    request_source,
+    RequestTiming,
+    summarize,
+    TimingRecorder,
+)
+
+
+class TestPercentile(unittest.TestCase):
+    def test_nearest_rank(self) -> None:
+        values = [5.0, 1.0, 4.0, 2.0, 3.0]
+        self.assertEqual(percentile(values, 50), 3.0)
+        self.assertEqual(percentile(values, 95), 5.0)
+        self.assertEqual(percentile(values, 0), 1.0)
+
+    def test_empty(self) -> None:
+        self.assertEqual(percentile([], 50), 0.0)
+
+
+class TestTimingRecorder(unittest.TestCase):
+    def test_measure_sets_current_timing(self) -> None:
+        recorder = TimingRecorder()
+        self.assertIsNone(current_timing())
+        with request_source("https://example.com/events"):
+            with recorder.measure("GET", "https://example.com/events/1") as timing:
+                self.assertIs(current_timing(), timing)
+        self.assertIsNone(current_timing())
+        self.assertEqual(recorder.timings, [timing])
+        self.assertEqual(timing.host, "example.com")
+        self.assertEqual(timing.source, "https://example.com/events")
+        self.assertGreaterEqual(timing.total, 0)
+
+    def test_error_recorded(self) -> None:
+        recorder = TimingRecorder()
+        with self.assertRaises(RuntimeError):
+            with recorder.measure("GET", "https://example.com"):
+                raise RuntimeError("Failed")
+        self.assertTrue(recorder.timings[0].failed)
+
+    def test_failed_urls(self) -> None:
+        recorder = TimingRecorder()
+        with recorder.measure("GET", "https://example.com/ok") as timing:
+            timing.status = 200
+        with recorder.measure("GET", "https://example.com/missing") as timing:
+            timing.status = 404
+        with recorder.measure("POST", "https://api.example.com") as timing:
+            timing.status = 500
+        self.assertEqual(recorder.failed_urls("GET"), {"https://example.com/missing"})
+
+    def test_report(self) -> None:
+        recorder = TimingRecorder()
+        for total, status, attempts in ((1.0, 200, 1), (3.0, 200, 3), (2.0, 404, 1)):
+            recorder.timings.append(
+                RequestTiming(
+                    url="https://a.com/page",
+                    host="a.com",
+                    method="GET",
+                    source="https://a.com",
+                    status=status,
+                    attempts=attempts,
+                    total=total,
+                    bytes=100,
+                )
+            )
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "run_report.json"
+            recorder.write_report(path)
+            with open(path) as file:
+                report = json.load(file)
+        host = report["hosts"]["a.com"]
+        self.assertEqual(host["requests"], 3)
+        self.assertEqual(host["failed"], 1)
+        self.assertEqual(host["retries"], 2)
+        self.assertEqual(host["bytes"], 300)
+        self.assertEqual(host["latency"], {"p50": 2.0, "p95": 3.0, "max": 3.0})
+        self.assertEqual(host["statuses"], {"200": 2, "404": 1})
+        self.assertEqual(report["sources"]["https://a.com"]["requests"], 3)
+
+    def test_unwritable_report_logged(self) -> None:
+        recorder = TimingRecorder()
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "missing" / "run_report.json"
+            with self.assertLogs(level="ERROR"):
+                recorder.write_report(path)
+
+    def test_summarize_empty(self) -> None:
+        self.assertEqual(summarize([])["requests"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
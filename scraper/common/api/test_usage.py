@@ -0,0 +1,91 @@
+import unittest
+
+from openai.types import CompletionUsage
+from openai.types.completion_usage import PromptTokensDetails
+
+from .timing import request_source
+from .usage import find_price, MODEL_PRICES, UsageLedger
+
+
+def usage(prompt: int, completion: int, cached: int = 0) -> CompletionUsage:
+    return CompletionUsage(
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        total_tokens=prompt + completion,
+        prompt_tokens_details=PromptTokensDetails(cached_tokens=cached),
+    )
+
+
+class TestUsageLedger(unittest.TestCase):
+    def test_find_price(self) -> None:
+        self.assertEqual(
+            find_price(MODEL_PRICES, "gpt-4o-mini-2024-07-18"),
+            MODEL_PRICES["gpt-4o-mini"],
+        )
+        self.assertEqual(find_price(MODEL_PRICES, "gpt-4o"), MODEL_PRICES["gpt-4o"])
+        self.assertIsNone(find_price(MODEL_PRICES, "unknown"))
+
+    def test_record_per_source(self) -> None:
+        ledger = UsageLedger()
+        with request_source("https://example.com/events"):
+            ledger.record(
+                "gpt-4o-mini",
+                "https://example.com/events",
+                usage(1_000_000, 100_000, cached=200_000),
+                1.5,
+            )
+            ledger.record(
+                "gpt-4o-mini", "https://example.com/events/1", usage(1000, 100), 0.5
+            )
+        ledger.record("gpt-4o-mini", "https://other.com", None, 0.1)
+        source = ledger.sources["https://example.com/events"]
+        self.assertEqual(source.calls, 2)
+        self.assertEqual(source.prompt_tokens, 1_001_000)
+        self.assertEqual(source.cached_tokens, 200_000)
+        # 800k uncached and 200k cached prompt tokens, and 100k completion tokens
+        self.assertAlmostEqual(
+            ledger.pages["https://example.com/events"].cost,
+            0.8 * 0.15 + 0.2 * 0.075 + 0.1 * 0.60,
+        )
+        self.assertEqual(ledger.sources["(unknown)"].calls, 1)
+        self.assertEqual(ledger.total.calls, 3)
+
+    def test_unknown_price(self) -> None:
+        ledger = UsageLedger()
+        with self.assertLogs(level="WARNING"):
+            ledger.record("unknown", "https://example.com", usage(10, 10), 0.1)
+        self.assertEqual(ledger.total.cost, 0.0)
+        self.assertEqual(ledger.total.tokens, 20)
+
+    def test_details_stop_first(self) -> None:
+        ledger = UsageLedger(max_tokens=1000)
+        self.assertTrue(ledger.allows(detail=True))
+        ledger.record("gpt-4o-mini", "https://example.com", usage(900, 50), 0.1)
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(ledger.allows(detail=True))
+        self.assertTrue(ledger.allows(detail=False))
+        ledger.record("gpt-4o-mini", "https://example.com", usage(50, 0), 0.1)
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(ledger.allows(detail=False))
+
+    def test_cost_budget(self) -> None:
+        ledger = UsageLedger(max_cost=0.01)
+        ledger.record("gpt-4o", "https://example.com", usage(2000, 500), 0.1)
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(ledger.allows(detail=False))
+
+    def test_summary(self) -> None:
+        ledger = UsageLedger()
+        with request_source("https://example.com"):
+            ledger.record("gpt-4o-mini", "https://example.com", usage(1000, 100), 1)
+        ledger.record_event("https://example.com")
+        ledger.record_event("https://example.com")
+        with self.assertLogs(level="INFO") as logs:
+            ledger.log_stats()
+        table = "\n".join(logs.output)
+        self.assertIn("Source", table)
+        self.assertRegex(table, r"https://example.com\s+1\s+1100\s+0.0002\s+2\s+0.0001")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,250 @@
+import contextvars
+import datetime
+import json
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set
+from urllib.parse import urlparse
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+@dataclass
+class RequestTiming:
+    """How long each phase of a request took, in seconds
+
+    A request covers all attempts made by get() or post(), so the phase timings are
+    totals across retries. connect is zero when an existing connection was reused.
+    """
+
+    url: str
+    host: str
+    method: str
+    source: Optional[str]
+    status: Optional[int] = None
+    attempts: int = 0
+    # Time spent waiting for the host's rate limit
+    waited: float = 0.0
+    # Time spent resolving the host name and opening new connections
+    connect: float = 0.0
+    # Time from sending the request until the response headers arrived, excluding
+    # any time spent connecting
+    first_byte: float = 0.0
+    # Time spent reading the response body
+    download: float = 0.0
+    total: float = 0.0
+    bytes: int = 0
+    error: Optional[str] = None
+
+    @property
+    def retries(self) -> int:
+        return max(self.attempts - 1, 0)
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None or not self.status or self.status >= 400
+
+
+# The source being scraped in the current thread or task, used to group timings
+CURRENT_SOURCE: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "CURRENT_SOURCE", default=None
+)
+# The request currently being made in this thread or task, if any
+CURRENT_TIMING: contextvars.ContextVar[Optional[RequestTiming]] = (
+    contextvars.ContextVar("CURRENT_TIMING", default=None)
+)
+
+
+@contextmanager
+def request_source(source: str) -> Iterator[None]:
+    """Attribute any requests made within this context to the given source"""
+    token = CURRENT_SOURCE.set(source)
+    try:
+        yield
+    finally:
+        CURRENT_SOURCE.reset(token)
+
+
+def current_source() -> Optional[str]:
+    return CURRENT_SOURCE.get()
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return CURRENT_TIMING.get()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTP connection which adds the time taken to connect to the current request"""
+
+    def connect(self) -> None:
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            timing = current_timing()
+            if timing is not None:
+                timing.connect += time.perf_counter() - start
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection which adds the time taken to connect to the current request
+
+    This includes the TLS handshake.
+    """
+
+    def connect(self) -> None:
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            timing = current_timing()
+            if timing is not None:
+                timing.connect += time.perf_counter() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+# Use with PoolManager.pool_classes_by_scheme to time new connections
+TIMED_POOL_CLASSES = {
+    "http": TimedHTTPConnectionPool,
+    "https": TimedHTTPSConnectionPool,
+}
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """Return the given percentile of the values using the nearest-rank method"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+def distribution(values: Sequence[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "max": round(max(values, default=0.0), 3),
+    }
+
+
+def summarize(timings: Sequence[RequestTiming]) -> Dict[str, Any]:
+    """Aggregate a group of timings"""
+    return {
+        "requests": len(timings),
+        "failed": sum(1 for timing in timings if timing.failed),
+        "retries": sum(timing.retries for timing in timings),
+        "bytes": sum(timing.bytes for timing in timings),
+        "total_seconds": round(sum(timing.total for timing in timings), 3),
+        "latency": distribution([timing.total for timing in timings]),
+        "waited": distribution([timing.waited for timing in timings]),
+        "connect": distribution([timing.connect for timing in timings]),
+        "first_byte": distribution([timing.first_byte for timing in timings]),
+        "download": distribution([timing.download for timing in timings]),
+        "statuses": {
+            str(status): sum(1 for timing in timings if timing.status == status)
+            for status in sorted({timing.status or 0 for timing in timings})
+        },
+    }
+
+
+class TimingRecorder:
+    """Thread-safe collection of request timings which can be written as a report"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.timings: List[RequestTiming] = []
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+
+    @contextmanager
+    def measure(self, method: str, url: str) -> Iterator[RequestTiming]:
+        """Time a request, making it the current request until the context exits"""
+        timing = RequestTiming(
+            url=url,
+            host=urlparse(url).netloc,
+            method=method,
+            source=CURRENT_SOURCE.get(),
+        )
+        token = CURRENT_TIMING.set(timing)
+        start = time.perf_counter()
+        try:
+            yield timing
+        except BaseException as error:
+            timing.error = repr(error)
+            raise
+        finally:
+            timing.total = time.perf_counter() - start
+            CURRENT_TIMING.reset(token)
+            with self.lock:
+                self.timings.append(timing)
+
+    def report(self) -> Dict[str, Any]:
+        with self.lock:
+            timings = list(self.timings)
+        by_host: Dict[str, List[RequestTiming]] = defaultdict(list)
+        by_source: Dict[str, List[RequestTiming]] = defaultdict(list)
+        for timing in timings:
+            by_host[timing.host].append(timing)
+            by_source[timing.source or "unknown"].append(timing)
+
+        def by_total_time(groups: Dict[str, List[RequestTiming]]) -> Dict[str, Any]:
+            # Put the groups which took the most time first
+            ordered = sorted(
+                groups.items(),
+                key=lambda item: sum(timing.total for timing in item[1]),
+                reverse=True,
+            )
+            return {name: summarize(group) for name, group in ordered}
+
+        return {
+            "started": self.started.isoformat(),
+            "finished": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "overall": summarize(timings),
+            "hosts": by_total_time(by_host),
+            "sources": by_total_time(by_source),
+        }
+
+    def failed_urls(self, method: str) -> Set[str]:
+        """Return the URLs of failed requests made with the given method"""
+        with self.lock:
+            return {
+                timing.url
+                for timing in self.timings
+                if timing.method == method and timing.failed
+            }
+
+    def write_report(self, path: Path) -> None:
+        """Write the report to path, logging rather than raising if it can't be written
+
+        This runs at the end of every run, so it mustn't hide an earlier error.
+        """
+        logger = logging.getLogger(__name__)
+        report = self.report()
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+        except OSError as error:
+            logger.error("Failed to write run report to %s: %r", path, error)
+            return
+        overall = report["overall"]
+        logger.info(
+            "Wrote run report to %s: %d requests, p50 %.2fs, p95 %.2fs, max %.2fs",
+            path,
+            overall["requests"],
+            overall["latency"]["p50"],
+            overall["latency"]["p95"],
+            overall["latency"]["max"],
+        )
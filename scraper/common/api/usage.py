@@ -0,0 +1,228 @@
+import logging
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import DefaultDict, Mapping, Optional, Set
+
+from openai.types import CompletionUsage
+
+from .timing import CURRENT_SOURCE
+
+# Fraction of the budget kept for listing pages, so that once it runs low, detail
+# pages stop being extracted before listings do
+LISTING_RESERVE = 0.1
+# Source which completions made outside of any source are attributed to
+UNKNOWN_SOURCE = "(unknown)"
+# Number of most expensive pages to list in the run summary
+TOP_PAGES = 5
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """Price of a model in US dollars per million tokens"""
+
+    prompt: float
+    cached_prompt: float
+    completion: float
+
+
+# OpenAI's standard prices. Models are matched by prefix, so dated snapshots of a
+# model share its price.
+MODEL_PRICES = {
+    "gpt-4o-mini": ModelPrice(prompt=0.15, cached_prompt=0.075, completion=0.60),
+    "gpt-4o": ModelPrice(prompt=2.50, cached_prompt=1.25, completion=10.00),
+    "gpt-4.1-nano": ModelPrice(prompt=0.10, cached_prompt=0.025, completion=0.40),
+    "gpt-4.1-mini": ModelPrice(prompt=0.40, cached_prompt=0.10, completion=1.60),
+    "gpt-4.1": ModelPrice(prompt=2.00, cached_prompt=0.50, completion=8.00),
+    "o4-mini": ModelPrice(prompt=1.10, cached_prompt=0.275, completion=4.40),
+}
+
+
+def find_price(prices: Mapping[str, ModelPrice], model: str) -> Optional[ModelPrice]:
+    matches = [name for name in prices if model.startswith(name)]
+    if not matches:
+        return None
+    return prices[max(matches, key=len)]
+
+
+@dataclass
+class Usage:
+    """Tokens used and time spent on completions"""
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens which were served from OpenAI's prompt cache, at a discount
+    cached_tokens: int = 0
+    seconds: float = 0.0
+    cost: float = 0.0
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: "Usage") -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.seconds += other.seconds
+        self.cost += other.cost
+
+
+class UsageLedger:
+    """Thread-safe record of the tokens and cost of every completion in a run
+
+    Usage is totalled per source, using the source of the current request_source()
+    context, and per page. If max_tokens or max_cost is given, allows() reports when
+    the budget has run out: first for detail pages, once all but LISTING_RESERVE of it
+    has been used, then for listing pages. Completions already in flight when the
+    budget runs out still count, so it may be exceeded slightly.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        max_cost: Optional[float] = None,
+        prices: Mapping[str, ModelPrice] = MODEL_PRICES,
+    ) -> None:
+        logger = logging.getLogger(__name__)
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.prices = prices
+        self.lock = threading.Lock()
+        self.total = Usage()
+        self.sources: DefaultDict[str, Usage] = defaultdict(Usage)
+        self.pages: DefaultDict[str, Usage] = defaultdict(Usage)
+        self.events: Counter[str] = Counter()
+        self.unpriced: Set[str] = set()
+        self.exhausted: Set[str] = set()
+        if max_tokens is not None or max_cost is not None:
+            logger.info(
+                "Budget for this run: %s tokens, $%s",
+                max_tokens if max_tokens is not None else "unlimited",
+                f"{max_cost:.2f}" if max_cost is not None else "unlimited",
+            )
+
+    def cost(self, model: str, usage: Usage) -> float:
+        logger = logging.getLogger(__name__)
+        price = find_price(self.prices, model)
+        if price is None:
+            if model not in self.unpriced:
+                logger.warning(
+                    "No price known for %s, so its cost isn't counted", model
+                )
+                self.unpriced.add(model)
+            return 0.0
+        uncached = usage.prompt_tokens - usage.cached_tokens
+        return (
+            uncached * price.prompt
+            + usage.cached_tokens * price.cached_prompt
+            + usage.completion_tokens * price.completion
+        ) / 1_000_000
+
+    def record(
+        self,
+        model: str,
+        page: str,
+        usage: Optional[CompletionUsage],
+        seconds: float,
+    ) -> None:
+        """Record a completion for the page, attributing it to the current source"""
+        recorded = Usage(calls=1, seconds=seconds)
+        if usage is not None:
+            recorded.prompt_tokens = usage.prompt_tokens
+            recorded.completion_tokens = usage.completion_tokens
+            details = usage.prompt_tokens_details
+            if details is not None and details.cached_tokens:
+                recorded.cached_tokens = details.cached_tokens
+        source = CURRENT_SOURCE.get() or UNKNOWN_SOURCE
+        with self.lock:
+            recorded.cost = self.cost(model, recorded)
+            self.total.add(recorded)
+            self.sources[source].add(recorded)
+            self.pages[page].add(recorded)
+
+    def record_event(self, source: Optional[str]) -> None:
+        """Count an event found from the source, to compare with its cost"""
+        with self.lock:
+            self.events[source or UNKNOWN_SOURCE] += 1
+
+    def fraction_used(self) -> float:
+        """The largest fraction of any limit of the budget used so far"""
+        fractions = [0.0]
+        if self.max_tokens is not None:
+            fractions.append(
+                self.total.tokens / self.max_tokens if self.max_tokens else 1.0
+            )
+        if self.max_cost is not None:
+            fractions.append(self.total.cost / self.max_cost if self.max_cost else 1.0)
+        return max(fractions)
+
+    def allows(self, detail: bool) -> bool:
+        """Check whether the budget allows extracting another detail or listing page"""
+        logger = logging.getLogger(__name__)
+        kind = "detail" if detail else "listing"
+        with self.lock:
+            used = self.fraction_used()
+            allowed = used < (1 - LISTING_RESERVE if detail else 1.0)
+            if not allowed and kind not in self.exhausted:
+                self.exhausted.add(kind)
+                logger.warning(
+                    "%.0f%% of the budget has been used, so no more %s pages will be "
+                    "extracted",
+                    100 * used,
+                    kind,
+                )
+            return allowed
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        with self.lock:
+            logger.info(
+                "Usage: %d completions, %d prompt tokens (%d cached), %d completion "
+                "tokens, %.1f s, estimated cost $%.4f",
+                self.total.calls,
+                self.total.prompt_tokens,
+                self.total.cached_tokens,
+                self.total.completion_tokens,
+                self.total.seconds,
+                self.total.cost,
+            )
+            if not self.sources:
+                return
+            width = max(len(source) for source in self.sources)
+            logger.info(
+                "%-*s %6s %10s %10s %7s %11s",
+                width,
+                "Source",
+                "Calls",
+                "Tokens",
+                "Cost ($)",
+                "Events",
+                "$ per event",
+            )
+            for source, usage in sorted(
+                self.sources.items(), key=lambda item: item[1].cost, reverse=True
+            ):
+                events = self.events[source]
+                logger.info(
+                    "%-*s %6d %10d %10.4f %7d %11s",
+                    width,
+                    source,
+                    usage.calls,
+                    usage.tokens,
+                    usage.cost,
+                    events,
+                    f"{usage.cost / events:.4f}" if events else "-",
+                )
+            for page, usage in sorted(
+                self.pages.items(), key=lambda item: item[1].tokens, reverse=True
+            )[:TOP_PAGES]:
+                logger.info(
+                    "Expensive page: %s used %d tokens in %d completions ($%.4f)",
+                    page,
+                    usage.tokens,
+                    usage.calls,
+                    usage.cost,
+                )
@@ -1,8 +1,23 @@
 import logging
+import re
 from typing import Dict, Optional
 from datetime import date, time
 
-from scraper.common.types.date_and_time import DateAndTime
+from scraper.common.types.date_and_time import DateAndTime, iso_components
+
+# Month names and abbreviations in English and French, as found on the pages we scrape
+MONTH_NAMES = (
+    r"jan(?:uary|vier)?|f(?:eb|[eé]v)(?:ruary|rier)?|mar(?:ch|s)?|apr(?:il)?|avr(?:il)?"
+    r"|may|mai|june?|juin|july?|juil(?:let)?|aug(?:ust)?|ao[uû]t|sept?(?:ember|embre)?"
+    r"|oct(?:ober|obre)?|nov(?:ember|embre)?|d[eé]c(?:ember|embre)?"
+)
+# Dates like 2025-03-01, 2025/03/01, March 1, 1 March or 1er mars
+DATE_LIKE = re.compile(
+    r"\b\d{4}[-/]\d{1,2}[-/]\d{1,2}\b"
+    rf"|\b(?:{MONTH_NAMES})\.?\s+\d{{1,2}}\b"
+    rf"|\b\d{{1,2}}(?:er)?\s+(?:{MONTH_NAMES})\b",
+    re.IGNORECASE,
+)
 
 
 def parse_date_and_time(datetime_dict: Dict[str, int]) -> DateAndTime:
@@ -45,3 +60,22 @@ def parse_time(time_string: str) -> Optional[time]:
         if time_string:
             logger.debug("Failed to parse time %r", time_string)
     return None
+
+
+def parse_iso_date_and_time(value: str) -> Optional[DateAndTime]:
+    """Parse an ISO-8601 date, optionally with a time and UTC offset
+
+    If the string cannot be parsed, return None.
+    """
+    logger = logging.getLogger(__name__)
+    components = iso_components(value)
+    if components is None:
+        if value.strip():
+            logger.debug("Failed to parse date and time %r", value)
+        return None
+    return DateAndTime.model_validate(components)
+
+
+def contains_date(text: str) -> bool:
+    """Check whether the text appears to mention a date"""
+    return DATE_LIKE.search(text) is not None
@@ -0,0 +1,65 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+
+class JsonArrayItems:
+    """Incrementally extracts the objects in an array of a JSON object being streamed
+
+    feed() takes each piece of the JSON text as it arrives, and returns the objects
+    in the array under key in the top-level object which that piece completed. Only
+    objects are returned, not any other values in the array.
+    """
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        # The latest string in the top-level object, which is a key if it's followed
+        # by a value
+        self.string: List[str] = []
+        self.last_string: Optional[str] = None
+        self.in_array = False
+        # Text of the object currently being read from the array, if any
+        self.item: Optional[List[str]] = None
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        logger = logging.getLogger(__name__)
+        items: List[Dict[str, Any]] = []
+        for char in text:
+            if self.item is not None:
+                self.item.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = "".join(self.string)
+                    continue
+                if self.depth == 1:
+                    self.string.append(char)
+                continue
+            if char == '"':
+                self.in_string = True
+                self.string = []
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 2 and char == "[" and self.last_string == self.key:
+                    self.in_array = True
+                elif self.depth == 3 and char == "{" and self.in_array:
+                    self.item = [char]
+            elif char in "}]":
+                if self.depth == 3 and self.item is not None:
+                    try:
+                        items.append(json.loads("".join(self.item)))
+                    except ValueError as error:
+                        logger.warning("Invalid item in streamed JSON: %r", error)
+                    self.item = None
+                elif self.depth == 2 and self.in_array:
+                    self.in_array = False
+                self.depth -= 1
+        return items
@@ -0,0 +1,99 @@
+import datetime
+import gzip
+import logging
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, urlunparse
+
+
+@dataclass
+class Sitemap:
+    """Contents of a sitemap or sitemap index
+
+    pages maps each page URL to its lastmod timestamp, if any. A sitemap index lists
+    other sitemaps instead of pages.
+    """
+
+    pages: Dict[str, Optional[datetime.datetime]] = field(default_factory=dict)
+    sitemaps: List[str] = field(default_factory=list)
+
+
+def parse_lastmod(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Parse a W3C datetime, as used for lastmod, into an aware datetime
+
+    Timestamps without a timezone are assumed to be in UTC. If the value is missing or
+    invalid, return None.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def local_name(tag: str) -> str:
+    """Strip the namespace from an XML tag"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_sitemap(content: bytes) -> Sitemap:
+    """Parse an XML sitemap or sitemap index, which may be gzipped
+
+    If the content can't be parsed, return an empty sitemap.
+    """
+    logger = logging.getLogger(__name__)
+    if content.startswith(b"\x1f\x8b"):
+        try:
+            content = gzip.decompress(content)
+        except (OSError, EOFError) as error:
+            logger.warning("Failed to decompress sitemap: %r", error)
+            return Sitemap()
+    try:
+        root = ElementTree.fromstring(content)
+    except ElementTree.ParseError as error:
+        logger.warning("Failed to parse sitemap: %r", error)
+        return Sitemap()
+
+    sitemap = Sitemap()
+    for element in root:
+        location = None
+        lastmod = None
+        for child in element:
+            name = local_name(child.tag)
+            if name == "loc" and child.text:
+                location = child.text.strip()
+            elif name == "lastmod":
+                lastmod = parse_lastmod(child.text)
+        if not location:
+            continue
+        if local_name(element.tag) == "sitemap":
+            sitemap.sitemaps.append(location)
+        elif local_name(element.tag) == "url":
+            sitemap.pages[location] = lastmod
+    return sitemap
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so that trivially different forms of it compare equal
+
+    The scheme, a leading "www.", the fragment and any trailing slash are ignored.
+    """
+    parsed = urlparse(url.strip())
+    netloc = parsed.netloc.lower().removeprefix("www.")
+    path = parsed.path.rstrip("/")
+    return urlunparse(("", netloc, path, parsed.params, parsed.query, ""))
+
+
+def is_under_path(url: str, base: str) -> bool:
+    """Check whether a URL is on the same site as base and below it in the hierarchy"""
+    normalized = urlparse(normalize_url(url))
+    normalized_base = urlparse(normalize_url(base))
+    if normalized.netloc != normalized_base.netloc:
+        return False
+    prefix = normalized_base.path
+    return normalized.path == prefix or normalized.path.startswith(prefix + "/")
@@ -0,0 +1,217 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from scraper.common.text_processors.streaming import VOID_TAGS
+
+# Pages without any of these can't contain structured data, so needn't be parsed
+STRUCTURED_DATA_MARKERS = ("application/ld+json", "itemscope")
+# Attributes which hold the value of a microdata property, by element
+MICRODATA_VALUE_ATTRIBUTES = {
+    "a": "href",
+    "area": "href",
+    "audio": "src",
+    "embed": "src",
+    "iframe": "src",
+    "img": "src",
+    "link": "href",
+    "meta": "content",
+    "object": "data",
+    "source": "src",
+    "time": "datetime",
+    "video": "src",
+}
+# Attributes of those which hold a URL, which may be relative to the page
+MICRODATA_URL_ATTRIBUTES = {"data", "href", "src"}
+# JSON-LD properties whose values are URLs, which may be relative to the page
+URL_PROPERTIES = {"image", "logo", "sameAs", "url"}
+
+
+def schema_types(item: Dict[str, Any]) -> List[str]:
+    """Return the schema.org types of an item, without any URL prefix"""
+    types = item.get("@type", [])
+    if isinstance(types, str):
+        types = types.split()
+    return [
+        str(schema_type).rstrip("/").rsplit("/", 1)[-1]
+        for schema_type in types
+        if isinstance(schema_type, str)
+    ]
+
+
+def flatten_json_ld(data: Any) -> Iterator[Dict[str, Any]]:
+    """Yield each item in a JSON-LD document, including those in @graph"""
+    if isinstance(data, list):
+        for item in data:
+            yield from flatten_json_ld(item)
+    elif isinstance(data, dict):
+        if "@graph" in data:
+            yield from flatten_json_ld(data["@graph"])
+        if "@type" in data:
+            yield data
+        # Listings often wrap their events in an ItemList
+        for element in data.get("itemListElement", []) or []:
+            if isinstance(element, dict):
+                yield from flatten_json_ld(element.get("item", element))
+
+
+def resolve_urls(value: Any, page_url: str, is_url: bool = False) -> Any:
+    """Resolve relative URLs in the URL properties of a JSON-LD value, recursively"""
+    if isinstance(value, list):
+        return [resolve_urls(element, page_url, is_url) for element in value]
+    if isinstance(value, dict):
+        return {
+            name: resolve_urls(element, page_url, name in URL_PROPERTIES)
+            for name, element in value.items()
+        }
+    if is_url and isinstance(value, str):
+        return urljoin(page_url, value.strip())
+    return value
+
+
+def parse_json_ld(text: str) -> Iterator[Dict[str, Any]]:
+    logger = logging.getLogger(__name__)
+    try:
+        data = json.loads(text, strict=False)
+    except ValueError as error:
+        logger.debug("Skipping invalid JSON-LD: %r", error)
+        return
+    yield from flatten_json_ld(data)
+
+
+@dataclass
+class OpenElement:
+    """An element being parsed by StructuredDataParser"""
+
+    name: str
+    attributes: Dict[str, str]
+    # The item this element starts, if it has itemscope
+    item: Optional[Dict[str, Any]] = None
+    # The item this element is a property of, and the property names it claimed
+    owner: Optional[Dict[str, Any]] = None
+    claimed: List[str] = field(default_factory=list)
+    # The text of the element, if that's its value
+    text: Optional[List[str]] = None
+
+
+class StructuredDataParser(HTMLParser):
+    """Collect JSON-LD and microdata items as a page is parsed, without a tree"""
+
+    def __init__(self, page_url: str) -> None:
+        super().__init__(convert_charrefs=True)
+        self.page_url = page_url
+        self.json_ld: List[Dict[str, Any]] = []
+        self.microdata: List[Dict[str, Any]] = []
+        self.open: List[OpenElement] = []
+        self.script: Optional[List[str]] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = {name: value or "" for name, value in attrs}
+        if tag == "script":
+            is_json_ld = attributes.get("type") == "application/ld+json"
+            self.script = [] if is_json_ld else None
+        element = OpenElement(tag, attributes)
+        if "itemscope" in attributes:
+            element.item = {}
+            if attributes.get("itemtype"):
+                element.item["@type"] = attributes["itemtype"]
+            if "itemprop" not in attributes:
+                self.microdata.append(element.item)
+        element.owner = self.current_item()
+        if "itemprop" in attributes and element.owner is not None:
+            # Keep the first value of properties which appear more than once
+            for name in attributes["itemprop"].split():
+                if name not in element.owner:
+                    element.owner[name] = None
+                    element.claimed.append(name)
+            if element.claimed and self.has_text_value(element):
+                element.text = []
+        self.open.append(element)
+        if tag in VOID_TAGS:
+            self.close_element()
+
+    def handle_startendtag(
+        self, tag: str, attrs: List[Tuple[str, Optional[str]]]
+    ) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        # Like html.parser, ignore end tags which don't match any open element, and
+        # close any elements inside the one ending which weren't closed themselves
+        if all(element.name != tag for element in self.open):
+            return
+        while self.open:
+            if self.close_element().name == tag:
+                break
+
+    def handle_data(self, data: str) -> None:
+        if self.script is not None:
+            self.script.append(data)
+        if self.open and self.open[-1].name in ("script", "style"):
+            return
+        for element in self.open:
+            if element.text is not None:
+                element.text.append(data)
+
+    def close(self) -> None:
+        super().close()
+        while self.open:
+            self.close_element()
+
+    def current_item(self) -> Optional[Dict[str, Any]]:
+        for element in reversed(self.open):
+            if element.item is not None:
+                return element.item
+        return None
+
+    @staticmethod
+    def has_text_value(element: OpenElement) -> bool:
+        if element.item is not None or "content" in element.attributes:
+            return False
+        attribute = MICRODATA_VALUE_ATTRIBUTES.get(element.name)
+        return attribute is None or attribute not in element.attributes
+
+    def close_element(self) -> OpenElement:
+        element = self.open.pop()
+        if element.name == "script" and self.script is not None:
+            items = parse_json_ld("".join(self.script))
+            self.json_ld.extend(resolve_urls(item, self.page_url) for item in items)
+            self.script = None
+        if element.owner is not None and element.claimed:
+            value = self.microdata_value(element)
+            for name in element.claimed:
+                element.owner[name] = value
+        return element
+
+    def microdata_value(self, element: OpenElement) -> Any:
+        if element.item is not None:
+            return element.item
+        if element.text is not None:
+            return " ".join("".join(element.text).split())
+        if "content" in element.attributes:
+            return element.attributes["content"]
+        attribute = MICRODATA_VALUE_ATTRIBUTES[element.name]
+        value = element.attributes[attribute]
+        if attribute in MICRODATA_URL_ATTRIBUTES:
+            return urljoin(self.page_url, value.strip())
+        return value
+
+
+def extract_structured_data(content: str, page_url: str) -> List[Dict[str, Any]]:
+    """Extract the schema.org items embedded in a page as JSON-LD or microdata
+
+    Microdata items are converted to dictionaries shaped like JSON-LD. Only top-level
+    items are returned, with any nested items as their properties. Relative URLs are
+    resolved against page_url. The page is tokenized rather than parsed into a tree.
+    """
+    if not any(marker in content for marker in STRUCTURED_DATA_MARKERS):
+        return []
+    parser = StructuredDataParser(page_url)
+    parser.feed(content)
+    parser.close()
+    return parser.json_ld + parser.microdata
@@ -1,7 +1,12 @@
 import datetime
 import unittest
 
-from .date_and_time import parse_date, parse_time
+from .date_and_time import (
+    contains_date,
+    parse_date,
+    parse_iso_date_and_time,
+    parse_time,
+)
 
 
 class TestParseDate(unittest.TestCase):
@@ -43,5 +48,50 @@ class TestParseTime(unittest.TestCase):
         self.assertIsNone(parse_time(0))  # type: ignore[arg-type]
 
 
+class TestParseIsoDateAndTime(unittest.TestCase):
+    def test_date_only(self) -> None:
+        result = parse_iso_date_and_time("2025-03-01")
+        assert result is not None
+        self.assertEqual(result.date, datetime.date(2025, 3, 1))
+        self.assertIsNone(result.time)
+
+    def test_utc_offset(self) -> None:
+        for value, offset in (
+            ("2025-03-01T18:30:00-05:00", datetime.timedelta(hours=-5)),
+            ("2025-03-01T18:30:00-03:30", datetime.timedelta(hours=-3, minutes=-30)),
+            ("2025-03-01T18:30:00Z", datetime.timedelta(0)),
+        ):
+            with self.subTest(value=value):
+                result = parse_iso_date_and_time(value)
+                assert result is not None
+                self.assertEqual(result.date, datetime.date(2025, 3, 1))
+                self.assertEqual(
+                    result.time,
+                    datetime.time(18, 30, tzinfo=datetime.timezone(offset)),
+                )
+
+    def test_invalid(self) -> None:
+        self.assertIsNone(parse_iso_date_and_time("March 1, 2025"))
+        self.assertIsNone(parse_iso_date_and_time(""))
+
+
+class TestContainsDate(unittest.TestCase):
+    def test_dates(self) -> None:
+        for text in (
+            "Starts 2025-03-01 at 7 pm",
+            "Tuesday, March 4",
+            "Mar. 4",
+            "le 1er mars 2025",
+            "12 décembre",
+        ):
+            with self.subTest(text=text):
+                self.assertTrue(contains_date(text))
+
+    def test_no_dates(self) -> None:
+        for text in ("Upcoming events", "Room 2025", "version 1.2.3", "Marché 12"):
+            with self.subTest(text=text):
+                self.assertFalse(contains_date(text))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,38 @@
+import json
+import unittest
+
+from .json_stream import JsonArrayItems
+
+ITEMS = [
+    {"title": 'Braces {like} [these] and "quotes"', "start": {"year": 2025}},
+    {"title": "Back\\slash", "tags": ["a", "b"], "end": None},
+    {"title": "Unicode é 🎉", "nested": {"list": [{"x": 1}]}},
+]
+DOCUMENT = json.dumps({"other": [{"skip": True}], "events": ITEMS, "after": "]"})
+
+
+class TestJsonArrayItems(unittest.TestCase):
+    def test_whole_document(self) -> None:
+        self.assertEqual(JsonArrayItems("events").feed(DOCUMENT), ITEMS)
+
+    def test_any_chunk_size(self) -> None:
+        for size in (1, 2, 3, 7, 50):
+            with self.subTest(size=size):
+                parser = JsonArrayItems("events")
+                items = []
+                for start in range(0, len(DOCUMENT), size):
+                    items.extend(parser.feed(DOCUMENT[start : start + size]))
+                self.assertEqual(items, ITEMS)
+
+    def test_items_as_soon_as_they_close(self) -> None:
+        parser = JsonArrayItems("events")
+        first_end = DOCUMENT.index("}}") + 2
+        self.assertEqual(parser.feed(DOCUMENT[:first_end]), ITEMS[:1])
+        self.assertEqual(parser.feed(DOCUMENT[first_end:]), ITEMS[1:])
+
+    def test_other_keys_ignored(self) -> None:
+        self.assertEqual(JsonArrayItems("missing").feed(DOCUMENT), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
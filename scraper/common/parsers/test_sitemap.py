@@ -0,0 +1,94 @@
+import datetime
+import gzip
+import unittest
+
+from .sitemap import is_under_path, normalize_url, parse_lastmod, parse_sitemap
+
+URLSET = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url>
+    <loc>https://example.com/events/one/</loc>
+    <lastmod>2024-01-02T03:04:05+00:00</lastmod>
+  </url>
+  <url>
+    <loc>https://example.com/events/two/</loc>
+  </url>
+</urlset>
+"""
+
+SITEMAP_INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap>
+    <loc>https://example.com/post-sitemap.xml</loc>
+    <lastmod>2024-01-01</lastmod>
+  </sitemap>
+</sitemapindex>
+"""
+
+
+class TestParseSitemap(unittest.TestCase):
+    def test_urlset(self) -> None:
+        sitemap = parse_sitemap(URLSET)
+        self.assertEqual(
+            sitemap.pages,
+            {
+                "https://example.com/events/one/": datetime.datetime(
+                    2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc
+                ),
+                "https://example.com/events/two/": None,
+            },
+        )
+        self.assertEqual(sitemap.sitemaps, [])
+
+    def test_index(self) -> None:
+        sitemap = parse_sitemap(SITEMAP_INDEX)
+        self.assertEqual(sitemap.pages, {})
+        self.assertEqual(sitemap.sitemaps, ["https://example.com/post-sitemap.xml"])
+
+    def test_gzipped(self) -> None:
+        sitemap = parse_sitemap(gzip.compress(URLSET))
+        self.assertEqual(len(sitemap.pages), 2)
+
+    def test_invalid(self) -> None:
+        sitemap = parse_sitemap(b"<html><body>Not found</p></html>")
+        self.assertEqual(sitemap.pages, {})
+        self.assertEqual(sitemap.sitemaps, [])
+
+
+class TestParseLastmod(unittest.TestCase):
+    def test_formats(self) -> None:
+        utc = datetime.timezone.utc
+        cases = {
+            "2024-01-02": datetime.datetime(2024, 1, 2, tzinfo=utc),
+            "2024-01-02T03:04Z": datetime.datetime(2024, 1, 2, 3, 4, tzinfo=utc),
+            "2024-01-02T03:04:05-05:00": datetime.datetime(
+                2024, 1, 2, 8, 4, 5, tzinfo=utc
+            ),
+        }
+        for value, expected in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_lastmod(value), expected)
+
+    def test_invalid(self) -> None:
+        self.assertIsNone(parse_lastmod(None))
+        self.assertIsNone(parse_lastmod("yesterday"))
+
+
+class TestUrlMatching(unittest.TestCase):
+    def test_normalize(self) -> None:
+        self.assertEqual(
+            normalize_url("https://www.Example.com/events/#top"),
+            normalize_url("http://example.com/events"),
+        )
+
+    def test_under_path(self) -> None:
+        base = "https://example.com/events/"
+        self.assertTrue(is_under_path("https://example.com/events/one", base))
+        self.assertTrue(is_under_path("https://www.example.com/events", base))
+        self.assertFalse(is_under_path("https://example.com/events-archive", base))
+        self.assertFalse(is_under_path("https://example.com/news/one", base))
+        self.assertFalse(is_under_path("https://other.com/events/one", base))
+
+
+if __name__ == "__main__":
+    unittest.main()
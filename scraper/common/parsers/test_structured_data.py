@@ -0,0 +1,109 @@
+import unittest
+
+from .structured_data import extract_structured_data, schema_types
+
+PAGE_URL = "https://example.com/events/"
+
+
+class TestExtractStructuredData(unittest.TestCase):
+    def test_json_ld(self) -> None:
+        html = """
+        <html>
+            <head>
+                <script type="application/ld+json">
+                    {"@context": "https://schema.org", "@graph": [
+                        {"@type": "Organization", "name": "Org"},
+                        {"@type": "ItemList", "itemListElement": [
+                            {"@type": "ListItem", "item": {"@type": "Event", "name": "A"}},
+                            {"@type": "Event", "name": "B"}
+                        ]}
+                    ]}
+                </script>
+                <script type="application/ld+json">not json</script>
+            </head>
+            <body></body>
+        </html>
+        """
+        items = extract_structured_data(html, PAGE_URL)
+        self.assertEqual(
+            [(schema_types(item), item.get("name")) for item in items],
+            [
+                (["Organization"], "Org"),
+                (["ItemList"], None),
+                (["Event"], "A"),
+                (["Event"], "B"),
+            ],
+        )
+
+    def test_relative_urls(self) -> None:
+        html = """
+        <script type="application/ld+json">
+            {"@type": "Event", "name": "A", "url": "a.html", "image": ["/a.png"],
+             "location": {"@type": "Place", "name": "Hall", "url": "../hall"}}
+        </script>
+        """
+        [item] = extract_structured_data(html, PAGE_URL)
+        self.assertEqual(item["url"], "https://example.com/events/a.html")
+        self.assertEqual(item["image"], ["https://example.com/a.png"])
+        self.assertEqual(item["location"]["url"], "https://example.com/hall")
+        self.assertEqual(item["name"], "A")
+
+    def test_microdata(self) -> None:
+        html = """
+        <html><body>
+            <div itemscope itemtype="https://schema.org/Event">
+                <h2 itemprop="name">Talk</h2>
+                <a itemprop="url" href="/talk">More</a>
+                <time itemprop="startDate" datetime="2025-03-01T18:00">March 1</time>
+                <div itemprop="location" itemscope itemtype="https://schema.org/Place">
+                    <span itemprop="name">Hall</span>
+                </div>
+            </div>
+        </body></html>
+        """
+        self.assertEqual(
+            extract_structured_data(html, PAGE_URL),
+            [
+                {
+                    "@type": "https://schema.org/Event",
+                    "name": "Talk",
+                    "url": "https://example.com/talk",
+                    "startDate": "2025-03-01T18:00",
+                    "location": {"@type": "https://schema.org/Place", "name": "Hall"},
+                }
+            ],
+        )
+
+    def test_microdata_text(self) -> None:
+        """Should take the text of nested elements, and the first of repeated names"""
+        html = """
+        <div itemscope itemtype="Event">
+            <p itemprop="description">
+                <span itemprop="description">Inner</span> <b>bold</b>
+                <script>var ignored = 1;</script>
+            </p>
+            <span itemprop="name">First</span>
+            <span itemprop="name">Second</span>
+            <p itemprop="organizer">Unclosed
+        </div>
+        """
+        self.assertEqual(
+            extract_structured_data(html, PAGE_URL),
+            [
+                {
+                    "@type": "Event",
+                    "description": "Inner bold",
+                    "name": "First",
+                    "organizer": "Unclosed",
+                }
+            ],
+        )
+
+    def test_no_structured_data(self) -> None:
+        self.assertEqual(
+            extract_structured_data("<html><body>Hi</body></html>", PAGE_URL), []
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Name of the route which sends an item out of the pipeline to the consumer
+OUTPUT = "output"
+# How often blocked threads check whether the pipeline is stopping, in seconds
+POLL_INTERVAL = 0.05
+# Sent to every queue once all items have been processed
+DONE = object()
+
+# Each item is routed to a stage by name
+Route = Tuple[str, Any]
+Processor = Callable[[Any], Iterable[Route]]
+
+
+@dataclass
+class Stage:
+    name: str
+    process: Processor
+    workers: int
+    inbox: "queue.Queue[Any]"
+
+
+class StagedRunner:
+    """Runs items through stages, each with its own pool of threads
+
+    Each stage takes an item from its input queue, processes it and returns any number
+    of routes: pairs of (stage name, item) which say where to send the results next.
+    Items routed to OUTPUT are yielded by run(). An item which produces no routes is
+    dropped. Each route is sent on as soon as the processor produces it, so a processor
+    which is a generator lets later stages start on its first results while it's still
+    working on the rest.
+
+    Stage queues are bounded unless created with bounded=False, so a fast stage can't
+    run too far ahead of a slow one. A stage which feeds items back to an earlier stage
+    should send them to an unbounded queue, otherwise the stages could deadlock waiting
+    on each other.
+
+    If any stage raises an exception, the pipeline stops and run() re-raises it.
+    """
+
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self.stages: Dict[str, Stage] = {}
+        self.output: queue.Queue[Any] = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        # Number of items which are in a stage queue or being processed
+        self.pending = 0
+        self.stopping = threading.Event()
+        self.error: Optional[BaseException] = None
+
+    def add_stage(
+        self,
+        name: str,
+        process: Processor,
+        workers: int,
+        bounded: bool = True,
+    ) -> None:
+        # Leave room to tell every worker when the pipeline is done
+        maxsize = max(self.queue_size, workers) if bounded else 0
+        self.stages[name] = Stage(name, process, workers, queue.Queue(maxsize))
+
+    def run(self, routes: Iterable[Route]) -> Iterator[Any]:
+        """Send the initial items through the pipeline and yield the output"""
+        initial = list(routes)
+        if not initial:
+            return
+        self.pending = len(initial)
+        threads: List[threading.Thread] = []
+        for stage in self.stages.values():
+            for i in range(stage.workers):
+                thread = threading.Thread(
+                    target=self.work,
+                    args=(stage,),
+                    name=f"{stage.name}-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+        # Feed the initial items from another thread, so that we can start consuming
+        # the output even if they don't all fit in the queues at once
+        feeder = threading.Thread(target=self.feed, args=(initial,), daemon=True)
+        feeder.start()
+        threads.append(feeder)
+        try:
+            while True:
+                try:
+                    item = self.output.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if self.error is not None:
+                        raise self.error
+                    continue
+                if item is DONE:
+                    return
+                yield item
+        finally:
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+
+    def feed(self, routes: List[Route]) -> None:
+        for name, item in routes:
+            self.put(self.stages[name].inbox, item)
+
+    def work(self, stage: Stage) -> None:
+        logger = logging.getLogger(__name__)
+        while not self.stopping.is_set():
+            try:
+                item = stage.inbox.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is DONE:
+                return
+            try:
+                for route in stage.process(item):
+                    self.send(route)
+            except Exception as error:
+                logger.debug("Stopping pipeline after error in %s", stage.name)
+                with self.lock:
+                    if self.error is None:
+                        self.error = error
+                self.stopping.set()
+                return
+            self.finish()
+
+    def send(self, route: Route) -> None:
+        name, item = route
+        if name == OUTPUT:
+            self.put(self.output, item)
+            return
+        with self.lock:
+            self.pending += 1
+        self.put(self.stages[name].inbox, item)
+
+    def finish(self) -> None:
+        """Mark the item that was just processed as done"""
+        with self.lock:
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            # All the stage queues are empty, so there's room for these
+            for stage in self.stages.values():
+                for _ in range(stage.workers):
+                    stage.inbox.put_nowait(DONE)
+            self.put(self.output, DONE)
+
+    def put(self, destination: "queue.Queue[Any]", item: Any) -> None:
+        """Add an item to a queue, waiting for space unless the pipeline stops"""
+        while not self.stopping.is_set():
+            try:
+                destination.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+from typing import Iterator, List
+
+from .stages import OUTPUT, Route, StagedRunner
+
+
+class TestStagedRunner(unittest.TestCase):
+    def test_items_pass_through_stages(self) -> None:
+        runner = StagedRunner(queue_size=2)
+        runner.add_stage("double", lambda item: [("add", item * 2)], workers=2)
+        runner.add_stage("add", lambda item: [(OUTPUT, item + 1)], workers=2)
+        output = runner.run(("double", item) for item in range(10))
+        self.assertEqual(sorted(output), [item * 2 + 1 for item in range(10)])
+
+    def test_fan_out_and_drop(self) -> None:
+        def split(item: int) -> List[Route]:
+            # Feed each item back into this stage until it reaches zero
+            if item == 0:
+                return []
+            return [("split", item - 1), (OUTPUT, item)]
+
+        runner = StagedRunner(queue_size=2)
+        runner.add_stage("split", split, workers=3, bounded=False)
+        output = runner.run([("split", 3), ("split", 2)])
+        self.assertEqual(sorted(output), [1, 1, 2, 2, 3])
+
+    def test_no_items(self) -> None:
+        runner = StagedRunner(queue_size=2)
+        runner.add_stage("noop", lambda item: [(OUTPUT, item)], workers=1)
+        self.assertEqual(list(runner.run([])), [])
+
+    def test_stages_overlap(self) -> None:
+        in_flight = {"slow": 0, "fast": 0}
+        overlapped = threading.Event()
+        lock = threading.Lock()
+
+        def track(stage: str, next_stage: str, item: int) -> List[Route]:
+            with lock:
+                in_flight[stage] += 1
+                if all(in_flight.values()):
+                    overlapped.set()
+            time.sleep(0.01)
+            with lock:
+                in_flight[stage] -= 1
+            return [(next_stage, item)]
+
+        runner = StagedRunner(queue_size=4)
+        runner.add_stage("fast", lambda item: track("fast", "slow", item), workers=1)
+        runner.add_stage("slow", lambda item: track("slow", OUTPUT, item), workers=1)
+        self.assertEqual(len(list(runner.run(("fast", i) for i in range(10)))), 10)
+        self.assertTrue(overlapped.is_set())
+
+    def test_generator_routes_sent_immediately(self) -> None:
+        received = threading.Event()
+
+        def produce(item: int) -> Iterator[Route]:
+            yield ("consume", item)
+            # The first route is processed before this one is produced
+            self.assertTrue(received.wait(timeout=1))
+            yield ("consume", item + 1)
+
+        def consume(item: int) -> List[Route]:
+            received.set()
+            return [(OUTPUT, item)]
+
+        runner = StagedRunner(queue_size=2)
+        runner.add_stage("produce", produce, workers=1)
+        runner.add_stage("consume", consume, workers=1)
+        self.assertEqual(sorted(runner.run([("produce", 1)])), [1, 2])
+
+    def test_error_stops_pipeline(self) -> None:
+        def fail(item: int) -> List[Route]:
+            if item == 5:
+                raise ValueError("Bad item")
+            return [(OUTPUT, item)]
+
+        runner = StagedRunner(queue_size=2)
+        runner.add_stage("fail", fail, workers=2)
+        with self.assertRaises(ValueError):
+            list(runner.run(("fail", item) for item in range(100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
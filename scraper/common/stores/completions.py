@@ -0,0 +1,67 @@
+import logging
+import threading
+from collections import Counter
+from typing import Optional
+
+from .sqlite import SqliteStore
+
+
+class CompletionCache:
+    """Persistent cache of parsed completions, keyed by archive.completion_key()
+
+    Keys identify the model, prompt, response schema and content, so a cached
+    completion is only reused for exactly the same request. Expiry and eviction are
+    left to the underlying store.
+
+    Hits and misses are counted, in total and per source if the lookup gives one,
+    along with an estimate of the tokens which hits saved.
+    """
+
+    def __init__(self, store: SqliteStore) -> None:
+        self.store = store
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.source_hits: Counter[str] = Counter()
+        self.source_misses: Counter[str] = Counter()
+
+    def get(self, key: str, source: Optional[str] = None) -> Optional[str]:
+        value = self.store.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                if source is not None:
+                    self.source_misses[source] += 1
+            else:
+                self.hits += 1
+                if source is not None:
+                    self.source_hits[source] += 1
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self.store.put(key, value)
+
+    def record_saved(self, tokens: int) -> None:
+        with self.lock:
+            self.saved_tokens += tokens
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        with self.lock:
+            lookups = self.hits + self.misses
+            logger.info(
+                "Completion cache: %d hits of %d lookups (%.0f%%), saving about %d "
+                "tokens",
+                self.hits,
+                lookups,
+                100 * self.hits / lookups if lookups else 0.0,
+                self.saved_tokens,
+            )
+            for source in sorted(set(self.source_hits) | set(self.source_misses)):
+                logger.info(
+                    "Completion cache for %s: %d hits, %d misses",
+                    source,
+                    self.source_hits[source],
+                    self.source_misses[source],
+                )
@@ -0,0 +1,117 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class SqliteStore:
+    """Thread-safe, persistent key-value store backed by a SQLite table
+
+    All threads share one connection, guarded by a lock. Each write is committed
+    immediately, and the database uses write-ahead logging, so an interrupted run
+    keeps everything stored before it stopped.
+
+    If ttl is given, values expire that many seconds after they were stored. If
+    max_entries is given, the least recently used values are evicted to keep the
+    store within that size.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        table: str = "store",
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL, "
+                "accessed REAL NOT NULL DEFAULT 0)"
+            )
+            columns = {
+                row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")
+            }
+            # Tables created before LRU eviction was supported
+            if "accessed" not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE {table} ADD COLUMN accessed REAL NOT NULL DEFAULT 0"
+                )
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT value, updated FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and row[1] < now - self.ttl:
+                self.connection.execute(
+                    f"DELETE FROM {self.table} WHERE key = ?", (key,)
+                )
+                return None
+            if self.max_entries is not None:
+                self.connection.execute(
+                    f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key)
+                )
+        return str(row[0])
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, updated, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.max_entries is not None:
+                self.evict(self.max_entries)
+
+    def evict(self, max_entries: int) -> None:
+        """Delete the least recently used values beyond max_entries
+
+        The lock must be held.
+        """
+        (count,) = self.connection.execute(
+            f"SELECT COUNT(*) FROM {self.table}"
+        ).fetchone()
+        if count <= max_entries:
+            return
+        self.connection.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)",
+            (count - max_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def __len__(self) -> int:
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT COUNT(*) FROM {self.table}"
+            ).fetchone()
+        return int(row[0])
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
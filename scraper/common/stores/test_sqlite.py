@@ -0,0 +1,78 @@
+import sqlite3
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from .sqlite import SqliteStore
+
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "store.sqlite3"
+
+    def test_get_put_delete(self) -> None:
+        store = SqliteStore(self.path)
+        self.addCleanup(store.close)
+        self.assertIsNone(store.get("a"))
+        store.put("a", "1")
+        store.put("a", "2")
+        self.assertEqual(store.get("a"), "2")
+        self.assertEqual(len(store), 1)
+        store.delete("a")
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(len(store), 0)
+
+    def test_persisted(self) -> None:
+        store = SqliteStore(self.path, table="first")
+        store.put("a", "1")
+        store.close()
+        store = SqliteStore(self.path, table="first")
+        self.addCleanup(store.close)
+        self.assertEqual(store.get("a"), "1")
+
+    def test_expired(self) -> None:
+        store = SqliteStore(self.path, ttl=0.01)
+        self.addCleanup(store.close)
+        store.put("a", "1")
+        self.assertEqual(store.get("a"), "1")
+        time.sleep(0.02)
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(len(store), 0)
+
+    def test_least_recently_used_evicted(self) -> None:
+        store = SqliteStore(self.path, max_entries=2)
+        self.addCleanup(store.close)
+        for key in ("a", "b", "a", "c"):
+            if store.get(key) is None:
+                store.put(key, key)
+            time.sleep(0.001)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get("a"), "a")
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.get("c"), "c")
+
+    def test_table_without_access_times(self) -> None:
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            "CREATE TABLE store (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "updated REAL NOT NULL)"
+        )
+        connection.execute("INSERT INTO store VALUES ('a', '1', 0)")
+        connection.commit()
+        connection.close()
+        store = SqliteStore(self.path, max_entries=1)
+        self.addCleanup(store.close)
+        self.assertEqual(store.get("a"), "1")
+        store.put("b", "2")
+        self.assertEqual(len(store), 1)
+
+    def test_invalid_table(self) -> None:
+        with self.assertRaises(ValueError):
+            SqliteStore(self.path, table="store; DROP TABLE store")
+
+
+if __name__ == "__main__":
+    unittest.main()
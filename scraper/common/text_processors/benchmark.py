@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from scraper.common.api.archive import INDEX_FILE, PageArchive
+from .html import available_parsers, clean_content, CONTENT_FORMATS, FALLBACK_PARSER
+from .streaming import clean_content_streaming, STREAMING_CLEANER
+from .tokens import estimate_tokens
+
+# (name, content) of each page in the corpus
+Page = Tuple[str, str]
+
+
+@dataclass
+class ParserResult:
+    parser: str
+    content_format: str
+    pages: int
+    bytes: int
+    seconds: float
+    # Length of the cleaned output for one pass over the corpus
+    output_chars: int
+    output_tokens: int
+    # Pages whose cleaned output differs from the reference parser's
+    mismatches: List[str] = field(default_factory=list)
+
+
+def load_corpus(path: Path) -> List[Page]:
+    """Load HTML pages from an archive made with --record or a directory of files"""
+    if (path / INDEX_FILE).exists():
+        archive = PageArchive(path, replay=True)
+        return [
+            (page.url, page.body.decode(page.encoding or "utf-8", "replace"))
+            for page in archive.iter_pages()
+            if page.content_type is None or "html" in page.content_type
+        ]
+    return [
+        (str(file), file.read_text(encoding="utf-8", errors="replace"))
+        for file in sorted(path.glob("**/*.htm*"))
+    ]
+
+
+def normalize(output: Optional[str]) -> Optional[str]:
+    """Ignore differences in whitespace between parsers"""
+    return " ".join(output.split()) if output is not None else None
+
+
+def benchmark_parsers(
+    pages: Sequence[Page],
+    parsers: Sequence[str],
+    repeat: int,
+    content_format: str,
+) -> List[ParserResult]:
+    """Clean every page with each parser, checking the output matches html.parser's"""
+    reference: Dict[str, Optional[str]] = {
+        name: normalize(
+            clean_content(
+                content,
+                parser=FALLBACK_PARSER,
+                content_format=content_format,
+            )
+        )
+        for name, content in pages
+    }
+    size = sum(len(content.encode()) for _, content in pages)
+    results = []
+    for parser in parsers:
+        outputs: Dict[str, Optional[str]] = {}
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for name, content in pages:
+                if parser == STREAMING_CLEANER:
+                    outputs[name] = clean_content_streaming(content, content_format)
+                else:
+                    outputs[name] = clean_content(
+                        content,
+                        parser=parser,
+                        content_format=content_format,
+                    )
+        elapsed = time.perf_counter() - start
+        results.append(
+            ParserResult(
+                parser=parser,
+                content_format=content_format,
+                pages=len(pages) * repeat,
+                bytes=size * repeat,
+                seconds=elapsed,
+                output_chars=sum(len(output or "") for output in outputs.values()),
+                output_tokens=sum(
+                    estimate_tokens(output or "") for output in outputs.values()
+                ),
+                mismatches=[
+                    name
+                    for name, output in outputs.items()
+                    if normalize(output) != reference[name]
+                ],
+            )
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""
+            Compare the speed of each installed HTML parser at cleaning a corpus of
+            real pages, and how many tokens each content format uses. Also check that
+            all parsers produce equivalent output.
+        """,
+    )
+    parser.add_argument(
+        "corpus",
+        type=Path,
+        help="""
+            Archive directory created with python -m scraper --record, or a directory
+            of HTML files.
+        """,
+    )
+    parser.add_argument(
+        "--parsers",
+        nargs="+",
+        choices=[*available_parsers(), STREAMING_CLEANER],
+        default=[*available_parsers(), STREAMING_CLEANER],
+        help="""
+            Parsers to benchmark, or streaming for the streaming cleaner. Defaults to
+            every installed parser and the streaming cleaner.
+        """,
+    )
+    parser.add_argument(
+        "--content-formats",
+        nargs="+",
+        choices=CONTENT_FORMATS,
+        default=list(CONTENT_FORMATS),
+        help="Content formats to benchmark. Defaults to every format.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to clean each page with each parser.",
+    )
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        parser.error(f"No HTML pages found in {args.corpus}")
+    input_tokens = sum(estimate_tokens(content) for _, content in pages)
+    print(f"Corpus: {len(pages)} pages, {input_tokens} estimated tokens")
+    results = [
+        result
+        for content_format in args.content_formats
+        for result in benchmark_parsers(
+            pages, args.parsers, args.repeat, content_format
+        )
+    ]
+    print(
+        f"{'parser':>12s} {'format':>8s} {'pages/s':>9s} {'MB/s':>7s} "
+        f"{'output':>10s} {'tokens':>9s} {'kept':>6s} {'mismatches':>11s}"
+    )
+    for result in results:
+        print(
+            f"{result.parser:>12s} {result.content_format:>8s} "
+            f"{result.pages / result.seconds:9.1f} "
+            f"{result.bytes / result.seconds / 1e6:7.2f} {result.output_chars:10d} "
+            f"{result.output_tokens:9d} "
+            f"{100 * result.output_tokens / input_tokens:5.1f}% "
+            f"{len(result.mismatches):11d}"
+        )
+    mismatched = [result for result in results if result.mismatches]
+    for result in mismatched:
+        print(
+            f"\n{result.parser} {result.content_format} output differs from "
+            f"{FALLBACK_PARSER} for:"
+        )
+        for name in result.mismatches:
+            print(f"  {name}")
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
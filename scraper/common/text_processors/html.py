@@ -1,12 +1,31 @@
 import html
+import importlib
+import importlib.util
 import logging
+import re
 from collections.abc import Mapping, Sequence
-from typing import cast, Optional, TypeVar
+from dataclasses import dataclass
+from typing import Any, Callable, cast, Dict, List, Optional, TypeVar
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+from .markdown import to_markdown
+from .profiles import SiteProfile
 
 T = TypeVar("T")
 
+# Formats which clean_content() can produce
+HTML_FORMAT = "html"
+MARKDOWN_FORMAT = "markdown"
+CONTENT_FORMATS = (HTML_FORMAT, MARKDOWN_FORMAT)
+
+# Use the fastest parser which is installed. Output can differ slightly between
+# parsers, so this is opt-in rather than the default.
+AUTO_PARSER = "auto"
+# Pure Python parser which is always available, and so the default
+FALLBACK_PARSER = "html.parser"
+BODY_TAG = re.compile(r"<body[\s>/]", re.IGNORECASE)
+
 
 def convert_html_entities(data: T) -> T:
     """Convert HTML entities to their corresponding Unicode characters
@@ -29,10 +48,198 @@ def convert_html_entities(data: T) -> T:
     return data
 
 
-def clean_content(content: str) -> Optional[str]:
+def parse_with_html5_parser(content: str) -> BeautifulSoup:
+    html5_parser: Any = importlib.import_module("html5_parser")
+    return cast(BeautifulSoup, html5_parser.parse(content, treebuilder="soup"))
+
+
+@dataclass(frozen=True)
+class HtmlParser:
+    name: str
+    # Module which must be installed to use this parser
+    module: str
+    parse: Callable[[str], BeautifulSoup]
+    # Whether the parser adds a <body> element to documents which don't have one
+    adds_body: bool
+
+    def is_available(self) -> bool:
+        return importlib.util.find_spec(self.module) is not None
+
+
+# Supported parsers, fastest first
+HTML_PARSERS: Dict[str, HtmlParser] = {
+    parser.name: parser
+    for parser in (
+        HtmlParser(
+            name="html5-parser",
+            module="html5_parser",
+            parse=parse_with_html5_parser,
+            adds_body=True,
+        ),
+        HtmlParser(
+            name="lxml",
+            module="lxml",
+            parse=lambda content: BeautifulSoup(content, "lxml"),
+            adds_body=True,
+        ),
+        HtmlParser(
+            name=FALLBACK_PARSER,
+            module="html.parser",
+            parse=lambda content: BeautifulSoup(content, "html.parser"),
+            adds_body=False,
+        ),
+    )
+}
+
+# Parser used by clean_content(). Set with set_html_parser().
+HTML_PARSER = FALLBACK_PARSER
+
+
+def set_html_parser(name: str) -> None:
+    global HTML_PARSER
+    if name != AUTO_PARSER and name not in HTML_PARSERS:
+        raise ValueError(f"Unknown HTML parser: {name}")
+    HTML_PARSER = name
+
+
+def available_parsers() -> List[str]:
+    return [name for name, parser in HTML_PARSERS.items() if parser.is_available()]
+
+
+def parser_candidates(name: str) -> List[HtmlParser]:
+    """List the parsers to try in order, falling back to html.parser"""
+    logger = logging.getLogger(__name__)
+    if name == AUTO_PARSER:
+        return [HTML_PARSERS[available] for available in available_parsers()]
+    parser = HTML_PARSERS[name]
+    if not parser.is_available():
+        logger.debug("HTML parser %s is not installed", name)
+        return [HTML_PARSERS[FALLBACK_PARSER]]
+    if name == FALLBACK_PARSER:
+        return [parser]
+    return [parser, HTML_PARSERS[FALLBACK_PARSER]]
+
+
+def parse_html(content: str, parser: Optional[str] = None) -> Optional[BeautifulSoup]:
+    """Parse a page with the given parser, or the one set with set_html_parser()
+
+    If the parser fails, fall back to the next one. Return None if the page has no
+    <body> element.
+    """
+    logger = logging.getLogger(__name__)
+    candidates = parser_candidates(parser or HTML_PARSER)
+    for candidate in candidates:
+        # Some parsers add a body to every document, so check the original
+        if candidate.adds_body and not BODY_TAG.search(content):
+            return None
+        try:
+            return candidate.parse(content)
+        except Exception as error:
+            if candidate is candidates[-1]:
+                raise
+            logger.warning("HTML parser %s failed: %r", candidate.name, error)
+    return None
+
+
+# Elements which never contain useful info
+DROPPED_TAGS = frozenset(("footer", "form", "header", "link", "style", "svg"))
+# Attributes which cost tokens without saying anything about the content
+DROPPED_ATTRIBUTES = frozenset(("class", "style"))
+DROPPED_ATTRIBUTE_PREFIXES = ("data-", "on")
+# Elements whose whitespace is significant or which aren't prose
+PRESERVE_WHITESPACE_TAGS = frozenset(("pre", "script", "textarea"))
+WHITESPACE = re.compile(r"\s+")
+
+
+def is_useful_script(attributes: Mapping[str, Any]) -> bool:
+    if attributes.get("type") != "application/json":
+        return False
+    script_id = attributes.get("id")
+    # Wix sites sometimes include long, irrelevant script elements
+    return not (isinstance(script_id, str) and script_id.startswith("wix"))
+
+
+def is_dropped_attribute(name: str) -> bool:
+    return name in DROPPED_ATTRIBUTES or name.startswith(DROPPED_ATTRIBUTE_PREFIXES)
+
+
+def strip_attributes(tag: Tag) -> None:
+    for name in list(tag.attrs):
+        if is_dropped_attribute(name):
+            del tag.attrs[name]
+
+
+def collapse_whitespace(match: re.Match[str]) -> str:
+    return "\n" if "\n" in match.group() else " "
+
+
+def prune(body: Tag) -> None:
+    """Remove unwanted elements, attributes and whitespace in a single pass"""
+    strip_attributes(body)
+    stack = [body]
+    while stack:
+        tag = stack.pop()
+        for child in list(tag.children):
+            if isinstance(child, Tag):
+                if child.name in DROPPED_TAGS or (
+                    child.name == "script" and not is_useful_script(child.attrs)
+                ):
+                    child.decompose()
+                    continue
+                strip_attributes(child)
+                if child.name not in PRESERVE_WHITESPACE_TAGS:
+                    stack.append(child)
+            # Leave comments, CDATA and so on alone
+            elif type(child) is NavigableString:
+                text = WHITESPACE.sub(collapse_whitespace, child)
+                if text != child:
+                    child.replace_with(text)
+
+
+def select_content(body: Tag, profile: SiteProfile) -> None:
+    """Reduce the body to the parts of the page selected by a site profile
+
+    If none of the elements to keep are found, e.g. because the site's layout changed,
+    the whole body is kept.
+    """
+    logger = logging.getLogger(__name__)
+    for selector in profile.drop:
+        for element in body.select(selector):
+            # Elements inside ones dropped already are gone too
+            if not element.decomposed:
+                element.decompose()
+    # Use the first selector which matches anything
+    selected = next(
+        (found for found in map(body.select, profile.keep) if found),
+        None,
+    )
+    if not selected:
+        if profile.keep:
+            logger.warning(
+                "No elements matched %s, keeping the whole page", profile.keep
+            )
+        return
+    selected_ids = {id(element) for element in selected}
+    kept = [
+        element
+        for element in selected
+        if not any(id(parent) in selected_ids for parent in element.parents)
+    ]
+    for element in kept:
+        element.extract()
+    body.clear()
+    body.extend(kept)
+
+
+def clean_content(
+    content: str,
+    parser: Optional[str] = None,
+    content_format: str = HTML_FORMAT,
+    profile: Optional[SiteProfile] = None,
+) -> Optional[str]:
     """Filter out irrelevant parts of a webpage's content
 
-    1. Select the <body> element.
+    1. Select the <body> element, or the parts of it selected by the site's profile.
     2. Remove all of the following elements:
         <footer>
         <form>
@@ -41,40 +248,29 @@ def clean_content(content: str) -> Optional[str]:
         <style>
         <svg>
     3. Remove script elements which don't contain useful info
+    4. Remove class, style, data-* and event handler attributes
+    5. Collapse runs of whitespace
+
+    The page is parsed with the given parser, or the one set with set_html_parser().
+    The result isn't pretty-printed, since indentation costs tokens. With the markdown
+    format, the pruned body is converted to compact markdown, which is much shorter
+    still.
     """
     logger = logging.getLogger(__name__)
-    soup = BeautifulSoup(content, "html.parser")
-    starting_length = len(str(soup))
-    body = soup.body
-    if body is None:
+    soup = parse_html(content, parser)
+    body = soup.body if soup is not None else None
+    if soup is None or body is None:
         logger.warning("Content does not contain body element")
         return None
 
-    for script in body.find_all("script"):
-        if script.attrs.get("type") != "application/json":
-            script.decompose()
-            continue
-        script_id = script.attrs.get("id")
-        # Wix sites sometimes include long, irrelevant script elements
-        if isinstance(script_id, str) and script_id.startswith("wix"):
-            script.decompose()
-
-    for tag_to_delete in (
-        "footer",
-        "form",
-        "header",
-        "link",
-        "style",
-        "svg",
-    ):
-        for element in body.find_all(tag_to_delete):
-            element.decompose()
-
-    final_length = len(str(body))
+    if profile is not None:
+        select_content(body, profile)
+    prune(body)
+    cleaned = to_markdown(body) if content_format == MARKDOWN_FORMAT else str(body)
     logger.info(
         "Reduced content length from %d to %d (%.0f%%)",
-        starting_length,
-        final_length,
-        100 * final_length / starting_length,
+        len(content),
+        len(cleaned),
+        100 * len(cleaned) / len(content),
     )
-    return body.prettify()
+    return cleaned
@@ -0,0 +1,147 @@
+from typing import List
+
+from bs4 import NavigableString, PageElement, Tag
+
+# Elements which start on a new line
+BLOCK_TAGS = frozenset(
+    (
+        "address",
+        "article",
+        "aside",
+        "blockquote",
+        "dd",
+        "details",
+        "dialog",
+        "div",
+        "dl",
+        "dt",
+        "fieldset",
+        "figcaption",
+        "figure",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "hr",
+        "li",
+        "main",
+        "nav",
+        "ol",
+        "p",
+        "pre",
+        "section",
+        "summary",
+        "table",
+        "tr",
+        "ul",
+    )
+)
+HEADING_LEVELS = {f"h{level}": level for level in range(1, 7)}
+# Links which don't lead anywhere useful
+IGNORED_LINK_PREFIXES = ("#", "javascript:", "mailto:", "tel:")
+
+
+class MarkdownRenderer:
+    """Convert a pruned element into compact markdown
+
+    Only the structure which helps with extraction is kept: headings, lists, table
+    rows, link targets and the machine-readable values of <time> elements. Lines
+    aren't separated by blank lines, since those cost tokens without adding meaning.
+    """
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        self.line: List[str] = []
+        self.list_depth = 0
+
+    def render(self, element: Tag) -> str:
+        self.render_children(element)
+        self.newline()
+        return "\n".join(self.lines)
+
+    def newline(self) -> None:
+        text = " ".join("".join(self.line).split())
+        # Skip lines which only have a list marker or heading marker
+        if text.strip("#- "):
+            self.lines.append("  " * max(self.list_depth - 1, 0) + text)
+        self.line = []
+
+    def render_children(self, element: Tag) -> None:
+        for child in element.children:
+            self.render_element(child)
+
+    def render_element(self, element: PageElement) -> None:
+        if type(element) is NavigableString:
+            self.line.append(element)
+            return
+        if not isinstance(element, Tag):
+            # Comments, doctypes and so on
+            return
+
+        name = element.name
+        if name in HEADING_LEVELS:
+            self.newline()
+            self.line.append("#" * HEADING_LEVELS[name] + " ")
+            self.render_children(element)
+            self.newline()
+        elif name in ("ul", "ol"):
+            self.newline()
+            self.list_depth += 1
+            self.render_children(element)
+            self.list_depth -= 1
+        elif name == "li":
+            self.newline()
+            self.line.append("- ")
+            self.render_children(element)
+            self.newline()
+        elif name == "a":
+            self.render_link(element)
+        elif name == "time":
+            self.render_children(element)
+            timestamp = element.attrs.get("datetime")
+            if isinstance(timestamp, str) and timestamp not in element.get_text():
+                self.line.append(f" ({timestamp})")
+        elif name == "br":
+            self.newline()
+        elif name in ("td", "th"):
+            if "".join(self.line).strip():
+                self.line.append(" | ")
+            self.render_children(element)
+        elif name in ("pre", "script"):
+            # Keep the original line breaks, e.g. for JSON data
+            self.newline()
+            self.lines.extend(
+                line for line in element.get_text().splitlines() if line.strip()
+            )
+        elif name == "img":
+            return
+        elif name in BLOCK_TAGS:
+            self.newline()
+            self.render_children(element)
+            self.newline()
+        else:
+            self.render_children(element)
+
+    def render_link(self, link: Tag) -> None:
+        href = link.attrs.get("href")
+        if not isinstance(href, str) or href.startswith(IGNORED_LINK_PREFIXES):
+            self.render_children(link)
+            return
+        if link.find(BLOCK_TAGS) is not None:
+            # Links wrapping whole cards can't be written inline
+            self.render_children(link)
+            self.newline()
+            self.line.append(f"[link]({href})")
+            self.newline()
+            return
+        start = len(self.line)
+        self.render_children(link)
+        text = " ".join("".join(self.line[start:]).split())
+        del self.line[start:]
+        self.line.append(f"[{text or 'link'}]({href})")
+
+
+def to_markdown(element: Tag) -> str:
+    return MarkdownRenderer().render(element)
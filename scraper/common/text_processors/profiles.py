@@ -0,0 +1,28 @@
+from dataclasses import dataclass
+from typing import Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+
+@dataclass(frozen=True)
+class SiteProfile:
+    """What to send to the model from a particular site's pages"""
+
+    # CSS selectors for the elements which contain the events, most specific first.
+    # Only the elements matched by the first selector which matches anything are
+    # kept. If none of them match, the whole body is kept.
+    keep: Tuple[str, ...] = ()
+    # CSS selectors for more elements to drop, besides those dropped from every page
+    drop: Tuple[str, ...] = ()
+    # Whether event pages have details which aren't already on the listing page
+    fetch_details: bool = True
+
+
+def site_key(url: str) -> str:
+    """Return the host of a URL without any www. prefix, for looking up site settings"""
+    return urlparse(url).netloc.lower().removeprefix("www.")
+
+
+def find_profile(
+    profiles: Mapping[str, SiteProfile], url: str
+) -> Optional[SiteProfile]:
+    return profiles.get(site_key(url))
@@ -0,0 +1,224 @@
+import logging
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Tuple, Union
+
+from .html import (
+    DROPPED_TAGS,
+    HTML_FORMAT,
+    is_dropped_attribute,
+    is_useful_script,
+    MARKDOWN_FORMAT,
+    parse_html,
+    PRESERVE_WHITESPACE_TAGS,
+    WHITESPACE,
+    collapse_whitespace,
+)
+from .markdown import to_markdown
+
+# Ways in which OpenAIApi can clean pages
+TREE_CLEANER = "tree"
+STREAMING_CLEANER = "streaming"
+CLEANERS = (TREE_CLEANER, STREAMING_CLEANER)
+
+# Elements which never have content or an end tag
+VOID_TAGS = frozenset(
+    (
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+    )
+)
+# Elements whose content is written as is, rather than escaped
+RAW_TEXT_TAGS = frozenset(("script", "style"))
+
+Attributes = List[Tuple[str, Optional[str]]]
+
+
+def escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def format_attribute(name: str, value: Optional[str]) -> str:
+    value = escape(value or "")
+    if '"' not in value:
+        return f' {name}="{value}"'
+    if "'" not in value:
+        return f" {name}='{value}'"
+    return f' {name}="{value.replace(chr(34), "&quot;")}"'
+
+
+class StreamingCleaner(HTMLParser):
+    """Clean a page as it's parsed, without building a tree of the whole page
+
+    Produces the same output as clean_content() with html.parser for well-formed
+    pages. Unwanted elements are skipped as they're parsed, and kept content is
+    written straight to the output, so the memory used is proportional to the output
+    and the depth of the page rather than the size of the page. Feed the page in as
+    many chunks as needed, then call finish().
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.output: List[str] = []
+        self.text: List[str] = []
+        # Names of the open elements in the body, and whether each is kept
+        self.open: List[Tuple[str, bool]] = []
+        self.in_body = False
+        self.finished_body = False
+        # Number of open elements which are dropped, or whose content is preserved
+        self.dropping = 0
+        self.preserving = 0
+
+    def finish(self) -> Optional[str]:
+        """Return the cleaned body, or None if the page has no <body> element"""
+        self.close()
+        if not self.in_body and not self.finished_body:
+            return None
+        self.end_body()
+        return "".join(self.output)
+
+    def flush_text(self) -> None:
+        if not self.text:
+            return
+        text = "".join(self.text)
+        self.text = []
+        if self.dropping:
+            return
+        raw = self.open and self.open[-1][0] in RAW_TEXT_TAGS
+        if not raw:
+            text = escape(text)
+        if not self.preserving:
+            text = WHITESPACE.sub(collapse_whitespace, text)
+        self.output.append(text)
+
+    def write_start_tag(self, tag: str, attrs: Attributes, void: bool) -> None:
+        # Sorted like BeautifulSoup's output
+        attributes = "".join(
+            format_attribute(name, value)
+            for name, value in sorted(dict(attrs).items())
+            if self.preserving or not is_dropped_attribute(name)
+        )
+        self.output.append(f"<{tag}{attributes}{'/' if void else ''}>")
+
+    def is_dropped(self, tag: str, attrs: Attributes) -> bool:
+        if self.preserving:
+            return False
+        if tag == "script":
+            return not is_useful_script(dict(attrs))
+        return tag in DROPPED_TAGS
+
+    def handle_starttag(self, tag: str, attrs: Attributes) -> None:
+        if self.finished_body:
+            return
+        if not self.in_body:
+            if tag == "body":
+                self.in_body = True
+                self.write_start_tag(tag, attrs, void=False)
+            return
+        self.flush_text()
+        void = tag in VOID_TAGS
+        kept = not self.dropping and not self.is_dropped(tag, attrs)
+        if kept:
+            self.write_start_tag(tag, attrs, void)
+        if void:
+            return
+        self.open.append((tag, kept))
+        if not kept:
+            self.dropping += 1
+        elif tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserving += 1
+
+    def handle_startendtag(self, tag: str, attrs: Attributes) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if not self.in_body:
+            return
+        self.flush_text()
+        if tag in ("body", "html"):
+            self.end_body()
+            return
+        # Like html.parser, ignore end tags which don't match any open element, and
+        # close any elements inside the one ending which weren't closed themselves
+        if all(name != tag for name, _ in self.open):
+            return
+        while self.open:
+            name, _ = self.open[-1]
+            self.close_element()
+            if name == tag:
+                break
+
+    def close_element(self) -> None:
+        name, kept = self.open.pop()
+        if not kept:
+            self.dropping -= 1
+            return
+        if not self.dropping:
+            self.output.append(f"</{name}>")
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self.preserving -= 1
+
+    def end_body(self) -> None:
+        if not self.in_body:
+            return
+        self.flush_text()
+        while self.open:
+            self.close_element()
+        self.output.append("</body>")
+        self.in_body = False
+        self.finished_body = True
+
+    def handle_data(self, data: str) -> None:
+        if self.in_body:
+            self.text.append(data)
+
+    def handle_comment(self, data: str) -> None:
+        if self.in_body:
+            self.flush_text()
+            if not self.dropping:
+                self.output.append(f"<!--{data}-->")
+
+
+def clean_content_streaming(
+    content: Union[str, Iterable[str]],
+    content_format: str = HTML_FORMAT,
+) -> Optional[str]:
+    """Streaming counterpart to clean_content(), which takes the page in chunks
+
+    The markdown format is rendered from a tree of the cleaned body, which is much
+    smaller than a tree of the whole page.
+    """
+    logger = logging.getLogger(__name__)
+    cleaner = StreamingCleaner()
+    length = 0
+    for chunk in [content] if isinstance(content, str) else content:
+        cleaner.feed(chunk)
+        length += len(chunk)
+    cleaned = cleaner.finish()
+    if cleaned is None:
+        logger.warning("Content does not contain body element")
+        return None
+    if content_format == MARKDOWN_FORMAT:
+        soup = parse_html(cleaned)
+        body = soup.body if soup is not None else None
+        cleaned = to_markdown(body) if body is not None else ""
+    logger.info(
+        "Reduced content length from %d to %d (%.0f%%)",
+        length,
+        len(cleaned),
+        100 * len(cleaned) / max(length, 1),
+    )
+    return cleaned
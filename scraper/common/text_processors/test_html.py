@@ -1,10 +1,20 @@
 import unittest
 from collections import OrderedDict
 from typing import Optional
+from unittest.mock import patch
 
 from bs4 import BeautifulSoup
 
-from .html import convert_html_entities, clean_content
+from .html import (
+    available_parsers,
+    convert_html_entities,
+    clean_content,
+    HTML_PARSERS,
+    HtmlParser,
+    parse_html,
+    set_html_parser,
+)
+from .profiles import SiteProfile
 
 
 class TestConvertHtmlEntities(unittest.TestCase):
@@ -223,6 +233,113 @@ class TestCleanContent(unittest.TestCase):
         result = clean_content(html)
         self.compare_html(expected, result)
 
+    def test_strip_attributes(self) -> None:
+        html = """
+        <html>
+            <body class="home" onload="init()">
+                <div class="card" style="color: red" data-id="1">
+                    <a class="link" href="/event" onclick="track()">Event</a>
+                    <time datetime="2025-01-01" data-format="short">Jan 1</time>
+                </div>
+            </body>
+        </html>
+        """
+        result = clean_content(html)
+        self.assertEqual(
+            result,
+            '<body>\n<div>\n<a href="/event">Event</a>\n'
+            '<time datetime="2025-01-01">Jan 1</time>\n</div>\n</body>',
+        )
+
+    def test_preserve_whitespace(self) -> None:
+        html = "<html><body><p>a   b</p><pre>a   b</pre></body></html>"
+        self.assertEqual(
+            clean_content(html),
+            "<body><p>a b</p><pre>a   b</pre></body>",
+        )
+
+
+class TestSiteProfiles(unittest.TestCase):
+    html = """
+    <html>
+        <body>
+            <nav>Menu</nav>
+            <div class="events">
+                <div class="event">First <span class="share">Share</span></div>
+                <div class="event">Second</div>
+            </div>
+            <aside><div class="event">Promoted</div></aside>
+        </body>
+    </html>
+    """
+
+    def test_keep(self) -> None:
+        profile = SiteProfile(keep=(".events", ".event"), drop=(".share", "aside"))
+        self.assertEqual(
+            clean_content(self.html, profile=profile),
+            "<body><div>\n<div>First </div>\n<div>Second</div>\n</div></body>",
+        )
+
+    def test_first_matching_selector(self) -> None:
+        profile = SiteProfile(keep=("main", ".event"), drop=("aside",))
+        self.assertEqual(
+            clean_content(self.html, profile=profile),
+            "<body><div>First <span>Share</span></div><div>Second</div></body>",
+        )
+
+    def test_no_match(self) -> None:
+        """Should keep the whole page if the selectors don't match"""
+        profile = SiteProfile(keep=("main",), drop=("nav",))
+        with self.assertLogs(level="WARNING"):
+            result = clean_content(self.html, profile=profile)
+        assert result is not None
+        self.assertNotIn("Menu", result)
+        self.assertIn("Second", result)
+        self.assertIn("Promoted", result)
+
+
+class TestHtmlParsers(unittest.TestCase):
+    def tearDown(self) -> None:
+        set_html_parser("html.parser")
+
+    def test_unknown_parser(self) -> None:
+        with self.assertRaises(ValueError):
+            set_html_parser("regex")
+
+    def test_parsers_agree(self) -> None:
+        html = """
+        <html>
+            <body>
+                <header>Menu</header>
+                <h1>Title</h1>
+                <script>alert('Hello');</script>
+                <p>Lorem <b>ipsum</b></p>
+                <footer>Contact</footer>
+            </body>
+        </html>
+        """
+        expected = clean_content(html, parser="html.parser")
+        assert expected is not None
+        for parser in available_parsers():
+            with self.subTest(parser=parser):
+                result = clean_content(html, parser=parser)
+                assert result is not None
+                self.assertEqual(result.split(), expected.split())
+                self.assertIsNone(clean_content("abc", parser=parser))
+
+    def test_fallback(self) -> None:
+        """Should fall back to html.parser if the chosen parser fails"""
+
+        def fail(content: str) -> BeautifulSoup:
+            raise RuntimeError("parser crashed")
+
+        broken = HtmlParser("lxml", module="html.parser", parse=fail, adds_body=True)
+        with patch.dict(HTML_PARSERS, {"lxml": broken}):
+            set_html_parser("lxml")
+            soup = parse_html("<html><body><p>Text</p></body></html>")
+        assert soup is not None
+        self.assertEqual(soup.get_text(), "Text")
+
 
 if __name__ == "__main__":
     unittest.main()
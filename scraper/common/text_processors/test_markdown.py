@@ -0,0 +1,91 @@
+import unittest
+
+from bs4 import BeautifulSoup
+
+from .html import clean_content
+from .markdown import to_markdown
+
+
+def render(html: str) -> str:
+    body = BeautifulSoup(html, "html.parser").body
+    assert body is not None
+    return to_markdown(body)
+
+
+class TestToMarkdown(unittest.TestCase):
+    def test_headings_and_paragraphs(self) -> None:
+        self.assertEqual(
+            render("<body><h2>Upcoming <b>events</b></h2><p>Some\n   text</p></body>"),
+            "## Upcoming events\nSome text",
+        )
+
+    def test_links(self) -> None:
+        self.assertEqual(
+            render(
+                '<body><p><a href="/event/1">AI <i>Safety</i> Day</a> '
+                '<a href="#top">Top</a> <a href="/e/2"></a></p></body>'
+            ),
+            "[AI Safety Day](/event/1) Top [link](/e/2)",
+        )
+
+    def test_card_link(self) -> None:
+        self.assertEqual(
+            render(
+                '<body><a href="/card"><div><h3>Card</h3><p>Text</p></div></a></body>'
+            ),
+            "### Card\nText\n[link](/card)",
+        )
+
+    def test_lists(self) -> None:
+        self.assertEqual(
+            render(
+                "<body><ul><li>One<ul><li>Nested</li></ul></li><li></li><li>Two</li></ul></body>"
+            ),
+            "- One\n  - Nested\n- Two",
+        )
+
+    def test_time(self) -> None:
+        self.assertEqual(
+            render(
+                '<body><time datetime="2025-03-01T10:00">March 1</time> '
+                '<time datetime="2025-03-02">2025-03-02</time></body>'
+            ),
+            "March 1 (2025-03-01T10:00) 2025-03-02",
+        )
+
+    def test_table(self) -> None:
+        self.assertEqual(
+            render(
+                "<body><table><tr><th>When</th><th>What</th></tr>"
+                "<tr><td>Monday</td><td>Talk</td></tr></table></body>"
+            ),
+            "When | What\nMonday | Talk",
+        )
+
+    def test_json_script(self) -> None:
+        self.assertEqual(
+            render(
+                '<body><p>A</p><script type="application/json">{\n"a": 1\n}</script></body>'
+            ),
+            'A\n{\n"a": 1\n}',
+        )
+
+    def test_clean_content(self) -> None:
+        html = """
+        <html>
+            <body>
+                <header>Menu</header>
+                <h1 class="title">Events</h1>
+                <script>alert('Hello');</script>
+                <p>See <a class="link" href="/events/1">the first event</a></p>
+            </body>
+        </html>
+        """
+        self.assertEqual(
+            clean_content(html, content_format="markdown"),
+            "# Events\nSee [the first event](/events/1)",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from .html import clean_content, FALLBACK_PARSER, MARKDOWN_FORMAT
+from .streaming import clean_content_streaming
+
+PAGE = """
+<!DOCTYPE html>
+<html>
+    <head>
+        <title>Events</title>
+        <link rel="stylesheet" href="style.css">
+    </head>
+    <body class="home" onload="init()">
+        <header><nav><a href="/">Home</a></nav></header>
+        <!-- Listing -->
+        <main data-page="1">
+            <h1>Upcoming   events</h1>
+            <ul>
+                <li class="event"><a href="/a?x=1&amp;y=2" title='Say "hi"'>A &amp; B</a>
+                <li class="event"><time datetime="2025-01-01">Jan&nbsp;1</time><br>
+                    <img src="a.png" alt="">
+            </ul>
+            <form><input name="q"></form>
+            <svg><circle r="1"/></svg>
+            <pre>  keep   this  </pre>
+            <script>track();</script>
+            <script type="application/json" id="data">{"a": "<b>"}</script>
+            <script type="application/json" id="wix-warmup-data">{}</script>
+            <div/><p>Done</p></span>
+        </main>
+        <footer>Contact</footer>
+    </body>
+</html>
+<script>after();</script>
+"""
+
+
+class TestStreamingCleaner(unittest.TestCase):
+    def test_same_as_tree(self) -> None:
+        expected = clean_content(PAGE, parser=FALLBACK_PARSER)
+        self.assertIsNotNone(expected)
+        self.assertEqual(clean_content_streaming(PAGE), expected)
+
+    def test_chunks(self) -> None:
+        """Should give the same output wherever the page is split"""
+        expected = clean_content_streaming(PAGE)
+        for size in (1, 7, 64):
+            with self.subTest(size=size):
+                chunks = (PAGE[i : i + size] for i in range(0, len(PAGE), size))
+                self.assertEqual(clean_content_streaming(chunks), expected)
+
+    def test_markdown(self) -> None:
+        self.assertEqual(
+            clean_content_streaming(PAGE, MARKDOWN_FORMAT),
+            clean_content(PAGE, parser=FALLBACK_PARSER, content_format=MARKDOWN_FORMAT),
+        )
+
+    def test_unclosed_elements(self) -> None:
+        html = "<html><body><div><p>One<p>Two</div><header>Dropped"
+        self.assertEqual(
+            clean_content_streaming(html),
+            clean_content(html, parser=FALLBACK_PARSER),
+        )
+
+    def test_no_body(self) -> None:
+        self.assertIsNone(clean_content_streaming("abc"))
+        self.assertIsNone(clean_content_streaming("<html><p>abc</p></html>"))
+
+
+if __name__ == "__main__":
+    unittest.main()
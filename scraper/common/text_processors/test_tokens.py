@@ -0,0 +1,47 @@
+import unittest
+
+from .tokens import estimate_tokens, split_content, split_html
+
+
+class TestSplitHtml(unittest.TestCase):
+    def test_small_page(self) -> None:
+        content = "<body><p>Short</p></body>"
+        self.assertEqual(split_html(content, max_tokens=100), ["<p>Short</p>"])
+
+    def test_split_at_elements(self) -> None:
+        items = [f"<li>Event number {i:02d}</li>" for i in range(20)]
+        content = f"<body><h1>Events</h1><ul>{''.join(items)}</ul></body>"
+        chunks = split_html(content, max_tokens=40)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk), 40)
+        # Every item appears whole in some chunk
+        for item in items:
+            self.assertTrue(any(item in chunk for chunk in chunks), item)
+
+    def test_overlap(self) -> None:
+        items = [f"<li>Event number {i:02d}</li>" for i in range(20)]
+        content = f"<body><ul>{''.join(items)}</ul></body>"
+        chunks = split_html(content, max_tokens=40, overlap_tokens=10)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            last_item = previous[previous.rindex("<li>") :]
+            self.assertTrue(chunk.startswith(last_item))
+
+    def test_long_text(self) -> None:
+        content = f"<body><p>{'x' * 1000}</p></body>"
+        chunks = split_html(content, max_tokens=100)
+        self.assertEqual("".join(chunks), "x" * 1000)
+        self.assertTrue(all(estimate_tokens(chunk) <= 100 for chunk in chunks))
+
+    def test_split_markdown(self) -> None:
+        lines = [f"- Event number {i:02d}\n" for i in range(20)]
+        chunks = split_content("".join(lines), max_tokens=30)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk), 30)
+            self.assertTrue(chunk.endswith("\n"))
+        self.assertEqual("".join(chunks), "".join(lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import logging
+import math
+import threading
+from collections import defaultdict
+from typing import DefaultDict, Iterable, Iterator, List
+
+from bs4 import NavigableString, PageElement, Tag
+
+from .html import parse_html
+
+# HTML is token-dense, so assume fewer characters per token than for prose. This is a
+# rough estimate for any model, not a count with its tokenizer. Erring towards too
+# many tokens keeps chunks and requests within their limits.
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate how many tokens the model will count for the text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_text(text: str, max_tokens: int) -> Iterator[str]:
+    size = max_tokens * CHARS_PER_TOKEN
+    for start in range(0, len(text), size):
+        yield text[start : start + size]
+
+
+def blocks(element: PageElement, max_tokens: int) -> Iterator[str]:
+    """Break an element into pieces which each fit within max_tokens
+
+    Elements which are too big are replaced by their children, so pieces always end
+    at element boundaries, except for text which is too long on its own.
+    """
+    if isinstance(element, Tag):
+        for child in element.children:
+            html = str(child)
+            if estimate_tokens(html) <= max_tokens:
+                yield html
+            elif isinstance(child, Tag):
+                yield from blocks(child, max_tokens)
+            elif isinstance(child, NavigableString):
+                yield from split_text(html, max_tokens)
+
+
+def pack(blocks: Iterable[str], max_tokens: int, overlap_tokens: int) -> List[str]:
+    """Combine consecutive blocks into chunks of at most max_tokens
+
+    Each chunk starts by repeating up to overlap_tokens of the end of the previous
+    chunk, so items which straddle a boundary appear whole in at least one chunk.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for block in blocks:
+        tokens = estimate_tokens(block)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("".join(current))
+            # Carry the last few blocks over to the next chunk
+            overlap: List[str] = []
+            overlap_size = 0
+            for previous in reversed(current):
+                size = estimate_tokens(previous)
+                if (
+                    overlap_size + size > overlap_tokens
+                    or overlap_size + size + tokens > max_tokens
+                ):
+                    break
+                overlap.insert(0, previous)
+                overlap_size += size
+            current = overlap
+            current_tokens = overlap_size
+        current.append(block)
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def split_html(content: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Split a cleaned page into chunks of at most max_tokens at element boundaries"""
+    soup = parse_html(content)
+    if soup is None:
+        return list(split_text(content, max_tokens))
+    return pack(blocks(soup.body or soup, max_tokens), max_tokens, overlap_tokens)
+
+
+def split_lines(content: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Split text, such as cleaned markdown, into chunks at line boundaries"""
+    lines = (
+        piece
+        for line in content.splitlines(keepends=True)
+        for piece in split_text(line, max_tokens)
+    )
+    return pack(lines, max_tokens, overlap_tokens)
+
+
+def split_content(content: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Split cleaned HTML or markdown into chunks of at most max_tokens"""
+    if content.lstrip().startswith("<"):
+        return split_html(content, max_tokens, overlap_tokens)
+    return split_lines(content, max_tokens, overlap_tokens)
+
+
+class ContentStats:
+    """Thread-safe totals of estimated tokens before and after cleaning pages"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.pages: DefaultDict[str, int] = defaultdict(int)
+        self.raw_tokens: DefaultDict[str, int] = defaultdict(int)
+        self.cleaned_tokens: DefaultDict[str, int] = defaultdict(int)
+
+    def record(self, content_format: str, raw: str, cleaned: str) -> None:
+        with self.lock:
+            self.pages[content_format] += 1
+            self.raw_tokens[content_format] += estimate_tokens(raw)
+            self.cleaned_tokens[content_format] += estimate_tokens(cleaned)
+
+    def log_stats(self) -> None:
+        logger = logging.getLogger(__name__)
+        with self.lock:
+            for content_format, pages in sorted(self.pages.items()):
+                raw = self.raw_tokens[content_format]
+                cleaned = self.cleaned_tokens[content_format]
+                logger.info(
+                    "Cleaned %d pages as %s: %d estimated tokens reduced to %d (%.0f%%)",
+                    pages,
+                    content_format,
+                    raw,
+                    cleaned,
+                    100 * cleaned / raw if raw else 0,
+                )
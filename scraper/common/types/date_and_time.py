@@ -1,10 +1,11 @@
 import datetime
 import logging
-from typing import Optional, Self
+from typing import Any, Dict, Optional, Self
 
 from pydantic import (
     ConfigDict,
     Field,
+    ValidationInfo,
     computed_field,
     model_serializer,
     model_validator,
@@ -12,6 +13,53 @@ from pydantic import (
 
 from .null_string_validator import NullStringValidator
 
+# Validation context for reading back models dumped with model_dump_json, e.g.
+# Model.model_validate_json(stored, context=SERIALIZED)
+SERIALIZED = {"serialized": True}
+
+
+def iso_components(value: str) -> Optional[Dict[str, Optional[int]]]:
+    """Split an ISO-8601 date, optionally with a time and UTC offset, into components
+
+    If the string cannot be parsed, return None.
+    """
+    value = value.strip()
+    try:
+        if "T" not in value and " " not in value:
+            day = datetime.date.fromisoformat(value)
+            return {
+                "year": day.year,
+                "month": day.month,
+                "day": day.day,
+                "hour": None,
+                "minute": None,
+                "second": None,
+                "utc_offset_hour": None,
+                "utc_offset_minute": None,
+            }
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+    utc_offset_hour = None
+    utc_offset_minute = None
+    offset = parsed.utcoffset()
+    if offset is not None:
+        minutes = int(offset.total_seconds()) // 60
+        sign = -1 if minutes < 0 else 1
+        utc_offset_hour = sign * (abs(minutes) // 60)
+        utc_offset_minute = sign * (abs(minutes) % 60)
+    return {
+        "year": parsed.year,
+        "month": parsed.month,
+        "day": parsed.day,
+        "hour": parsed.hour,
+        "minute": parsed.minute,
+        "second": parsed.second,
+        "utc_offset_hour": utc_offset_hour,
+        "utc_offset_minute": utc_offset_minute,
+    }
+
 
 class DateAndTime(NullStringValidator):
     model_config = ConfigDict(json_schema_extra={"additionalProperties": False})
@@ -41,6 +89,22 @@ class DateAndTime(NullStringValidator):
         description="Minute offset from UTC as an integer, if known. Otherwise null.",
     )
 
+    @model_validator(mode="before")
+    @classmethod
+    def parse_serialized(cls, data: Any, info: ValidationInfo) -> Any:
+        """Accept the ISO-8601 string or null which instances are serialized as
+
+        Only applies when validating with the SERIALIZED context, so model output
+        must still provide the components.
+        """
+        if not (info.context or {}).get("serialized"):
+            return data
+        if data is None:
+            return dict.fromkeys(cls.model_fields)
+        if isinstance(data, str):
+            return iso_components(data) or dict.fromkeys(cls.model_fields)
+        return data
+
     @model_validator(mode="after")
     def validate_date(self) -> Self:
         """Validate that date and time components form valid values.
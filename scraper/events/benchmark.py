@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from typing import List, Sequence, Tuple
+
+from scraper.common.api.mock import MockApi
+from scraper.events.event import EventList
+from scraper.events.pipeline import fetch_events
+
+
+def benchmark_workers(
+    worker_counts: Sequence[int],
+    num_sources: int,
+    latency: float,
+) -> List[Tuple[int, int, float]]:
+    """Run the pipeline against MockApi for each worker count
+
+    Return a list of (workers, events found, elapsed seconds).
+    """
+    api = MockApi[EventList](latency=latency)
+    sources = [f"https://source-{i}.example.com/events" for i in range(num_sources)]
+    results = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        event_count = sum(1 for _ in fetch_events(api, sources, workers))
+        elapsed = time.perf_counter() - start
+        results.append((workers, event_count, elapsed))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""
+            Measure how event pipeline throughput scales with the number of workers,
+            using a mock API with injected latency in place of real requests.
+        """,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+        help="Worker counts to benchmark.",
+    )
+    parser.add_argument(
+        "--sources",
+        type=int,
+        default=5,
+        help="Number of mock sources to scrape. Each yields 10 events.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Simulated latency of each API call, in seconds.",
+    )
+    args = parser.parse_args()
+
+    results = benchmark_workers(args.workers, args.sources, args.latency)
+    print(f"{'workers':>8s} {'events':>8s} {'seconds':>8s} {'events/s':>9s}")
+    for workers, event_count, elapsed in results:
+        print(
+            f"{workers:8d} {event_count:8d} {elapsed:8.2f} {event_count / elapsed:9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
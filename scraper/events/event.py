@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from pydantic import (
     BaseModel,
@@ -106,3 +106,30 @@ class EventList(BaseModel):
     model_config = ConfigDict(json_schema_extra={"additionalProperties": False})
 
     events: List[Event] = Field(description="A list of events")
+
+
+def merge_event_lists(event_lists: List[EventList]) -> EventList:
+    """Combine the events scraped from each chunk of a page
+
+    Chunks overlap, so the same event may appear more than once. Events with the same
+    title, start date and URL are merged into the first one found.
+    """
+    merged: Dict[Tuple[Any, ...], Event] = {}
+    untitled: List[Event] = []
+    for event_list in event_lists:
+        for event in event_list.events:
+            if not event.title:
+                untitled.append(event)
+                continue
+            key = (
+                " ".join(event.title.casefold().split()),
+                event.start.year,
+                event.start.month,
+                event.start.day,
+                event.url,
+            )
+            if key in merged:
+                merged[key].merge(event)
+            else:
+                merged[key] = event
+    return EventList(events=[*merged.values(), *untitled])
@@ -1,66 +1,402 @@
+import asyncio
 import logging
-from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterable, Sequence
+from typing import (
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+)
 
-from scraper.common.api.interface import Api
+from scraper.common.api.interface import (
+    Api,
+    ApiResponse,
+    AsyncApi,
+    BatchApi,
+    PageNotModified,
+    StagedApi,
+)
+from scraper.common.api.packing import PageBatcher
+from scraper.common.api.sitemap import SitemapDiscovery
+from scraper.common.api.timing import request_source
+from scraper.common.api.usage import UsageLedger
+from scraper.common.pipelines.stages import OUTPUT, Route, StagedRunner
+from scraper.common.text_processors.profiles import find_profile, SiteProfile
 from .event import Event, EventList
 from .parser import parse_full_response
 
+# Names of the pipeline stages. APIs which don't support separate stages do all their
+# work in the scrape stage instead of fetch, clean and extract.
+FETCH = "fetch"
+CLEAN = "clean"
+EXTRACT = "extract"
+SCRAPE = "scrape"
+EXPAND = "expand"
+
+Processor = Callable[["PageTask"], Iterable[Route]]
+
 
 def fetch_events(
     api: Api[EventList],
     sources: Sequence[str],
     workers: int,
+    discovery: Optional[SitemapDiscovery] = None,
+    fetch_workers: Optional[int] = None,
+    clean_workers: int = 1,
+    profiles: Optional[Mapping[str, SiteProfile]] = None,
+    detail_batcher: Optional[PageBatcher[EventList]] = None,
+    ledger: Optional[UsageLedger] = None,
 ) -> Iterable[Event]:
+    """Scrape events from each source, then fill in details from each event's page
+
+    Pages move through a series of stages connected by bounded queues:
+        fetch -> clean -> extract -> expand -> output
+    Each stage has its own pool of workers, so pages can be downloaded while others
+    are waiting on the API. The expand stage turns each listing page into tasks to
+    fetch the detail page of each event, and merges those details into the events.
+    Events are yielded as soon as their details have been fetched. If the API streams
+    the events on a listing page, each event is sent on from the extract stage as soon
+    as it has been generated, so its detail page can be fetched while the rest of the
+    listing is still being extracted.
+
+    workers is the number of pages which can be extracted at once. By default, the
+    same number of pages can be fetched at once. If the API doesn't implement
+    StagedApi, fetching and extraction happen together in workers scrape workers.
+
+    If discovery is given, each source's sitemaps are checked as well. Events whose
+    detail pages haven't changed since the last run are dropped, since they were
+    already found then.
+
+    Detail pages aren't fetched for sources whose site profile in profiles says they
+    have nothing to add.
+
+    If detail_batcher is given, detail pages are extracted through it, so that several
+    of them can share one request to the API.
+
+    If ledger is given, pages are only extracted while its budget allows. Events on
+    listing pages are still returned once their detail pages can't be extracted.
+    """
     logger = logging.getLogger(__name__)
-    logger.info(
-        "Fetching events from %d sources with %d parallel workers",
-        len(sources),
-        workers,
+    fetch_workers = fetch_workers or workers
+    pipeline = EventPipeline(api, discovery, profiles, detail_batcher, ledger)
+    # Allow each stage to get a little ahead of the next
+    runner = StagedRunner(queue_size=2 * max(workers, fetch_workers))
+    if isinstance(api, StagedApi):
+        logger.info(
+            "Fetching events from %d sources with %d fetch, %d clean and %d extract "
+            "workers",
+            len(sources),
+            fetch_workers,
+            clean_workers,
+            workers,
+        )
+        first_stage = FETCH
+        # Detail pages are fed back to the first stage, so its queue can't be bounded
+        runner.add_stage(
+            FETCH,
+            pipeline.tagged(pipeline.fetch),
+            fetch_workers,
+            bounded=False,
+        )
+        runner.add_stage(CLEAN, pipeline.tagged(pipeline.clean), clean_workers)
+        runner.add_stage(EXTRACT, pipeline.tagged(pipeline.extract), workers)
+    else:
+        logger.info(
+            "Fetching events from %d sources with %d parallel workers",
+            len(sources),
+            workers,
+        )
+        first_stage = SCRAPE
+        runner.add_stage(
+            SCRAPE,
+            pipeline.tagged(pipeline.scrape),
+            workers,
+            bounded=False,
+        )
+    runner.add_stage(EXPAND, pipeline.expand(first_stage), 1)
+
+    pipeline.start(sources)
+    yield from runner.run(
+        (first_stage, PageTask(source=source, url=source)) for source in sources
     )
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        futures: list[Future[Iterable[Event]]] = []
+
+
+@dataclass
+class PageTask:
+    """A listing page or event detail page moving through the pipeline"""
+
+    source: str
+    url: str
+    # The event whose details are on this page, or None for a listing page
+    event: Optional[Event] = None
+    content: Optional[str] = None
+    response: ApiResponse[EventList] = None
+    # Whether the page was skipped because it hasn't changed since the last run
+    skipped: bool = False
+
+
+class EventPipeline:
+    """The work done by each stage of the pipeline in fetch_events()
+
+    Each method takes a task and returns, or yields, where to send it, or any new
+    tasks, next.
+    """
+
+    def __init__(
+        self,
+        api: Api[EventList],
+        discovery: Optional[SitemapDiscovery],
+        profiles: Optional[Mapping[str, SiteProfile]] = None,
+        detail_batcher: Optional[PageBatcher[EventList]] = None,
+        ledger: Optional[UsageLedger] = None,
+    ) -> None:
+        self.api = api
+        self.discovery = discovery
+        self.profiles = profiles or {}
+        self.detail_batcher = detail_batcher
+        self.ledger = ledger
+        self.lock = threading.Lock()
+        # Number of pages per source which haven't been through the pipeline yet
+        self.outstanding: Counter[str] = Counter()
+        self.found: Counter[str] = Counter()
+
+    def start(self, sources: Iterable[str]) -> None:
         for source in sources:
-            fut = executor.submit(fetch_events_from_source, api, source)
-            futures.append(fut)
-        for fut in as_completed(futures):
-            for event in fut.result():
-                yield event
+            self.outstanding[source] += 1
+
+    def staged_api(self) -> StagedApi[EventList]:
+        assert isinstance(self.api, StagedApi)
+        return self.api
+
+    @staticmethod
+    def tagged(process: Processor) -> Processor:
+        """Attribute any requests made while processing a task to the task's source"""
+
+        def process_task(task: PageTask) -> Iterator[Route]:
+            with request_source(task.source):
+                yield from process(task)
+
+        return process_task
+
+    def should_skip(self, task: PageTask) -> bool:
+        """Check whether the detail page was already scraped during a previous run
+
+        The event from the listing page is still kept, since only fetching its details
+        again can be skipped. Also log what we're about to scrape.
+        """
+        logger = logging.getLogger(__name__)
+        if task.event is None:
+            if self.discovery:
+                self.discovery.discover(task.source)
+            logger.info("Scraping events from %s", task.source)
+            return False
+        if self.discovery and self.discovery.unchanged_since_last_run(task.url):
+            logger.info("Skipping unchanged event page: %s", task.url)
+            return True
+        logger.info("Fetching details for event: %s", task.url)
+        return False
+
+    def within_budget(self, task: PageTask) -> bool:
+        """Check whether the budget allows extracting the page"""
+        return self.ledger is None or self.ledger.allows(detail=task.event is not None)
+
+    def fetch(self, task: PageTask) -> List[Route]:
+        if self.should_skip(task):
+            return self.complete(task.source, task.event)
+        # Don't fetch pages there's no budget left to extract
+        if not self.within_budget(task):
+            return [(EXPAND, task)]
+        try:
+            task.content = self.staged_api().fetch(
+                task.url,
+                if_modified=task.event is None,
+            )
+        except PageNotModified as unmodified:
+            return self.unmodified(task, unmodified)
+        if task.content is None:
+            return [(EXPAND, task)]
+        return [(CLEAN, task)]
+
+    def unmodified(self, task: PageTask, unmodified: PageNotModified) -> List[Route]:
+        """Send on the events saved for a listing page which hasn't changed"""
+        logger = logging.getLogger(__name__)
+        if not isinstance(unmodified.response, EventList):
+            logger.info("Skipping %s since it hasn't changed", task.url)
+            return self.complete(task.source, None)
+        logger.info("Reusing events from unchanged page: %s", task.url)
+        task.response = unmodified.response
+        return [(EXPAND, task)]
+
+    def finish_extraction(self, task: PageTask) -> None:
+        """Let a listing page be skipped next time if it's unchanged and was extracted
+
+        If nothing was extracted, it's scraped again next time.
+        """
+        if task.event is not None:
+            return
+        api = self.staged_api()
+        if task.response is None:
+            api.forget(task.url)
+        else:
+            api.remember(task.url, task.response)
+
+    def clean(self, task: PageTask) -> List[Route]:
+        assert task.content is not None
+        api = self.staged_api()
+        # Skip the model entirely if the page has machine-readable events
+        task.response = api.extract_structured(task.url, task.content)
+        if task.response is not None:
+            task.content = None
+            self.finish_extraction(task)
+            return [(EXPAND, task)]
+        task.content = api.clean(task.url, task.content)
+        if not task.content:
+            self.finish_extraction(task)
+            return [(EXPAND, task)]
+        return [(EXTRACT, task)]
+
+    def extract(self, task: PageTask) -> Iterator[Route]:
+        logger = logging.getLogger(__name__)
+        assert task.content is not None
+        api = self.staged_api()
+        streamed = False
+        if not self.within_budget(task):
+            logger.info("Not extracting %s, since the budget has run low", task.url)
+        elif task.event is not None and self.detail_batcher is not None:
+            task.response = self.detail_batcher.extract(task.url, task.content)
+        elif task.event is not None:
+            task.response = api.extract(task.url, task.content)
+        else:
+            streamed = yield from self.extract_listing(task)
+        # The content is no longer needed, so don't hold on to it
+        task.content = None
+        self.finish_extraction(task)
+        if streamed:
+            # Its events have already been sent on
+            yield from self.complete(task.source, None)
+        else:
+            yield (EXPAND, task)
+
+    def extract_listing(self, task: PageTask) -> Generator[Route, None, bool]:
+        """Extract a listing page, sending on each event as soon as it's streamed
+
+        Returns whether any events were streamed. If not, they're sent on by the
+        expand stage once the whole response is available.
+        """
+        logger = logging.getLogger(__name__)
+        assert task.content is not None
+        stream = self.staged_api().extract_stream(task.url, task.content)
+        scrape_datetime = datetime.now().astimezone(tz=None)
+        streamed = False
+        while True:
+            try:
+                item = next(stream)
+            except StopIteration as stop:
+                task.response = stop.value
+                return streamed
+            try:
+                event = Event.model_validate(item)
+            except ValueError as error:
+                logger.warning("Ignoring invalid event from %s: %r", task.url, error)
+                continue
+            streamed = True
+            for parsed in parse_full_response(
+                EventList(events=[event]), task.source, scrape_datetime
+            ):
+                logger.debug("Event: %r", parsed)
+                yield from self.expand_event(task.source, parsed, FETCH)
+
+    def scrape(self, task: PageTask) -> List[Route]:
+        """Fetch and extract in one step, for APIs which don't support StagedApi"""
+        if self.should_skip(task):
+            return self.complete(task.source, task.event)
+        if not self.within_budget(task):
+            return [(EXPAND, task)]
+        if task.event is not None:
+            task.response = self.api.scrape(task.url)
+            return [(EXPAND, task)]
+        try:
+            task.response = self.api.scrape_if_modified(task.url)
+        except PageNotModified as unmodified:
+            return self.unmodified(task, unmodified)
+        return [(EXPAND, task)]
+
+    def expand(self, first_stage: str) -> Processor:
+        """Create the expand stage, which sends detail pages back to first_stage"""
+
+        def expand(task: PageTask) -> List[Route]:
+            if task.event is not None:
+                event = merge_event_details(task.event, task.response)
+                return self.complete(task.source, event)
 
+            routes: List[Route] = []
+            for event in parse_listing(task.source, task.response):
+                routes.extend(self.expand_event(task.source, event, first_stage))
+            routes.extend(self.complete(task.source, None))
+            return routes
 
-def fetch_events_from_source(api: Api[EventList], source: str) -> Iterable[Event]:
+        return expand
+
+    def expand_event(self, source: str, event: Event, first_stage: str) -> List[Route]:
+        """Send an event from a listing page on to have its detail page fetched"""
+        with self.lock:
+            self.outstanding[source] += 1
+        if event.url and should_fetch_details(self.profiles, source):
+            return [(first_stage, PageTask(source=source, url=event.url, event=event))]
+        return self.complete(source, event)
+
+    def complete(self, source: str, event: Optional[Event]) -> List[Route]:
+        """Finish with a page, sending the event it produced, if any, to the output"""
+        logger = logging.getLogger(__name__)
+        routes: List[Route] = []
+        if event is not None:
+            if event.title:
+                routes.append((OUTPUT, event))
+            else:
+                logger.debug("Dropping event due to missing title")
+        with self.lock:
+            if routes:
+                self.found[source] += 1
+            self.outstanding[source] -= 1
+            if self.outstanding[source] == 0:
+                logger.info("Found %d events from %s", self.found[source], source)
+        return routes
+
+
+def should_fetch_details(profiles: Mapping[str, SiteProfile], source: str) -> bool:
+    profile = find_profile(profiles, source)
+    return profile is None or profile.fetch_details
+
+
+def parse_listing(source: str, response: ApiResponse[EventList]) -> List[Event]:
     logger = logging.getLogger(__name__)
-    logger.info("Scraping events from %s", source)
-    response = api.scrape(source)
     if not response:
         logger.info("No response from %s", source)
-        return
-    event_count = 0
-    for event in parse_full_response(
-        response=response,
-        scrape_source=source,
-        scrape_datetime=datetime.now().astimezone(tz=None),
-    ):
+        return []
+    events = list(
+        parse_full_response(
+            response=response,
+            scrape_source=source,
+            scrape_datetime=datetime.now().astimezone(tz=None),
+        )
+    )
+    for event in events:
         logger.debug("Event: %r", event)
-        event = fetch_event_details(api, event)
-        if event.title:
-            event_count += 1
-            yield event
-        else:
-            logging.debug("Dropping event due to missing title")
-    logger.info("Found %d events from %s", event_count, source)
+    return events
 
 
-def fetch_event_details(api: Api[EventList], event: Event) -> Event:
-    """Try to fill in additional details by scraping the event's own page"""
+def merge_event_details(event: Event, response: ApiResponse[EventList]) -> Event:
+    """Combine an event with the details scraped from its own page"""
     logger = logging.getLogger(__name__)
-
-    if not event.url:
-        return event
-
-    logger.info("Fetching details for event: %s", event.url)
-    response = api.scrape(event.url)
     if not response:
         return event
 
@@ -81,3 +417,168 @@ def fetch_event_details(api: Api[EventList], event: Event) -> Event:
         break
 
     return event
+
+
+async def fetch_events_async(
+    api: AsyncApi[EventList],
+    sources: Sequence[str],
+    concurrency: int,
+    discovery: Optional[SitemapDiscovery] = None,
+    profiles: Optional[Mapping[str, SiteProfile]] = None,
+    ledger: Optional[UsageLedger] = None,
+) -> List[Event]:
+    """Asynchronous counterpart to fetch_events()
+
+    At most concurrency pages are scraped at once, across listing and detail pages.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(
+        "Fetching events from %d sources with up to %d concurrent scrapes",
+        len(sources),
+        concurrency,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scrape_source(source: str) -> List[Event]:
+        # Detail pages are scraped in tasks created here, which inherit the source
+        with request_source(source):
+            return await scrape_listing(source)
+
+    async def scrape_listing(source: str) -> List[Event]:
+        if discovery:
+            await asyncio.to_thread(discovery.discover, source)
+        logger.info("Scraping events from %s", source)
+        if ledger and not ledger.allows(detail=False):
+            return []
+        try:
+            async with semaphore:
+                response = await api.scrape_if_modified(source)
+        except PageNotModified as unmodified:
+            if not isinstance(unmodified.response, EventList):
+                logger.info("Skipping %s since it hasn't changed", source)
+                return []
+            logger.info("Reusing events from unchanged page: %s", source)
+            response = unmodified.response
+        listing = parse_listing(source, response)
+        if not should_fetch_details(profiles or {}, source):
+            logger.info("Not fetching details for events from %s", source)
+            events = listing
+        else:
+            events = await asyncio.gather(*(scrape_details(event) for event in listing))
+        titled = [event for event in events if event.title]
+        logger.info("Found %d events from %s", len(titled), source)
+        return titled
+
+    async def scrape_details(event: Event) -> Event:
+        if not event.url:
+            return event
+        if discovery and discovery.unchanged_since_last_run(event.url):
+            logger.info("Skipping unchanged event page: %s", event.url)
+            return event
+        if ledger and not ledger.allows(detail=True):
+            return event
+        logger.info("Fetching details for event: %s", event.url)
+        async with semaphore:
+            response = await api.scrape(event.url)
+        return merge_event_details(event, response)
+
+    results = await asyncio.gather(*(scrape_source(source) for source in sources))
+    return [event for events in results for event in events]
+
+
+def fetch_events_batch(
+    api: StagedApi[EventList],
+    batch_api: BatchApi[EventList],
+    sources: Sequence[str],
+    workers: int,
+    discovery: Optional[SitemapDiscovery] = None,
+    profiles: Optional[Mapping[str, SiteProfile]] = None,
+) -> List[Event]:
+    """Counterpart to fetch_events() which extracts events in batches
+
+    Every listing page is fetched and cleaned by api, using workers threads, then
+    events are extracted from all of them in one batch. The same is then done for the
+    detail page of each event. This takes much longer than fetch_events(), but batches
+    can be cheaper, as with OpenAI's Batch API.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(
+        "Fetching events from %d sources in batches, with %d fetch workers",
+        len(sources),
+        workers,
+    )
+    pipeline = EventPipeline(api, discovery, profiles)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+
+    def prepare(task: PageTask) -> PageTask:
+        """Fetch and clean a page, skipping extraction where possible"""
+        with request_source(task.source):
+            if pipeline.should_skip(task):
+                task.skipped = True
+                return task
+            try:
+                task.content = api.fetch(task.url, if_modified=task.event is None)
+            except PageNotModified as unmodified:
+                if isinstance(unmodified.response, EventList):
+                    logger.info("Reusing events from unchanged page: %s", task.url)
+                    task.response = unmodified.response
+                else:
+                    logger.info("Skipping %s since it hasn't changed", task.url)
+                task.skipped = True
+                return task
+            if task.content is None:
+                return task
+            task.response = api.extract_structured(task.url, task.content)
+            if task.response is not None:
+                task.content = None
+                pipeline.finish_extraction(task)
+                return task
+            task.content = api.clean(task.url, task.content)
+            if not task.content:
+                pipeline.finish_extraction(task)
+            return task
+
+    def extract(tasks: List[PageTask]) -> None:
+        """Extract the events from every page which still needs it in one batch"""
+        pending = [task for task in tasks if task.content]
+        pages = {task.url: task.content for task in pending if task.content}
+        logger.info("Extracting events from %d pages in a batch", len(pages))
+        responses = batch_api.extract_batch(pages) if pages else {}
+        for task in pending:
+            assert task.content is not None
+            task.response = responses.get(task.url)
+            pipeline.finish_extraction(task)
+            task.content = None
+
+    with executor:
+        listings = list(
+            executor.map(
+                prepare, (PageTask(source=source, url=source) for source in sources)
+            )
+        )
+        extract(listings)
+
+        events: List[Event] = []
+        details: List[PageTask] = []
+        for listing in listings:
+            fetch_details = should_fetch_details(pipeline.profiles, listing.source)
+            for event in parse_listing(listing.source, listing.response):
+                if event.url and fetch_details:
+                    details.append(
+                        PageTask(source=listing.source, url=event.url, event=event)
+                    )
+                else:
+                    events.append(event)
+        details = list(executor.map(prepare, details))
+        extract(details)
+
+    for detail in details:
+        assert detail.event is not None
+        # The detail page hasn't changed, so keep the event as listed
+        if detail.skipped:
+            events.append(detail.event)
+            continue
+        events.append(merge_event_details(detail.event, detail.response))
+    titled = [event for event in events if event.title]
+    logger.info("Found %d events from %d sources", len(titled), len(sources))
+    return titled
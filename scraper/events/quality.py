@@ -0,0 +1,20 @@
+from typing import Optional
+
+from scraper.common.parsers.date_and_time import contains_date
+from .event import EventList
+
+
+def check_event_list(content: str, response: EventList) -> Optional[str]:
+    """Find a reason to doubt the events extracted from a page
+
+    Returns None if they look plausible.
+    """
+    if not response.events:
+        if contains_date(content):
+            return "no events on a page with dates"
+        return None
+    if any(not event.title for event in response.events):
+        return "events missing titles"
+    if any(event.start.date is None for event in response.events):
+        return "events missing dates"
+    return None
@@ -1,3 +1,7 @@
+from typing import Dict
+
+from scraper.common.text_processors.profiles import SiteProfile
+
 EVENT_SOURCES = (
     "https://aisafety.com/events-and-training",
     "https://amii.ca/events/",
@@ -25,3 +29,19 @@ EVENT_SOURCES = (
     "https://meetup.com/montreal-ai-governance-ethics-safety/",
     "https://meetup.com/coalition-pour-lia-responsable-quebec/",
 )
+
+# How to find the events on the pages of particular sites, by host without www.
+# Selectors which stop matching fall back to the whole page, so they're safe to
+# leave in place when a site is redesigned, but should then be updated.
+SITE_PROFILES: Dict[str, SiteProfile] = {
+    # Meetup pages are mostly navigation, recommendations and sign-up prompts
+    "meetup.com": SiteProfile(
+        keep=("main",),
+        drop=("nav", "aside", "[role=dialog]", "[data-testid=recommendations]"),
+    ),
+    # The listing is a Drupal view inside a page with several menus
+    "uottawa.ca": SiteProfile(
+        keep=(".view-content", "main"),
+        drop=("nav", "aside", ".breadcrumb"),
+    ),
+}
@@ -0,0 +1,177 @@
+import logging
+import re
+from typing import Any, Dict, Optional, Tuple
+
+from scraper.common.parsers.date_and_time import parse_iso_date_and_time
+from scraper.common.parsers.structured_data import (
+    extract_structured_data,
+    schema_types,
+)
+from scraper.common.types.date_and_time import DateAndTime
+from .event import Event, EventList, merge_event_lists
+
+ONLINE = "online"
+# Event descriptions should be one to three sentences
+MAX_DESCRIPTION_SENTENCES = 3
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Values of schema.org eventAttendanceMode, by whether attendees can join virtually
+ATTENDANCE_MODES = {
+    "OfflineEventAttendanceMode": False,
+    "OnlineEventAttendanceMode": True,
+    "MixedEventAttendanceMode": True,
+}
+# Expand the codes commonly used for addressCountry to the names we use elsewhere
+COUNTRY_NAMES = {
+    "CA": "Canada",
+    "CAN": "Canada",
+    "US": "United States",
+    "USA": "United States",
+    "GB": "United Kingdom",
+    "UK": "United Kingdom",
+    "FR": "France",
+}
+PROVINCE_NAMES = {
+    "AB": "Alberta",
+    "BC": "British Columbia",
+    "MB": "Manitoba",
+    "NB": "New Brunswick",
+    "NL": "Newfoundland and Labrador",
+    "NS": "Nova Scotia",
+    "NT": "Northwest Territories",
+    "NU": "Nunavut",
+    "ON": "Ontario",
+    "PE": "Prince Edward Island",
+    "QC": "Quebec",
+    "SK": "Saskatchewan",
+    "YT": "Yukon",
+}
+
+
+def text(value: Any) -> Optional[str]:
+    """Get a string from a property which may be a list or a nested item"""
+    if isinstance(value, list):
+        return text(value[0]) if value else None
+    if isinstance(value, dict):
+        return text(value.get("name") or value.get("@id"))
+    if isinstance(value, str):
+        return " ".join(value.split()) or None
+    return None
+
+
+def first_item(value: Any) -> Optional[Dict[str, Any]]:
+    if isinstance(value, list):
+        items = [item for item in value if isinstance(item, dict)]
+        return items[0] if items else None
+    return value if isinstance(value, dict) else None
+
+
+def parse_date(value: Any) -> DateAndTime:
+    parsed = parse_iso_date_and_time(text(value) or "")
+    if parsed is None:
+        return DateAndTime(
+            year=None,
+            month=None,
+            day=None,
+            hour=None,
+            minute=None,
+            second=None,
+            utc_offset_hour=None,
+            utc_offset_minute=None,
+        )
+    return parsed
+
+
+def parse_description(value: Any) -> Optional[str]:
+    description = text(value)
+    if description is None:
+        return None
+    sentences = SENTENCE_END.split(description)
+    return " ".join(sentences[:MAX_DESCRIPTION_SENTENCES])
+
+
+def parse_virtual(item: Dict[str, Any]) -> Optional[bool]:
+    mode = text(item.get("eventAttendanceMode"))
+    if mode:
+        return ATTENDANCE_MODES.get(mode.rstrip("/").rsplit("/", 1)[-1])
+    location = first_item(item.get("location"))
+    if location and "VirtualLocation" in schema_types(location):
+        return True
+    return None
+
+
+def parse_location(
+    item: Dict[str, Any],
+    virtual: Optional[bool],
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Return the country, region and city of the event"""
+    location = first_item(item.get("location"))
+    place = (
+        location
+        if location and "VirtualLocation" not in schema_types(location)
+        else None
+    )
+    address = first_item(place.get("address")) if place else None
+    if address is None:
+        if virtual and not place:
+            return ONLINE, ONLINE, ONLINE
+        return None, None, None
+    country = text(address.get("addressCountry"))
+    region = text(address.get("addressRegion"))
+    return (
+        COUNTRY_NAMES.get(country or "", country),
+        PROVINCE_NAMES.get(region or "", region),
+        text(address.get("addressLocality")),
+    )
+
+
+def parse_event(item: Dict[str, Any]) -> Optional[Event]:
+    logger = logging.getLogger(__name__)
+    virtual = parse_virtual(item)
+    country, region, city = parse_location(item, virtual)
+    try:
+        return Event(
+            title=text(item.get("name")),
+            start=parse_date(item.get("startDate")),
+            end=parse_date(item.get("endDate")),
+            description=parse_description(item.get("description")),
+            url=text(item.get("url")),
+            virtual=virtual,
+            location_country=country,
+            location_region=region,
+            location_city=city,
+        )
+    except (TypeError, ValueError) as error:
+        logger.debug("Failed to create event from structured data: %r", error)
+        return None
+
+
+def is_event(item: Dict[str, Any]) -> bool:
+    # Includes subtypes such as EducationEvent and BusinessEvent
+    return any(schema_type.endswith("Event") for schema_type in schema_types(item))
+
+
+def is_complete(event: Event) -> bool:
+    return bool(event.title) and event.start.date is not None
+
+
+def parse_structured_events(url: str, content: str) -> Optional[EventList]:
+    """Extract events from schema.org JSON-LD or microdata embedded in a page
+
+    If the page has no events, or any of them is missing a title or start date, return
+    None so that the page is read by the model instead.
+    """
+    logger = logging.getLogger(__name__)
+    items = [item for item in extract_structured_data(content, url) if is_event(item)]
+    if not items:
+        return None
+    events = [parse_event(item) for item in items]
+    complete = [event for event in events if event is not None and is_complete(event)]
+    if len(complete) < len(events):
+        logger.debug("Structured data for %s has incomplete events", url)
+        return None
+    # Pages may describe the same event in both JSON-LD and microdata
+    event_list = merge_event_lists([EventList(events=complete)])
+    logger.info(
+        "Found %d events in structured data for %s", len(event_list.events), url
+    )
+    return event_list
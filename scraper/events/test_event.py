@@ -6,8 +6,8 @@ from datetime import datetime, date, time, timezone
 from pathlib import Path
 from typing import Any, Dict, Optional
 
-from .event import Approved, Event
-from scraper.common.types.date_and_time import DateAndTime
+from .event import Approved, Event, EventList, merge_event_lists
+from scraper.common.types.date_and_time import DateAndTime, SERIALIZED
 from scraper.common.writers.csv import write_to_csv
 from scraper.common.writers.jsonl import write_to_jsonl
 
@@ -142,6 +142,29 @@ class TestEvent(unittest.TestCase):
         self.assertIsNone(event.scrape_source)
         self.assertIsNone(event.scrape_datetime)
 
+    def test_json_round_trip(self) -> None:
+        unknown_end = DateAndTime(
+            year=None,
+            month=None,
+            day=None,
+            hour=None,
+            minute=None,
+            second=None,
+            utc_offset_hour=None,
+            utc_offset_minute=None,
+        )
+        event_list = EventList(
+            events=[
+                TestEvent.create_example_event(),
+                TestEvent.create_example_event(end=unknown_end),
+            ]
+        )
+        serialized = event_list.model_dump_json()
+        parsed = EventList.model_validate_json(serialized, context=SERIALIZED)
+        self.assertEqual(parsed, event_list)
+        with self.assertRaises(ValueError):
+            EventList.model_validate_json(serialized)
+
     def test_null_string(self) -> None:
         event_json = """
         {
@@ -401,5 +424,25 @@ class TestEvent(unittest.TestCase):
             self.assertTrue(prop.get("description"))
 
 
+class TestMergeEventLists(unittest.TestCase):
+    def test_deduplicate_overlap(self) -> None:
+        first = TestEvent.create_example_event(description=None)
+        duplicate = TestEvent.create_example_event(title=" sample  EVENT ")
+        other = TestEvent.create_example_event(title="Other Event")
+        untitled = TestEvent.create_example_event(title=None)
+        merged = merge_event_lists(
+            [
+                EventList(events=[first, untitled]),
+                EventList(events=[duplicate, other]),
+            ]
+        )
+        self.assertEqual(
+            [event.title for event in merged.events],
+            ["Sample Event", "Other Event", None],
+        )
+        # Missing fields are filled in from the duplicate
+        self.assertEqual(merged.events[0].description, "A sample event for testing.")
+
+
 if __name__ == "__main__":
     unittest.main()
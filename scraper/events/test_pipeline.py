@@ -0,0 +1,445 @@
+import asyncio
+import datetime
+import threading
+import time
+import unittest
+from typing import Any, Dict, Generator, Mapping, Optional
+
+from scraper.common.api import http
+from scraper.common.api.interface import (
+    Api,
+    ApiResponse,
+    BatchApi,
+    PageNotModified,
+    ThreadedAsyncApi,
+)
+from scraper.common.api.mock import MockApi, MockStagedApi
+from scraper.common.api.packing import PageBatcher
+from scraper.common.api.politeness import HostScheduler
+from scraper.common.api.sitemap import SitemapDiscovery
+from scraper.common.api.usage import UsageLedger
+from scraper.common.text_processors.profiles import SiteProfile
+from scraper.common.types.date_and_time import DateAndTime
+from .event import Event, EventList
+from .pipeline import fetch_events, fetch_events_async, fetch_events_batch
+from .structured_data import parse_date
+
+
+class ConcurrencyTrackingApi(MockApi[EventList]):
+    """Mock API which records how many scrape calls were in flight at once"""
+
+    def __init__(self, latency: float) -> None:
+        super().__init__(latency=latency)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.urls: list[str] = []
+
+    def scrape(self, url: str) -> ApiResponse[EventList]:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.urls.append(url)
+        try:
+            return super().scrape(url)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class ListingOnlyApi(Api[EventList]):
+    """Mock API which only returns events for the listing page"""
+
+    def __init__(self, listing_url: str) -> None:
+        self.listing_url = listing_url
+        self.mock = MockApi[EventList]()
+
+    def scrape(self, url: str) -> ApiResponse[EventList]:
+        if url == self.listing_url:
+            return self.mock.scrape(url)
+        return None
+
+
+SOURCES = [f"https://source-{i}.example.com/events" for i in range(3)]
+
+
+class TestFetchEvents(unittest.TestCase):
+    def test_all_events_returned(self) -> None:
+        events = list(fetch_events(MockApi[EventList](), SOURCES, workers=4))
+        # MockApi returns 10 events per listing page
+        self.assertEqual(len(events), 30)
+        self.assertTrue(all(event.title for event in events))
+        self.assertEqual(
+            {event.scrape_source for event in events},
+            set(SOURCES),
+        )
+
+    def test_details_fetched_for_each_event(self) -> None:
+        api = ConcurrencyTrackingApi(latency=0)
+        list(fetch_events(api, SOURCES, workers=4))
+        # One listing page per source plus one detail page per event
+        self.assertEqual(len(api.urls), 3 + 30)
+
+    def test_scrapes_run_in_parallel(self) -> None:
+        api = ConcurrencyTrackingApi(latency=0.01)
+        list(fetch_events(api, SOURCES, workers=8))
+        self.assertGreater(api.max_in_flight, 1)
+        self.assertLessEqual(api.max_in_flight, 8)
+
+    def test_single_worker_runs_serially(self) -> None:
+        api = ConcurrencyTrackingApi(latency=0.001)
+        list(fetch_events(api, SOURCES, workers=1))
+        self.assertEqual(api.max_in_flight, 1)
+
+    def test_more_workers_is_faster(self) -> None:
+        api = MockApi[EventList](latency=0.01)
+        start = time.perf_counter()
+        list(fetch_events(api, SOURCES[:1], workers=1))
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        list(fetch_events(api, SOURCES[:1], workers=10))
+        parallel = time.perf_counter() - start
+        self.assertLess(parallel, serial)
+
+    def test_profile_skips_details(self) -> None:
+        api = ConcurrencyTrackingApi(latency=0)
+        profiles = {"source-0.example.com": SiteProfile(fetch_details=False)}
+        events = list(fetch_events(api, SOURCES, workers=4, profiles=profiles))
+        self.assertEqual(len(events), 30)
+        self.assertEqual(len(api.urls), 3 + 20)
+
+    def test_missing_details_keep_listing_event(self) -> None:
+        api = ListingOnlyApi(SOURCES[0])
+        events = list(fetch_events(api, SOURCES[:1], workers=2))
+        self.assertEqual(len(events), 10)
+
+
+class StageTrackingApi(MockStagedApi[EventList]):
+    """Mock staged API which records how many pages were in each stage at once"""
+
+    def __init__(self, latency: float) -> None:
+        super().__init__(fetch_latency=latency, extract_latency=latency)
+        self.lock = threading.Lock()
+        self.fetching = 0
+        self.extracting = 0
+        self.max_fetching = 0
+        self.max_extracting = 0
+        self.overlapped = False
+
+    def fetch(self, url: str, if_modified: bool = False) -> Optional[str]:
+        with self.lock:
+            self.fetching += 1
+            self.max_fetching = max(self.max_fetching, self.fetching)
+            self.overlapped = self.overlapped or self.extracting > 0
+        try:
+            return super().fetch(url, if_modified)
+        finally:
+            with self.lock:
+                self.fetching -= 1
+
+    def extract(self, url: str, content: str) -> ApiResponse[EventList]:
+        with self.lock:
+            self.extracting += 1
+            self.max_extracting = max(self.max_extracting, self.extracting)
+        try:
+            return super().extract(url, content)
+        finally:
+            with self.lock:
+                self.extracting -= 1
+
+
+class TestStagedFetchEvents(unittest.TestCase):
+    def test_all_events_returned(self) -> None:
+        api = MockStagedApi[EventList]()
+        events = list(fetch_events(api, SOURCES, workers=2, fetch_workers=4))
+        self.assertEqual(len(events), 30)
+
+    def test_stage_worker_limits(self) -> None:
+        api = StageTrackingApi(latency=0.005)
+        list(fetch_events(api, SOURCES, workers=2, fetch_workers=5))
+        self.assertLessEqual(api.max_extracting, 2)
+        self.assertLessEqual(api.max_fetching, 5)
+        self.assertGreater(api.max_fetching, 2)
+        # Pages should be fetched while others are being extracted
+        self.assertTrue(api.overlapped)
+
+    def test_structured_data_skips_model(self) -> None:
+        api = StructuredDataApi()
+        events = list(fetch_events(api, SOURCES, workers=2))
+        self.assertEqual(len(events), 3)
+        self.assertEqual(api.extracted, 0)
+
+
+class StructuredDataApi(MockStagedApi[EventList]):
+    """Mock staged API whose listing pages have complete structured data"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.extracted = 0
+
+    def extract_structured(self, url: str, content: str) -> ApiResponse[EventList]:
+        return EventList(
+            events=[
+                Event(
+                    title="Structured",
+                    start=parse_date("2025-03-01"),
+                    end=parse_date("2025-03-01"),
+                    description=None,
+                    url=None,
+                    virtual=None,
+                    location_country=None,
+                    location_region=None,
+                    location_city=None,
+                )
+            ]
+        )
+
+    def extract(self, url: str, content: str) -> ApiResponse[EventList]:
+        self.extracted += 1
+        return super().extract(url, content)
+
+
+class EventListApi(MockStagedApi[EventList]):
+    """Mock staged API which lists two events on each listing page"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.extracted = 0
+
+    def extract(self, url: str, content: str) -> ApiResponse[EventList]:
+        self.extracted += 1
+        titles = [url] if "/detail-" in url else ["first", "second"]
+        return EventList(
+            events=[
+                Event(
+                    title=title,
+                    start=parse_date("2025-03-01T19:00:00-05:00"),
+                    end=parse_date(None),
+                    description=None,
+                    url=f"{url}/detail-{title}",
+                    virtual=None,
+                    location_country=None,
+                    location_region=None,
+                    location_city=None,
+                )
+                for title in titles
+            ]
+        )
+
+
+class FakeBatchApi(BatchApi[EventList]):
+    """Batch API which extracts each page with a staged API, recording batch sizes"""
+
+    def __init__(self, api: EventListApi) -> None:
+        self.api = api
+        self.batches: list[int] = []
+
+    def extract_batch(
+        self, pages: Mapping[str, str]
+    ) -> Dict[str, ApiResponse[EventList]]:
+        self.batches.append(len(pages))
+        return {url: self.api.extract(url, content) for url, content in pages.items()}
+
+
+class TestFetchEventsBatch(unittest.TestCase):
+    def test_listings_then_details(self) -> None:
+        api = EventListApi()
+        batch_api = FakeBatchApi(api)
+        events = fetch_events_batch(api, batch_api, SOURCES, workers=2)
+        # One batch of listing pages, then one of the two detail pages for each
+        self.assertEqual(batch_api.batches, [3, 6])
+        self.assertEqual(len(events), 6)
+        self.assertTrue(all(event.scrape_source in SOURCES for event in events))
+        # Titles come from the detail pages
+        self.assertTrue(all("/detail-" in (event.title or "") for event in events))
+
+    def test_profile_skips_details(self) -> None:
+        api = EventListApi()
+        batch_api = FakeBatchApi(api)
+        profiles = {"source-0.example.com": SiteProfile(fetch_details=False)}
+        events = fetch_events_batch(
+            api, batch_api, SOURCES, workers=2, profiles=profiles
+        )
+        self.assertEqual(batch_api.batches, [3, 4])
+        self.assertEqual(len(events), 6)
+
+
+class TestDetailBatcher(unittest.TestCase):
+    def test_detail_pages_packed(self) -> None:
+        api = EventListApi()
+        batch_api = FakeBatchApi(api)
+        batcher = PageBatcher(batch_api, max_pages=2, max_wait=0.1)
+        events = list(fetch_events(api, SOURCES, workers=2, detail_batcher=batcher))
+        self.assertEqual(len(events), 6)
+        self.assertTrue(all("/detail-" in (event.title or "") for event in events))
+        # Only detail pages go through the batcher
+        self.assertEqual(sum(batch_api.batches), 6)
+        self.assertGreater(max(batch_api.batches), 1)
+
+
+class StreamingEventListApi(EventListApi):
+    """Mock staged API which streams the events on each listing page
+
+    After the first event, the stream waits for a detail page to be fetched.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.detail_fetched = threading.Event()
+        self.overlapped = False
+
+    def fetch(self, url: str, if_modified: bool = False) -> Optional[str]:
+        if "/detail-" in url:
+            self.detail_fetched.set()
+        return super().fetch(url, if_modified)
+
+    def extract_stream(
+        self, url: str, content: str
+    ) -> Generator[Dict[str, Any], None, ApiResponse[EventList]]:
+        response = self.extract(url, content)
+        assert isinstance(response, EventList)
+        for event in response.events:
+            # The model outputs dates as components, not as they're serialized
+            item = event.model_dump(mode="json")
+            for name, value in event:
+                if isinstance(value, DateAndTime):
+                    item[name] = dict(value)
+            yield item
+            self.overlapped = self.overlapped or self.detail_fetched.wait(timeout=5)
+        return response
+
+
+class TestStreamedListings(unittest.TestCase):
+    def test_details_fetched_while_streaming(self) -> None:
+        api = StreamingEventListApi()
+        events = list(fetch_events(api, SOURCES[:1], workers=1))
+        self.assertTrue(api.overlapped)
+        self.assertEqual(len(events), 2)
+        self.assertTrue(all("/detail-" in (event.title or "") for event in events))
+        self.assertEqual({event.scrape_source for event in events}, {SOURCES[0]})
+
+    def test_all_events_returned(self) -> None:
+        api = StreamingEventListApi()
+        events = list(fetch_events(api, SOURCES, workers=2))
+        self.assertEqual(len(events), 6)
+        self.assertEqual(api.extracted, 9)
+
+
+class RememberingApi(EventListApi):
+    """Mock staged API which reports listing pages as unchanged once remembered"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.saved: Dict[str, ApiResponse[EventList]] = {}
+
+    def fetch(self, url: str, if_modified: bool = False) -> Optional[str]:
+        if if_modified and url in self.saved:
+            raise PageNotModified(url, self.saved[url])
+        return super().fetch(url, if_modified)
+
+    def remember(self, url: str, response: ApiResponse[EventList]) -> None:
+        self.saved[url] = response
+
+
+class TestUnchangedListings(unittest.TestCase):
+    def test_events_reused(self) -> None:
+        api = RememberingApi()
+        first = list(fetch_events(api, SOURCES, workers=2))
+        self.assertEqual(set(api.saved), set(SOURCES))
+        extracted = api.extracted
+        second = list(fetch_events(api, SOURCES, workers=2))
+        self.assertEqual(len(second), len(first))
+        # Only the detail pages are extracted again
+        self.assertEqual(api.extracted - extracted, 6)
+
+    def test_events_reused_batch(self) -> None:
+        api = RememberingApi()
+        batch_api = FakeBatchApi(api)
+        fetch_events_batch(api, batch_api, SOURCES, workers=2)
+        self.assertEqual(set(api.saved), set(SOURCES))
+        events = fetch_events_batch(api, batch_api, SOURCES, workers=2)
+        self.assertEqual(batch_api.batches, [3, 6, 6])
+        self.assertEqual(len(events), 6)
+
+
+class TestBudget(unittest.TestCase):
+    def test_details_skipped_when_budget_low(self) -> None:
+        api = EventListApi()
+        ledger = UsageLedger(max_tokens=1000)
+        ledger.total.prompt_tokens = 950
+        with self.assertLogs(level="WARNING"):
+            events = list(fetch_events(api, SOURCES, workers=2, ledger=ledger))
+        # Only the listing pages were extracted, but their events are kept
+        self.assertEqual(api.extracted, 3)
+        self.assertEqual(len(events), 6)
+        self.assertFalse(any("/detail-" in (event.title or "") for event in events))
+
+    def test_nothing_extracted_when_budget_spent(self) -> None:
+        api = EventListApi()
+        ledger = UsageLedger(max_tokens=1000)
+        ledger.total.prompt_tokens = 1000
+        with self.assertLogs(level="WARNING"):
+            events = list(fetch_events(api, SOURCES, workers=2, ledger=ledger))
+        self.assertEqual(api.extracted, 0)
+        self.assertEqual(events, [])
+
+
+class TestSitemapSkipping(unittest.TestCase):
+    source = "https://example.com/en/events"
+    sitemap = b"""
+        <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+          <url>
+            <loc>https://example.com/en/events/ador-ia</loc>
+            <lastmod>2024-01-01</lastmod>
+          </url>
+        </urlset>
+    """
+
+    def setUp(self) -> None:
+        self.original_scheduler = http.HOST_SCHEDULER
+        http.set_host_scheduler(HostScheduler())
+
+    def tearDown(self) -> None:
+        http.set_host_scheduler(self.original_scheduler)
+
+    def fetch_sitemap(self, url: str) -> Optional[bytes]:
+        return self.sitemap if url.endswith("/sitemap.xml") else None
+
+    def test_unchanged_detail_pages_skipped(self) -> None:
+        last_run = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+        discovery = SitemapDiscovery(last_run, fetcher=self.fetch_sitemap)
+        api = ConcurrencyTrackingApi(latency=0)
+        events = list(fetch_events(api, [self.source], workers=2, discovery=discovery))
+        self.assertNotIn("https://example.com/en/events/ador-ia", api.urls)
+        self.assertEqual(len(api.urls), 1 + 9)
+        # The event on the unchanged page is still returned, as listed
+        self.assertEqual(len(events), 10)
+        self.assertIn(
+            "https://example.com/en/events/ador-ia", [event.url for event in events]
+        )
+
+    def test_nothing_skipped_on_first_run(self) -> None:
+        discovery = SitemapDiscovery(None, fetcher=self.fetch_sitemap)
+        api = MockApi[EventList]()
+        events = list(fetch_events(api, [self.source], workers=2, discovery=discovery))
+        self.assertEqual(len(events), 10)
+
+
+class TestFetchEventsAsync(unittest.TestCase):
+    def test_all_events_returned(self) -> None:
+        api = ThreadedAsyncApi(MockApi[EventList]())
+        events = asyncio.run(fetch_events_async(api, SOURCES, concurrency=4))
+        self.assertEqual(len(events), 30)
+        self.assertTrue(all(event.title for event in events))
+
+    def test_concurrency_bounded(self) -> None:
+        tracker = ConcurrencyTrackingApi(latency=0.01)
+        api = ThreadedAsyncApi(tracker)
+        asyncio.run(fetch_events_async(api, SOURCES, concurrency=3))
+        self.assertEqual(len(tracker.urls), 3 + 30)
+        self.assertGreater(tracker.max_in_flight, 1)
+        self.assertLessEqual(tracker.max_in_flight, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
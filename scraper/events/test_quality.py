@@ -0,0 +1,51 @@
+import unittest
+from typing import Optional
+
+from .event import Event, EventList
+from .quality import check_event_list
+from .structured_data import parse_date
+
+
+def event(title: Optional[str], start: Optional[str]) -> Event:
+    return Event(
+        title=title,
+        start=parse_date(start),
+        end=parse_date(None),
+        description=None,
+        url=None,
+        virtual=None,
+        location_country=None,
+        location_region=None,
+        location_city=None,
+    )
+
+
+class TestCheckEventList(unittest.TestCase):
+    def test_plausible(self) -> None:
+        response = EventList(events=[event("Talk", "2025-03-01T19:00:00-05:00")])
+        self.assertIsNone(check_event_list("<p>Talk on March 1</p>", response))
+
+    def test_no_events(self) -> None:
+        self.assertIsNone(
+            check_event_list("<p>No upcoming events</p>", EventList(events=[]))
+        )
+        self.assertEqual(
+            check_event_list("<p>Talk on March 1</p>", EventList(events=[])),
+            "no events on a page with dates",
+        )
+
+    def test_missing_fields(self) -> None:
+        self.assertEqual(
+            check_event_list(
+                "", EventList(events=[event(None, "2025-03-01T19:00:00-05:00")])
+            ),
+            "events missing titles",
+        )
+        self.assertEqual(
+            check_event_list("", EventList(events=[event("Talk", None)])),
+            "events missing dates",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
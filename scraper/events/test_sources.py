@@ -0,0 +1,18 @@
+import unittest
+
+import soupsieve
+
+from .sources import SITE_PROFILES
+
+
+class TestSiteProfiles(unittest.TestCase):
+    def test_selectors_valid(self) -> None:
+        for host, profile in SITE_PROFILES.items():
+            self.assertFalse(host.startswith("www."))
+            for selector in profile.keep + profile.drop:
+                with self.subTest(host=host, selector=selector):
+                    soupsieve.compile(selector)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import datetime
+import json
+import unittest
+from typing import Any, Dict
+
+from .structured_data import parse_structured_events
+
+
+def page(*items: Dict[str, Any]) -> str:
+    scripts = "".join(
+        f'<script type="application/ld+json">{json.dumps(item)}</script>'
+        for item in items
+    )
+    return f"<html><head>{scripts}</head><body></body></html>"
+
+
+EVENT = {
+    "@context": "https://schema.org",
+    "@type": "EducationEvent",
+    "name": "AI Governance Workshop",
+    "startDate": "2025-03-01T18:00:00-05:00",
+    "endDate": "2025-03-01T20:00:00-05:00",
+    "description": "First. Second! Third? Fourth.",
+    "url": "https://example.com/events/workshop",
+    "eventAttendanceMode": "https://schema.org/MixedEventAttendanceMode",
+    "location": {
+        "@type": "Place",
+        "name": "Hall",
+        "address": {
+            "@type": "PostalAddress",
+            "addressLocality": "Toronto",
+            "addressRegion": "ON",
+            "addressCountry": "CA",
+        },
+    },
+}
+
+
+class TestParseStructuredEvents(unittest.TestCase):
+    def test_event(self) -> None:
+        response = parse_structured_events("https://example.com", page(EVENT))
+        assert response is not None
+        [event] = response.events
+        self.assertEqual(event.title, "AI Governance Workshop")
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        self.assertEqual(event.start.date, datetime.date(2025, 3, 1))
+        self.assertEqual(event.start.time, datetime.time(18, 0, tzinfo=eastern))
+        self.assertEqual(event.end.time, datetime.time(20, 0, tzinfo=eastern))
+        self.assertEqual(event.description, "First. Second! Third?")
+        self.assertEqual(event.url, "https://example.com/events/workshop")
+        self.assertTrue(event.virtual)
+        self.assertEqual(event.location_country, "Canada")
+        self.assertEqual(event.location_region, "Ontario")
+        self.assertEqual(event.location_city, "Toronto")
+
+    def test_online_event(self) -> None:
+        online = {
+            "@type": "Event",
+            "name": "Webinar",
+            "startDate": "2025-03-01",
+            "location": {"@type": "VirtualLocation", "url": "https://zoom.us/j/1"},
+        }
+        response = parse_structured_events("https://example.com", page(online))
+        assert response is not None
+        [event] = response.events
+        self.assertTrue(event.virtual)
+        self.assertEqual(event.location_city, "online")
+        self.assertIsNone(event.start.time)
+
+    def test_incomplete_events(self) -> None:
+        """Should leave the page to the model if any event is missing its date"""
+        undated = {"@type": "Event", "name": "Someday"}
+        self.assertIsNone(
+            parse_structured_events("https://example.com", page(EVENT, undated))
+        )
+
+    def test_no_events(self) -> None:
+        organization = {"@type": "Organization", "name": "Org"}
+        self.assertIsNone(
+            parse_structured_events("https://example.com", page(organization))
+        )
+
+    def test_duplicates_merged(self) -> None:
+        response = parse_structured_events("https://example.com", page(EVENT, EVENT))
+        assert response is not None
+        self.assertEqual(len(response.events), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()